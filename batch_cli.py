@@ -0,0 +1,234 @@
+"""Headless batch valuation, e.g. for cron jobs and pipelines.
+
+    python main.py value clients/ extra.csv --format json --output values.json
+
+Every input file is a ticker,quantity csv; directories are scanned for
+*.csv files. All files share one quote fetch and one cache, so each
+symbol is requested at most once per run.
+
+Exit status: 0 when everything was valued, 1 when some files, lines or
+symbols failed, 2 when nothing could be valued at all.
+"""
+import argparse
+import asyncio
+import csv
+import glob
+import io
+import json
+import os
+import sys
+
+from fx import base_currency, fetch_rates, guess_currency, rates_for_quotes
+from metrics import PROFILERS, Profiler, enable_from_env, metrics
+from portfolio_loader import load_portfolio
+from quote_cache import QuoteCache
+from quote_provider import QuoteFetcher, get_provider
+from report import FORMATS, Valuation, render_csv, render_json, render_table
+
+
+EXIT_OK = 0
+EXIT_PARTIAL = 1
+EXIT_FAILED = 2
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="main.py value",
+        description="Value one or more portfolio files without the interactive menu.")
+    parser.add_argument("paths", nargs="+",
+                        help="portfolio csv files or directories containing them")
+    parser.add_argument("--format", choices=FORMATS, default="json",
+                        help="output format (default: json)")
+    parser.add_argument("--output", "-o", help="write results here instead of stdout")
+    parser.add_argument("--provider", help="quote provider (default: PORTFOLIO_PROVIDER or yfinance)")
+    parser.add_argument("--max-concurrency", type=int, help="quote requests in flight at once")
+    parser.add_argument("--batch-size", type=int, help="symbols per batched quote request")
+    parser.add_argument("--base-currency",
+                        help="currency of the totals (default: PORTFOLIO_BASE_CURRENCY or USD)")
+    parser.add_argument("--refresh", action="store_true", help="ignore cached prices")
+    parser.add_argument("--no-cache", action="store_true", help="do not use the quote cache")
+    parser.add_argument("--metrics",
+                        help="write timings and counters here (.json, else Prometheus text)")
+    parser.add_argument("--profile", choices=PROFILERS, default="",
+                        help="profile the run with cProfile or tracemalloc")
+    parser.add_argument("--profile-output", help="save cProfile stats to this file")
+    return parser
+
+
+# expand directories into the csv files they contain, keeping the given order
+def collect_files(paths):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, "*.csv"))))
+        else:
+            files.append(path)
+    return list(dict.fromkeys(files))
+
+
+# load every file, remembering the ones that could not be read
+def load_files(files):
+    loaded = {}
+    failures = {}
+    for path in files:
+        try:
+            loaded[path] = load_portfolio(path)
+        except Exception as e:
+            failures[path] = str(e)
+    return loaded, failures
+
+
+# value every loaded file against one shared set of quotes and exchange rates
+def value_files(loaded, failures, quotes, errors, rates, rate_errors, base):
+    results = []
+    for path, result in loaded.items():
+        results.append({
+            "path": path,
+            "valuation": Valuation(result.tickers, result.quantities, quotes, errors, rates,
+                                   base, rate_errors),
+            "malformed_lines": [{"line": line, "reason": reason} for line, reason in result.errors],
+            "malformed_line_count": result.error_count,
+            "error": None,
+        })
+    for path, error in failures.items():
+        results.append({
+            "path": path,
+            "valuation": None,
+            "malformed_lines": [],
+            "malformed_line_count": 0,
+            "error": error,
+        })
+    return results
+
+
+def write_json(results, summary, out):
+    # each file's valuation is the shared json report, nested one level down
+    encode = json.JSONEncoder().encode
+    portfolios = []
+    for result in results:
+        valuation = result["valuation"]
+        rendered = "null" if valuation is None else render_json(valuation).rstrip("\n")
+        portfolios.append(
+            (f'{{\n  "path": {encode(result["path"])},\n'
+             f'  "error": {encode(result["error"])},\n'
+             f'  "malformed_lines": {encode(result["malformed_lines"])},\n'
+             f'  "malformed_line_count": {result["malformed_line_count"]},\n'
+             f'  "valuation": ' + rendered.replace("\n", "\n  ") + "\n}").replace("\n", "\n    "))
+    out.write(f'{{\n  "summary": {encode(summary)},\n'
+              f'  "portfolios": [\n    ' + ",\n    ".join(portfolios) + "\n  ]\n}\n")
+
+
+def write_csv(results, summary, out):
+    # the shared csv report of each file, with the file's path in front of every row
+    writer = csv.writer(out)
+    empty = Valuation([], [], {}, {}, base=summary["base_currency"])
+    header = next(csv.reader(io.StringIO(render_csv(empty))))
+    writer.writerow(["path"] + header)
+    for result in results:
+        if result["valuation"] is None:
+            writer.writerow([result["path"]] + [""] * (len(header) - 1)
+                            + [f"error: {result['error']}"])
+            continue
+        rows = csv.reader(io.StringIO(render_csv(result["valuation"])))
+        next(rows)
+        writer.writerows([result["path"]] + row for row in rows)
+
+
+def write_table(results, summary, out):
+    for result in results:
+        out.write(f"== {result['path']} ==\n")
+        if result["valuation"] is None:
+            out.write(f"Error: {result['error']}\n\n")
+            continue
+        out.write(render_table(result["valuation"]) + "\n")
+    out.write(f"Total of {summary['valued']} file(s): {summary['total']:,.2f} {summary['base_currency']}\n")
+
+
+WRITERS = {
+    "table": write_table,
+    "json": write_json,
+    "csv": write_csv,
+}
+
+
+def exit_status(results):
+    valued = [r for r in results if r["error"] is None]
+    if not valued:
+        return EXIT_FAILED
+    for result in results:
+        if (result["error"] is not None or result["valuation"].failed()
+                or result["malformed_line_count"]):
+            return EXIT_PARTIAL
+    return EXIT_OK
+
+
+async def run_batch(args):
+    files = collect_files(args.paths)
+    with metrics.stage("read_portfolio"):
+        loaded, failures = load_files(files)
+
+    # the union of all symbols is fetched once for the whole run
+    symbols = list(dict.fromkeys(
+        ticker for result in loaded.values() for ticker in result.tickers))
+
+    cache = None if args.no_cache else QuoteCache.from_env()
+    fetcher = QuoteFetcher(get_provider(args.provider), max_concurrency=args.max_concurrency,
+                           batch_size=args.batch_size, cache=cache)
+    base = (args.base_currency or base_currency()).upper()
+    try:
+        with metrics.stage("fetch"):
+            # every currency's rate is fetched once, in the same run as the quotes
+            (quotes, errors), (rates, rate_errors) = await asyncio.gather(
+                fetcher.fetch_many(symbols, refresh=args.refresh),
+                fetch_rates(fetcher, {guess_currency(s) for s in symbols}, base,
+                            refresh=args.refresh))
+            rates, rate_errors = await rates_for_quotes(fetcher, symbols, quotes, base,
+                                                        args.refresh, rates, rate_errors)
+    finally:
+        fetcher.close()
+
+    with metrics.stage("value"):
+        results = value_files(loaded, failures, quotes, errors, rates, rate_errors, base)
+    summary = {
+        "files": len(files),
+        "valued": len(loaded),
+        "failed_files": len(failures),
+        "symbols": len(symbols),
+        "priced_symbols": len(quotes),
+        "base_currency": base,
+        "total": sum(r["valuation"].total for r in results if r["valuation"] is not None),
+    }
+    if cache is not None:
+        summary["cache"] = cache.stats()
+    return results, summary
+
+
+def run(argv):
+    args = build_parser().parse_args(argv)
+    metrics_path = args.metrics or enable_from_env()
+    if metrics_path:
+        metrics.enable()
+    try:
+        with Profiler(args.profile, args.profile_output):
+            results, summary = asyncio.run(run_batch(args))
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return EXIT_FAILED
+
+    writer = WRITERS[args.format]
+    with metrics.stage("render"):
+        if args.output:
+            with open(args.output, "w", newline="") as out:
+                writer(results, summary, out)
+        else:
+            writer(results, summary, sys.stdout)
+    if metrics_path:
+        metrics.write(metrics_path)
+
+    status = exit_status(results)
+    if status != EXIT_OK:
+        malformed = sum(r["malformed_line_count"] for r in results)
+        print(f"Warning: {summary['failed_files']} file(s) failed, "
+              f"{summary['symbols'] - summary['priced_symbols']} symbol(s) unpriced, "
+              f"{malformed} malformed line(s) skipped.", file=sys.stderr)
+    return status
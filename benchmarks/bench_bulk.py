@@ -0,0 +1,81 @@
+"""Time bulk valuation of many small account files (main.py bulk).
+
+Usage: python benchmarks/bench_bulk.py [--accounts 100000] [--positions 20]
+           [--symbols 5000] [--workers 1,8] [--dir accounts/]
+
+Writes --accounts ticker,quantity files into --dir (a temporary
+directory by default; an existing --dir with files in it is reused) and
+values them with the offline local provider for each --workers count.
+Parsing, fetching and the matrix-vector product are timed separately.
+"""
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bulk import BulkValuation, load_matrix, price_symbols  # noqa: E402
+from quote_provider import LocalQuoteProvider, QuoteFetcher  # noqa: E402
+
+
+def write_accounts(directory, accounts, positions, symbols, seed=0):
+    rng = random.Random(seed)
+    universe = [f"SYM{i:05d}" for i in range(symbols)]
+    for account in range(accounts):
+        lines = [f"{ticker},{rng.randint(1, 500)}"
+                 for ticker in rng.sample(universe, min(positions, symbols))]
+        with open(os.path.join(directory, f"account{account:06d}.csv"), "w") as f:
+            f.write("\n".join(lines) + "\n")
+
+
+def value(files, workers):
+    started = time.perf_counter()
+    matrix, malformed, failures = load_matrix(files, workers)
+    parsed = time.perf_counter()
+    with QuoteFetcher(LocalQuoteProvider()) as fetcher:
+        prices = asyncio.run(price_symbols(fetcher, matrix.symbols, "USD"))
+    fetched = time.perf_counter()
+    valuation = BulkValuation(matrix, prices, "USD", malformed, failures)
+    valued = time.perf_counter()
+    return valuation, (parsed - started, fetched - parsed, valued - fetched)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--accounts", type=int, default=100_000)
+    parser.add_argument("--positions", type=int, default=20, help="holdings per account")
+    parser.add_argument("--symbols", type=int, default=5000, help="distinct symbols")
+    parser.add_argument("--workers", default=f"1,{os.cpu_count() or 1}",
+                        help="comma-separated worker counts to compare")
+    parser.add_argument("--dir", help="keep the account files here")
+    args = parser.parse_args()
+
+    directory = args.dir or tempfile.mkdtemp(prefix="bench_bulk_")
+    os.makedirs(directory, exist_ok=True)
+    try:
+        files = sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                       if name.endswith(".csv"))
+        if not files:
+            started = time.perf_counter()
+            write_accounts(directory, args.accounts, args.positions, args.symbols)
+            files = sorted(os.path.join(directory, name) for name in os.listdir(directory))
+            print(f"Wrote {len(files)} account files in {time.perf_counter() - started:.1f}s")
+
+        for workers in dict.fromkeys(int(w) for w in args.workers.split(",")):
+            valuation, (parse, fetch, product) = value(files, workers)
+            accounts, symbols = valuation.matrix.shape
+            print(f"{workers:3d} worker(s): parse {parse:6.2f}s  fetch {fetch:5.2f}s  "
+                  f"value {product:5.3f}s  ({accounts} accounts x {symbols} symbols, "
+                  f"{valuation.matrix.nnz} positions, total {valuation.total:,.2f})")
+    finally:
+        if not args.dir:
+            shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
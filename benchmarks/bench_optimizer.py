@@ -0,0 +1,71 @@
+"""Time the portfolio optimizer (main.py optimize) on a large universe.
+
+Usage: python benchmarks/bench_optimizer.py [--assets 500] [--days 365]
+           [--points 25] [--max-weight 0.05]
+
+Stores --days of history for --assets symbols from the offline local
+provider in a temporary price store, then traces the frontier and the
+max-Sharpe portfolio three times: cold, warm on the same window, and
+warm after the window moved on by a day, the usual daily re-run. Every
+asset has a close on every day of the window, so all of them go into
+the solver; the run fails if any would be left out. The max-Sharpe
+portfolio usually holds only part of them.
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+from datetime import date, timedelta
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from optimizer import Optimizer, annualized_inputs  # noqa: E402
+from price_history import PriceHistoryStore  # noqa: E402
+from quote_provider import LocalQuoteProvider  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--assets", type=int, default=500)
+    parser.add_argument("--days", type=int, default=365, help="calendar days of history")
+    parser.add_argument("--points", type=int, default=25, help="frontier points")
+    parser.add_argument("--max-weight", type=float, help="cap per asset")
+    args = parser.parse_args()
+
+    symbols = [f"SYM{i:04d}" for i in range(args.assets)]
+    # today's close is never stored, the window ends with yesterday's
+    end = date.today() - timedelta(days=1)
+    start = end - timedelta(days=args.days)
+    directory = tempfile.mkdtemp(prefix="bench_optimizer_")
+    try:
+        store = PriceHistoryStore(directory)
+        store.update(LocalQuoteProvider(), symbols, start, end)
+        dates, matrix = store.price_matrix(symbols, start, end)
+        complete = int((~np.isnan(matrix).any(axis=0)).sum()) if len(dates) else 0
+        if complete < args.assets:
+            print(f"Error: only {complete} of {args.assets} assets have history over the whole "
+                  f"window, the others would not reach the solver", file=sys.stderr)
+            return 1
+        print(f"Optimizing {args.assets} assets with {len(dates)} days of history "
+              f"({dates[0]} to {dates[-1]}), {args.points} frontier points")
+        optimizer = Optimizer(max_weight=args.max_weight, points=args.points)
+        # the last run drops the oldest day and adds the newest
+        runs = (("cold", matrix[:-1]), ("warm, same data", matrix[:-1]),
+                ("warm, next day", matrix[1:]))
+        for label, prices in runs:
+            mean, cov = annualized_inputs(prices)
+            frontier = optimizer.optimize(symbols, mean, cov)
+            best = frontier.max_sharpe
+            print(f"{label:16} {frontier.seconds:6.3f}s  {frontier.iterations:6} iterations  "
+                  f"{len(frontier.symbols)} assets optimized, max Sharpe {best.sharpe:.3f} "
+                  f"holding {int((best.weights > 1e-6).sum())} of them")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,244 @@
+"""Whole valuation pipeline against a simulated-latency quote provider.
+
+Usage: python benchmarks/bench_pipeline.py [--sizes 10,100,1000,10000,100000]
+           [--concurrency 1,8,32] [--latency 0.02] [--jitter 0.01]
+           [--error-rate 0] [--output results.json] [--compare old.json]
+
+Every case parses a generated portfolio csv, fetches its quotes from
+the offline LocalQuoteProvider and values it, the same steps as
+calculate_portfolio_value() without printing. Two fetch modes are
+compared: "per-symbol" sends one request per holding (with concurrency
+1 this is the old sequential behaviour), "batched" uses fetch_many().
+Each case runs in a fresh interpreter so its peak memory is its own.
+Per-symbol cases that would take longer than --max-seconds at the given
+latency are skipped.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from portfolio_loader import load_portfolio  # noqa: E402
+from quote_provider import DEFAULT_BATCH_SIZE, LocalQuoteProvider, QuoteFetcher  # noqa: E402
+from request_scheduler import RequestScheduler  # noqa: E402
+from valuation import value_positions  # noqa: E402
+
+
+MODES = ("per-symbol", "batched")
+
+# a result slower than the baseline by more than this share is flagged
+REGRESSION_THRESHOLD = 0.10
+
+
+# peak resident memory of this process in MB, None where it cannot be read
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes on Linux
+    return peak / (1 << 20) if sys.platform == "darwin" else peak / 1024
+
+
+# a portfolio csv with `positions` distinct symbols
+def write_portfolio(path, positions, seed=0):
+    rng = random.Random(seed)
+    with open(path, "w", newline="") as f:
+        for i in range(positions):
+            f.write(f"SYM{i:06d},{rng.randint(1, 500)}\n")
+
+
+async def fetch_per_symbol(fetcher, symbols):
+    async def one(symbol):
+        try:
+            return await fetcher.fetch(symbol)
+        except Exception as e:
+            return e
+
+    quotes, errors = {}, {}
+    for symbol, result in zip(symbols, await asyncio.gather(*(one(s) for s in symbols))):
+        if isinstance(result, Exception):
+            errors[symbol] = result
+        else:
+            quotes[symbol] = result
+    return quotes, errors
+
+
+async def value_portfolio(path, fetcher, mode):
+    stages = {}
+    started = time.perf_counter()
+    result = load_portfolio(path)
+    symbols, quantities = result.tickers, result.quantities
+    stages["parse"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    if mode == "batched":
+        quotes, errors = await fetcher.fetch_many(symbols)
+    else:
+        quotes, errors = await fetch_per_symbol(fetcher, symbols)
+    stages["fetch"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    prices, values, total = value_positions(symbols, quantities, quotes)
+    stages["value"] = time.perf_counter() - started
+    return stages, total, len(errors)
+
+
+# one case in this process, returns its measurements
+def run_case(positions, mode, concurrency, latency, jitter, error_rate, seed):
+    workdir = tempfile.mkdtemp(prefix="pipeline-")
+    path = os.path.join(workdir, "portfolio.csv")
+    try:
+        write_portfolio(path, positions, seed)
+        provider = LocalQuoteProvider(latency=latency, jitter=jitter,
+                                      error_rate=error_rate, seed=seed)
+        scheduler = RequestScheduler(max_concurrency=concurrency, seed=seed)
+        with QuoteFetcher(provider, max_concurrency=concurrency,
+                          scheduler=scheduler) as fetcher:
+            started = time.perf_counter()
+            stages, total, failed = asyncio.run(value_portfolio(path, fetcher, mode))
+            wall = time.perf_counter() - started
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+        os.rmdir(workdir)
+
+    return {
+        "positions": positions,
+        "mode": mode,
+        "concurrency": concurrency,
+        "wall": wall,
+        "throughput": positions / wall if wall else None,
+        "stages": stages,
+        "failed": failed,
+        "retries": scheduler.retried,
+        "peak_rss_mb": peak_rss_mb(),
+        "total": total,
+    }
+
+
+# run one case in a fresh interpreter
+def run_isolated(positions, mode, concurrency, args):
+    command = [sys.executable, os.path.abspath(__file__), "--case",
+               f"{positions},{mode},{concurrency}",
+               "--latency", str(args.latency), "--jitter", str(args.jitter),
+               "--error-rate", str(args.error_rate), "--seed", str(args.seed)]
+    output = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+    return json.loads(output)
+
+
+# rough lower bound on a case's run time, used to skip hopeless ones
+def estimated_seconds(positions, mode, concurrency, batch_size, latency):
+    requests = positions if mode == "per-symbol" else -(-positions // batch_size)
+    return -(-requests // concurrency) * latency
+
+
+def case_key(case):
+    return (case["positions"], case["mode"], case["concurrency"])
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = {case_key(case): case for case in json.load(f)["cases"]}
+
+    regressions = 0
+    print(f"\nCompared with {baseline_path}:")
+    for case in results["cases"]:
+        old = baseline.get(case_key(case))
+        if old is None:
+            continue
+        change = case["wall"] / old["wall"] - 1
+        flag = ""
+        if change > REGRESSION_THRESHOLD:
+            flag = "  <- slower"
+            regressions += 1
+        print(f"  {case['positions']:>7} {case['mode']:10} x{case['concurrency']:<4}"
+              f" {old['wall']:9.3f}s -> {case['wall']:9.3f}s  ({change * 100:+.1f}%){flag}")
+    print(f"{regressions} case(s) more than {REGRESSION_THRESHOLD:.0%} slower")
+    return regressions
+
+
+def parse_list(text):
+    return [int(part) for part in text.split(",") if part]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=parse_list, default=[10, 100, 1000, 10_000, 100_000])
+    parser.add_argument("--concurrency", type=parse_list, default=[1, 8, 32])
+    parser.add_argument("--modes", default=",".join(MODES))
+    parser.add_argument("--latency", type=float, default=0.02,
+                        help="seconds per simulated request (default: 0.02)")
+    parser.add_argument("--jitter", type=float, default=0.01,
+                        help="extra random delay per request, up to this many seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="share of requests that fail and are retried")
+    parser.add_argument("--max-seconds", type=float, default=30.0,
+                        help="skip cases estimated to take longer than this")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="a previous --output file to compare against")
+    parser.add_argument("--case", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case:
+        positions, mode, concurrency = args.case.split(",")
+        result = run_case(int(positions), mode, int(concurrency), args.latency,
+                          args.jitter, args.error_rate, args.seed)
+        json.dump(result, sys.stdout)
+        return 0
+
+    modes = [mode for mode in args.modes.split(",") if mode]
+    for mode in modes:
+        if mode not in MODES:
+            parser.error(f"unknown mode '{mode}', choose from {', '.join(MODES)}")
+
+    results = {
+        "python": sys.version.split()[0],
+        "platform": sys.platform,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "latency": args.latency,
+        "jitter": args.jitter,
+        "error_rate": args.error_rate,
+        "cases": [],
+    }
+    # the fetcher in each case reads the same variable
+    batch_size = int(os.environ.get("PORTFOLIO_BATCH_SIZE", DEFAULT_BATCH_SIZE))
+    print(f"latency {args.latency * 1000:g} ms + up to {args.jitter * 1000:g} ms jitter, "
+          f"error rate {args.error_rate:g}, batch size {batch_size}")
+    print(f"  {'positions':>9} {'mode':10} {'conc':>4} {'wall':>9} {'pos/s':>11}"
+          f" {'fetch':>9} {'peak MB':>8} {'failed':>6}")
+    for positions in args.sizes:
+        for mode in modes:
+            for concurrency in args.concurrency:
+                estimate = estimated_seconds(positions, mode, concurrency, batch_size, args.latency)
+                if estimate > args.max_seconds:
+                    print(f"  {positions:>9} {mode:10} {concurrency:>4}   skipped"
+                          f" (at least {estimate:.0f}s)")
+                    continue
+                case = run_isolated(positions, mode, concurrency, args)
+                results["cases"].append(case)
+                peak = f"{case['peak_rss_mb']:8.1f}" if case["peak_rss_mb"] else f"{'-':>8}"
+                print(f"  {positions:>9} {mode:10} {concurrency:>4} {case['wall']:8.3f}s"
+                      f" {case['throughput']:11,.0f} {case['stages']['fetch']:8.3f}s"
+                      f" {peak} {case['failed']:>6}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+    if args.compare:
+        return 1 if compare(results, args.compare) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
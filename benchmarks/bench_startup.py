@@ -0,0 +1,113 @@
+"""Start-up time of main.py: to the first menu and to the first valuation.
+
+Usage: python benchmarks/bench_startup.py [--runs 5] [--output startup.json]
+
+Each measurement starts a fresh interpreter on a scratch copy of the
+program. "Cold" runs use a new copy, so none of the program's modules
+have been compiled yet; "warm" runs reuse a copy whose bytecode cache
+was filled by an earlier run.
+The first valuation uses the offline local provider and the sample
+portfolio, so no network time is included.
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MENU_MARKER = b"Enter your choice"
+VALUATION_MARKER = b"Total Portfolio Value"
+
+
+# a scratch copy of the program's sources and the sample portfolio
+def make_workdir():
+    workdir = tempfile.mkdtemp(prefix="startup-")
+    for name in os.listdir(ROOT):
+        if name.endswith(".py") or name == "sample.csv":
+            shutil.copy(os.path.join(ROOT, name), workdir)
+    return workdir
+
+
+# seconds from process start until `marker` shows up on stdout
+def time_to_marker(stdin_text, marker, workdir, env):
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(workdir, "main.py")],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+        cwd=workdir, env=env)
+    process.stdin.write(stdin_text)
+    process.stdin.close()
+
+    seen = b""
+    elapsed = None
+    while True:
+        chunk = process.stdout.read1(65536)
+        if not chunk:
+            break
+        seen = (seen + chunk)[-4096:]
+        if elapsed is None and marker in seen:
+            elapsed = time.perf_counter() - start
+    process.wait()
+    if elapsed is None:
+        raise RuntimeError(f"main.py exited without printing {marker!r}")
+    return elapsed
+
+
+def measure(runs, cold, marker, stdin_text):
+    env = dict(os.environ, PORTFOLIO_PROVIDER="local", PORTFOLIO_CACHE_PATH="")
+    times = []
+    workdir = None
+    try:
+        # warm runs reuse one copy, primed by an unmeasured first run
+        total_runs = runs if cold else runs + 1
+        for run in range(total_runs):
+            if cold or workdir is None:
+                if workdir is not None:
+                    shutil.rmtree(workdir, ignore_errors=True)
+                workdir = make_workdir()
+            for leftover in ("portfolio.db", "portfolio.csv"):
+                if os.path.exists(os.path.join(workdir, leftover)):
+                    os.remove(os.path.join(workdir, leftover))
+            elapsed = time_to_marker(stdin_text, marker, workdir, env)
+            if cold or run > 0:
+                times.append(elapsed)
+    finally:
+        if workdir is not None:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    cases = {
+        "menu": (MENU_MARKER, b"q\n"),
+        "first_valuation": (VALUATION_MARKER, b"d\nq\n"),
+    }
+    results = {"python": sys.version.split()[0], "runs": args.runs}
+    for name, (marker, stdin_text) in cases.items():
+        for cold in (True, False):
+            label = f"{name}_{'cold' if cold else 'warm'}"
+            times = measure(args.runs, cold, marker, stdin_text)
+            results[label] = {"median": statistics.median(times), "min": min(times), "max": max(times)}
+            print(f"  {label:24} median {statistics.median(times) * 1000:8.1f} ms"
+                  f"  (min {min(times) * 1000:.1f}, max {max(times) * 1000:.1f})")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Compare the old per-row valuation path with the aggregated one the app uses.
+
+Usage: python benchmarks/bench_valuation.py [--rows 100000] [--symbols 500]
+
+Both paths use the offline LocalQuoteProvider with no latency, so the
+numbers show the per-row overhead (iterrows, one fetch per row) rather
+than network time.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from quote_provider import LocalQuoteProvider, QuoteFetcher  # noqa: E402
+from report import fetch_valuation  # noqa: E402
+from valuation import holdings_lists  # noqa: E402
+
+
+# a heavily duplicated portfolio: `rows` entries over `symbols` tickers
+def make_portfolio(rows, symbols, seed=0):
+    rng = np.random.default_rng(seed)
+    tickers = np.array([f"SYM{i:05d}" for i in range(symbols)])
+    return pd.DataFrame({
+        'ticker': tickers[rng.integers(0, symbols, rows)],
+        'quantity': rng.integers(1, 500, rows),
+    })
+
+
+# the original approach: one fetch task per row, summed as they finish
+async def per_row_value(dataFrame, fetcher):
+    tasks = []
+    for index, row in dataFrame.iterrows():
+        tasks.append(asyncio.create_task(fetcher.fetch(row['ticker'])))
+    total = 0
+    for (index, row), task in zip(dataFrame.iterrows(), tasks):
+        quote = await task
+        total += quote.price * row['quantity']
+    return total
+
+
+# the app's path: one row per symbol, one batched fetch, a report.Valuation
+async def aggregated_value(dataFrame, fetcher):
+    symbols, quantities = holdings_lists(dataFrame)
+    valuation = await fetch_valuation(fetcher, symbols, quantities)
+    return valuation.total
+
+
+def timed(coro_fn, dataFrame, fetcher):
+    start = time.perf_counter()
+    total = asyncio.run(coro_fn(dataFrame, fetcher))
+    return time.perf_counter() - start, total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--symbols", type=int, default=500)
+    args = parser.parse_args()
+
+    dataFrame = make_portfolio(args.rows, args.symbols)
+    print(f"Portfolio: {len(dataFrame)} rows, {dataFrame['ticker'].nunique()} unique symbols")
+
+    with QuoteFetcher(LocalQuoteProvider()) as fetcher:
+        old_time, old_total = timed(per_row_value, dataFrame, fetcher)
+        new_time, new_total = timed(aggregated_value, dataFrame, fetcher)
+
+    print(f"  per-row path:    {old_time:8.3f}s  total ${old_total:,.2f}")
+    print(f"  aggregated path: {new_time:8.3f}s  total ${new_total:,.2f}")
+    print(f"  speedup:         {old_time / new_time:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
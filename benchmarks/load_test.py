@@ -0,0 +1,225 @@
+"""Load test for the valuation service (python main.py serve).
+
+Usage: python benchmarks/load_test.py [--clients 2000] [--requests 10000]
+           [--positions 20] [--universe 500] [--latency 0.05]
+           [--url http://127.0.0.1:8080] [--output load.json]
+
+Without --url a service is started on a free port with the offline
+local provider and --latency per simulated quote request, so the test
+needs no network. --clients connections post randomly drawn portfolios
+over keep-alive connections until --requests valuations are done. The
+report shows throughput, latency percentiles, the answers by status,
+and how many symbol fetches the service saved by coalescing and its
+shared cache.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+from urllib.parse import urlsplit
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# portfolios are drawn from a universe with a few popular symbols, like real ones
+SUFFIXES = ("", "", "", "", ".AX", ".L", ".TO")
+
+
+def make_universe(size, seed):
+    rng = random.Random(seed)
+    return [f"T{i:05d}{rng.choice(SUFFIXES)}" for i in range(size)]
+
+
+def make_payload(universe, positions, rng):
+    # weighted towards the start of the universe so clients overlap
+    picks = {universe[min(int(rng.paretovariate(1.2)) - 1, len(universe) - 1)]
+             for _ in range(positions)}
+    while len(picks) < positions:
+        picks.add(rng.choice(universe))
+    holdings = [[symbol, rng.randint(1, 500)] for symbol in picks]
+    return json.dumps({"holdings": holdings}).encode()
+
+
+async def request(reader, writer, host, path, body=None):
+    method = "POST" if body is not None else "GET"
+    body = body or b""
+    writer.write(f"{method} {path} HTTP/1.1\r\nHost: {host}\r\n"
+                 f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n"
+                 .encode() + body)
+    await writer.drain()
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("connection closed by the service")
+    status = int(status_line.split()[1])
+    length = 0
+    close = False
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        if name.lower() == "content-length":
+            length = int(value)
+        elif name.lower() == "connection" and value.strip().lower() == "close":
+            close = True
+    data = await reader.readexactly(length)
+    return status, data, close
+
+
+async def client(host, port, universe, positions, queue, results, seed):
+    rng = random.Random(seed)
+    reader = writer = None
+    while True:
+        try:
+            queue.get_nowait()
+        except asyncio.QueueEmpty:
+            break
+        if writer is None:
+            reader, writer = await asyncio.open_connection(host, port)
+        payload = make_payload(universe, positions, rng)
+        started = time.perf_counter()
+        try:
+            status, data, close = await request(reader, writer, host, "/value", payload)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            results.append((None, time.perf_counter() - started))
+            writer.close()
+            writer = None
+            continue
+        results.append((status, time.perf_counter() - started))
+        if close:
+            writer.close()
+            writer = None
+    if writer is not None:
+        writer.close()
+
+
+async def fetch_json(host, port, path):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        status, data, close = await request(reader, writer, host, path)
+    finally:
+        writer.close()
+    return json.loads(data)
+
+
+async def drive(host, port, args):
+    universe = make_universe(args.universe, args.seed)
+    queue = asyncio.Queue()
+    for _ in range(args.requests):
+        queue.put_nowait(None)
+    results = []
+    before = await fetch_json(host, port, "/stats")
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client(host, port, universe, args.positions, queue, results,
+                                  args.seed + i)
+                           for i in range(args.clients)))
+    wall = time.perf_counter() - started
+    after = await fetch_json(host, port, "/stats")
+    return results, wall, before, after
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def start_service(args):
+    env = dict(os.environ, PORTFOLIO_PROVIDER="local")
+    command = [sys.executable, os.path.join(ROOT, "main.py"), "serve", "--port", "0",
+               "--latency", str(args.latency), "--max-active", str(args.max_active),
+               "--max-queue", str(args.max_queue)]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True, env=env, cwd=ROOT)
+    line = process.stdout.readline()
+    if "http://" not in line:
+        process.kill()
+        raise RuntimeError(f"the service did not start: {line!r}")
+    return process, urlsplit(line.split()[3])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", help="an already running service (default: start one)")
+    parser.add_argument("--clients", type=int, default=2000, help="concurrent connections")
+    parser.add_argument("--requests", type=int, default=10_000, help="valuations in total")
+    parser.add_argument("--positions", type=int, default=20, help="holdings per portfolio")
+    parser.add_argument("--universe", type=int, default=500, help="distinct symbols")
+    parser.add_argument("--latency", type=float, default=0.05,
+                        help="simulated seconds per quote request of a started service")
+    parser.add_argument("--max-active", type=int, default=256,
+                        help="--max-active of a started service")
+    parser.add_argument("--max-queue", type=int, default=4096,
+                        help="--max-queue of a started service")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    sys.path.insert(0, ROOT)
+    from service import raise_file_limit
+    raise_file_limit()
+
+    process = None
+    if args.url:
+        url = urlsplit(args.url)
+    else:
+        process, url = start_service(args)
+    try:
+        results, wall, before, after = asyncio.run(drive(url.hostname, url.port, args))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    latencies = sorted(elapsed for status, elapsed in results if status == 200)
+    statuses = {}
+    for status, elapsed in results:
+        key = str(status) if status is not None else "connection error"
+        statuses[key] = statuses.get(key, 0) + 1
+    requested = after["symbols_requested"] - before["symbols_requested"]
+    coalesced = after["symbols_coalesced"] - before["symbols_coalesced"]
+    report = {
+        "clients": args.clients,
+        "requests": len(results),
+        "positions": args.positions,
+        "wall": wall,
+        "throughput": len(results) / wall if wall else None,
+        "statuses": statuses,
+        "latency": {
+            "p50": percentile(latencies, 0.50),
+            "p95": percentile(latencies, 0.95),
+            "p99": percentile(latencies, 0.99),
+            "max": latencies[-1] if latencies else None,
+            "mean": statistics.fmean(latencies) if latencies else None,
+        },
+        "symbols_requested": requested,
+        "symbols_coalesced": coalesced,
+        "provider_calls": after["scheduler"]["calls"] - before["scheduler"]["calls"],
+        "cache": after["cache"],
+    }
+
+    print(f"{report['requests']} valuations from {args.clients} clients in {wall:.2f}s "
+          f"({report['throughput']:,.0f}/s)")
+    print("  answers:  " + ", ".join(f"{count} x {status}" for status, count in statuses.items()))
+    if latencies:
+        latency = report["latency"]
+        print(f"  latency:  p50 {latency['p50'] * 1000:.0f} ms, p95 {latency['p95'] * 1000:.0f} ms,"
+              f" p99 {latency['p99'] * 1000:.0f} ms, max {latency['max'] * 1000:.0f} ms")
+    print(f"  symbols:  {requested} passed to the fetcher, {coalesced} joined another request;"
+          f" {report['provider_calls']} provider calls")
+    if report["cache"]:
+        print(f"  cache:    {report['cache']['hits']} hits, {report['cache']['misses']} misses")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,368 @@
+"""Bulk valuation of many client portfolios as one sparse holdings matrix.
+
+    python main.py bulk clients/ --output totals.csv --workers 8
+
+Every account is a ticker,quantity csv like portfolio.csv; directories
+are scanned for *.csv files. The files are parsed in shards on a process
+pool into an accounts x symbols holdings matrix that stores only the
+held positions. The union of symbols is fetched once, and all account
+totals come from a single sparse matrix-vector product with the prices
+in the base currency. The output has one line per account.
+
+Exit status as for `main.py value`: 0 when everything was valued, 1 when
+some files, lines or positions failed, 2 when nothing could be valued.
+"""
+import argparse
+import asyncio
+import csv
+import io
+import json
+import math
+import os
+import sys
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+from batch_cli import EXIT_FAILED, EXIT_OK, EXIT_PARTIAL, collect_files
+from fx import base_currency, conversion_factors, currency_of, fetch_rates, guess_currency
+from fx import rates_for_quotes
+from metrics import PROFILERS, Profiler, enable_from_env, metrics
+from portfolio_loader import parse_row
+from quote_cache import QuoteCache
+from quote_provider import QuoteFetcher, get_provider
+
+
+# shards handed to each worker, more than one so a slow shard does not hold up the rest
+SHARDS_PER_WORKER = 8
+
+# fewer files than this are parsed in-process, a pool costs more than it saves
+MIN_POOL_FILES = 2000
+
+
+class HoldingsMatrix:
+    """Quantities held, as a sparse accounts x symbols matrix.
+
+    Kept in coordinate form: entry k is quantities[k] shares of
+    symbols[cols[k]] in accounts[rows[k]]. Repeated (row, col) pairs add
+    up, so a ticker listed twice in one file needs no merging.
+    """
+
+    __slots__ = ("accounts", "symbols", "rows", "cols", "quantities")
+
+    def __init__(self, accounts, symbols, rows, cols, quantities):
+        self.accounts = accounts
+        self.symbols = symbols
+        self.rows = rows
+        self.cols = cols
+        self.quantities = quantities
+
+    @property
+    def shape(self):
+        return len(self.accounts), len(self.symbols)
+
+    @property
+    def nnz(self):
+        return len(self.quantities)
+
+    def dot(self, vector):
+        """Matrix-vector product: per account, the sum of quantity * vector[symbol]."""
+        import numpy as np
+        return np.bincount(self.rows, weights=self.quantities * vector[self.cols],
+                           minlength=len(self.accounts))
+
+    def count(self, mask):
+        """Positions per account whose symbol is set in the boolean `mask`."""
+        import numpy as np
+        return np.bincount(self.rows[mask[self.cols]], minlength=len(self.accounts))
+
+
+# (tickers, quantities) of a file whose every line is a valid ticker,quantity
+# pair, converted a whole column at a time; None when any line is not
+def _parse_plain(text):
+    lines = text.splitlines()
+    # exactly one comma on every line, so fields cannot shift between lines
+    if set(map(str.count, lines, repeat(","))) != {1}:
+        return None
+    fields = ",".join(lines).split(",")
+    tickers = list(map(str.strip, fields[0::2]))
+    try:
+        quantities = list(map(float, fields[1::2]))
+    except ValueError:
+        return None
+    if not all(tickers) or not all(map((0.0).__lt__, quantities)):
+        return None
+    return tickers, quantities
+
+
+def _parse_lines(text):
+    """(tickers, quantities, malformed count) for the text of one file."""
+    if '"' not in text:
+        parsed = _parse_plain(text)
+        if parsed is not None:
+            return parsed[0], parsed[1], 0
+
+    # quoted fields, blank or malformed lines: row by row with the loader's checks
+    tickers = []
+    quantities = []
+    bad = 0
+    for fields in csv.reader(io.StringIO(text)):
+        # blank lines are skipped, as load_portfolio does
+        if not fields or fields == [""]:
+            continue
+        try:
+            ticker, quantity = parse_row(fields)
+        except ValueError:
+            bad += 1
+            continue
+        tickers.append(ticker)
+        quantities.append(quantity)
+    return tickers, quantities, bad
+
+
+# parse one shard of files; runs in a worker process, so it returns plain
+# arrays that pickle compactly, with columns numbered within the shard
+def parse_shard(paths):
+    tickers = []
+    quantities = array("d")
+    counts = array("i")     # positions per file, in file order
+    malformed = array("i")
+    failures = {}
+    for account, path in enumerate(paths):
+        try:
+            with open(path, newline="") as f:
+                file_tickers, amounts, bad = _parse_lines(f.read())
+        except (OSError, UnicodeDecodeError, csv.Error) as e:
+            failures[account] = str(e)
+            file_tickers, amounts, bad = (), (), 0
+        tickers.extend(file_tickers)
+        quantities.extend(amounts)
+        counts.append(len(file_tickers))
+        malformed.append(bad)
+    # symbols are numbered once for the whole shard, in first-seen order
+    symbols = {symbol: i for i, symbol in enumerate(dict.fromkeys(tickers))}
+    cols = array("i", map(symbols.__getitem__, tickers))
+    return list(symbols), counts, cols, quantities, malformed, failures
+
+
+def _shards(files, workers):
+    size = max(1, math.ceil(len(files) / (workers * SHARDS_PER_WORKER)))
+    return [files[start:start + size] for start in range(0, len(files), size)]
+
+
+def load_matrix(files, workers=None):
+    """Parse `files` into a HoldingsMatrix with one row per file.
+
+    Returns (matrix, malformed line count per account, {account: error})
+    for the files that could not be read. `workers` None uses every core.
+    """
+    import numpy as np
+    if workers is None:
+        workers = os.cpu_count() or 1
+    shards = _shards(files, workers)
+    if workers > 1 and len(files) >= MIN_POOL_FILES:
+        with ProcessPoolExecutor(max_workers=min(workers, len(shards))) as pool:
+            parsed = list(pool.map(parse_shard, shards))
+    else:
+        parsed = [parse_shard(shard) for shard in shards]
+
+    # number the symbols across shards, and move each shard's rows past the earlier ones
+    index = {}
+    rows, cols, quantities, malformed = [], [], [], []
+    failures = {}
+    offset = 0
+    for shard, (symbols, shard_counts, shard_cols, shard_quantities, shard_malformed,
+                shard_failures) in zip(shards, parsed):
+        mapping = np.array([index.setdefault(symbol, len(index)) for symbol in symbols],
+                           dtype=np.intp)
+        rows.append(np.repeat(np.arange(offset, offset + len(shard), dtype=np.intp),
+                              np.frombuffer(shard_counts, dtype=np.intc)))
+        cols.append(mapping[np.frombuffer(shard_cols, dtype=np.intc)])
+        quantities.append(np.frombuffer(shard_quantities, dtype=float))
+        malformed.append(np.frombuffer(shard_malformed, dtype=np.intc))
+        failures.update({offset + account: error for account, error in shard_failures.items()})
+        offset += len(shard)
+
+    def joined(parts, dtype):
+        return np.concatenate(parts) if parts else np.zeros(0, dtype=dtype)
+
+    matrix = HoldingsMatrix(list(files), list(index), joined(rows, np.intp),
+                            joined(cols, np.intp), joined(quantities, float))
+    return matrix, joined(malformed, np.intc), failures
+
+
+class BulkValuation:
+    """Per-account totals in the base currency.
+
+    `totals` leave out positions without a price or exchange rate; they
+    are counted in `failed`. Accounts whose file could not be read have
+    a NaN total and an entry in `failures`.
+    """
+
+    def __init__(self, matrix, prices, base, malformed, failures):
+        import numpy as np
+        unpriced = np.isnan(prices)
+        self.matrix = matrix
+        self.base = base
+        self.totals = matrix.dot(np.where(unpriced, 0.0, prices))
+        self.positions = np.bincount(matrix.rows, minlength=len(matrix.accounts))
+        self.failed = matrix.count(unpriced)
+        self.malformed = malformed
+        self.failures = failures
+        if failures:
+            self.totals[list(failures)] = np.nan
+        self.unpriced = [symbol for symbol, missing in zip(matrix.symbols, unpriced) if missing]
+
+    @property
+    def total(self):
+        import numpy as np
+        return float(np.nansum(self.totals))
+
+    def rows(self):
+        """(account, positions, total, failed, malformed, error) per account."""
+        failures = self.failures
+        return ((account, positions, total, failed, malformed, failures.get(i))
+                for i, (account, positions, total, failed, malformed) in enumerate(zip(
+                    self.matrix.accounts, self.positions.tolist(), self.totals.tolist(),
+                    self.failed.tolist(), self.malformed.tolist())))
+
+
+async def price_symbols(fetcher, symbols, base, refresh=False):
+    """Prices of `symbols` in `base`, NaN where there is no price or rate.
+
+    The quotes and every currency's exchange rate are fetched in one run.
+    """
+    import numpy as np
+    from valuation import price_vector
+    (quotes, errors), (rates, rate_errors) = await asyncio.gather(
+        fetcher.fetch_many(symbols, refresh=refresh),
+        fetch_rates(fetcher, {guess_currency(s) for s in symbols}, base, refresh=refresh))
+    rates, rate_errors = await rates_for_quotes(fetcher, symbols, quotes, base, refresh,
+                                                rates, rate_errors)
+    factors = conversion_factors([currency_of(s, quotes.get(s)) for s in symbols], rates)
+    return price_vector(symbols, quotes) * np.asarray(factors, dtype=float)
+
+
+def render_csv(valuation):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(["account", "positions", f"total_{valuation.base.lower()}",
+                     "failed_positions", "malformed_lines", "error"])
+    writer.writerows(
+        (account, positions, "" if math.isnan(total) else f"{total:.2f}", failed, malformed,
+         error or "")
+        for account, positions, total, failed, malformed, error in valuation.rows())
+    writer.writerow(["TOTAL", valuation.matrix.nnz, f"{valuation.total:.2f}",
+                     int(valuation.failed.sum()), int(valuation.malformed.sum()), ""])
+    return buffer.getvalue()
+
+
+def render_json(valuation):
+    # one account per line with the C encoder, as report.render_json does
+    encode = json.JSONEncoder().encode
+    rows = ",\n    ".join(
+        encode({"account": account, "positions": positions,
+                "total": None if math.isnan(total) else total,
+                "failed_positions": failed, "malformed_lines": malformed, "error": error})
+        for account, positions, total, failed, malformed, error in valuation.rows())
+    return (f'{{\n  "base_currency": {encode(valuation.base)},\n'
+            f'  "total": {encode(valuation.total)},\n'
+            f'  "accounts": {len(valuation.matrix.accounts)},\n'
+            f'  "positions": {valuation.matrix.nnz},\n'
+            f'  "symbols": {len(valuation.matrix.symbols)},\n'
+            f'  "unpriced_symbols": {encode(valuation.unpriced)},\n'
+            f'  "totals": [\n    {rows}\n  ]\n}}\n')
+
+
+RENDERERS = {
+    "csv": render_csv,
+    "json": render_json,
+}
+
+
+def exit_status(valuation):
+    if len(valuation.failures) == len(valuation.matrix.accounts):
+        return EXIT_FAILED
+    if valuation.failures or valuation.unpriced or valuation.malformed.any():
+        return EXIT_PARTIAL
+    return EXIT_OK
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="main.py bulk",
+        description="Value many account portfolio files at once and list each account's total.")
+    parser.add_argument("paths", nargs="+",
+                        help="account csv files or directories containing them")
+    parser.add_argument("--format", choices=tuple(RENDERERS), default="csv",
+                        help="output format (default: csv)")
+    parser.add_argument("--output", "-o", help="write the totals here instead of stdout")
+    parser.add_argument("--workers", type=int,
+                        help="processes parsing the files (default: one per core)")
+    parser.add_argument("--provider", help="quote provider (default: PORTFOLIO_PROVIDER or yfinance)")
+    parser.add_argument("--max-concurrency", type=int, help="quote requests in flight at once")
+    parser.add_argument("--batch-size", type=int, help="symbols per batched quote request")
+    parser.add_argument("--base-currency",
+                        help="currency of the totals (default: PORTFOLIO_BASE_CURRENCY or USD)")
+    parser.add_argument("--refresh", action="store_true", help="ignore cached prices")
+    parser.add_argument("--no-cache", action="store_true", help="do not use the quote cache")
+    parser.add_argument("--metrics",
+                        help="write timings and counters here (.json, else Prometheus text)")
+    parser.add_argument("--profile", choices=PROFILERS, default="",
+                        help="profile the run with cProfile or tracemalloc")
+    parser.add_argument("--profile-output", help="save cProfile stats to this file")
+    return parser
+
+
+async def run_bulk(args):
+    files = collect_files(args.paths)
+    if not files:
+        raise ValueError("no portfolio files found")
+    with metrics.stage("read_portfolio"):
+        matrix, malformed, failures = load_matrix(files, args.workers)
+
+    cache = None if args.no_cache else QuoteCache.from_env()
+    fetcher = QuoteFetcher(get_provider(args.provider), max_concurrency=args.max_concurrency,
+                           batch_size=args.batch_size, cache=cache)
+    base = (args.base_currency or base_currency()).upper()
+    try:
+        with metrics.stage("fetch"):
+            prices = await price_symbols(fetcher, matrix.symbols, base, args.refresh)
+    finally:
+        fetcher.close()
+
+    with metrics.stage("value"):
+        return BulkValuation(matrix, prices, base, malformed, failures)
+
+
+def run(argv):
+    args = build_parser().parse_args(argv)
+    metrics_path = args.metrics or enable_from_env()
+    if metrics_path:
+        metrics.enable()
+    try:
+        with Profiler(args.profile, args.profile_output):
+            valuation = asyncio.run(run_bulk(args))
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return EXIT_FAILED
+
+    with metrics.stage("render"):
+        text = RENDERERS[args.format](valuation)
+        if args.output:
+            with open(args.output, "w", newline="") as out:
+                out.write(text)
+        else:
+            sys.stdout.write(text)
+    if metrics_path:
+        metrics.write(metrics_path)
+
+    accounts, symbols = valuation.matrix.shape
+    print(f"Valued {accounts} account(s), {valuation.matrix.nnz} position(s) over "
+          f"{symbols} symbol(s): {valuation.total:,.2f} {valuation.base}", file=sys.stderr)
+    status = exit_status(valuation)
+    if status != EXIT_OK:
+        print(f"Warning: {len(valuation.failures)} file(s) failed, "
+              f"{len(valuation.unpriced)} symbol(s) unpriced, "
+              f"{int(valuation.malformed.sum())} malformed line(s) skipped.", file=sys.stderr)
+    return status
@@ -0,0 +1,199 @@
+"""Currency detection and conversion into a base currency.
+
+Every position is valued in the currency its price is quoted in and
+converted into the base currency (PORTFOLIO_BASE_CURRENCY, USD by
+default). Exchange rates are ordinary quotes for pair symbols such as
+AUDUSD=X, so they go through the same fetcher: one batched request per
+run for all currencies involved, and the quote cache's TTL keeps them
+for later runs.
+"""
+import math
+import os
+
+from metrics import metrics
+from quote_provider import QuoteError
+from valuation import SMALL_PORTFOLIO
+
+
+DEFAULT_BASE = "USD"
+
+# symbols without an exchange suffix are US listings
+DEFAULT_CURRENCY = "USD"
+
+# exchange suffix -> currency, for quotes that do not report a currency
+SUFFIX_CURRENCIES = {
+    "AX": "AUD", "NZ": "NZD", "TO": "CAD", "V": "CAD", "NE": "CAD",
+    "L": "GBp", "IL": "GBP",
+    "DE": "EUR", "F": "EUR", "PA": "EUR", "AS": "EUR", "BR": "EUR", "MI": "EUR",
+    "MC": "EUR", "LS": "EUR", "VI": "EUR", "HE": "EUR", "IR": "EUR",
+    "SW": "CHF", "ST": "SEK", "OL": "NOK", "CO": "DKK",
+    "T": "JPY", "HK": "HKD", "SS": "CNY", "SZ": "CNY", "KS": "KRW", "KQ": "KRW",
+    "TW": "TWD", "SI": "SGD", "NS": "INR", "BO": "INR", "JO": "ZAc",
+    "SA": "BRL", "MX": "MXN", "TA": "ILA",
+}
+
+# prices quoted in a minor unit: code -> (currency, units per minor unit)
+MINOR_UNITS = {
+    "GBp": ("GBP", 0.01),
+    "GBX": ("GBP", 0.01),
+    "ZAc": ("ZAR", 0.01),
+    "ILA": ("ILS", 0.01),
+}
+
+
+def base_currency():
+    return os.environ.get("PORTFOLIO_BASE_CURRENCY", DEFAULT_BASE).upper()
+
+
+# currency of a symbol from its exchange suffix
+def guess_currency(symbol):
+    if symbol.endswith("=X"):
+        # an exchange rate pair such as AUDUSD=X is quoted in its second currency
+        return symbol[3:6] if len(symbol) == 8 else DEFAULT_CURRENCY
+    if "." in symbol:
+        return SUFFIX_CURRENCIES.get(symbol.rsplit(".", 1)[1].upper(), DEFAULT_CURRENCY)
+    return DEFAULT_CURRENCY
+
+
+# the currency a quote is priced in
+def currency_of(symbol, quote=None):
+    if quote is not None and quote.currency:
+        return quote.currency
+    return guess_currency(symbol)
+
+
+# (currency, scale) with minor units such as pence turned into the main unit
+def split_minor(currency):
+    if currency in MINOR_UNITS:
+        return MINOR_UNITS[currency]
+    return currency.upper(), 1.0
+
+
+def pair_symbol(currency, base):
+    return f"{currency}{base}=X"
+
+
+def rate_pairs(symbols, base):
+    """{currency: pair symbol} for the currencies `symbols` trade in, other than `base`.
+
+    Currencies come from the exchange suffixes, for callers that work
+    from stored prices and have no quotes to ask.
+    """
+    majors = {split_minor(guess_currency(symbol))[0] for symbol in symbols}
+    return {currency: pair_symbol(currency, base) for currency in sorted(majors - {base})}
+
+
+async def fetch_rates(fetcher, currencies, base, refresh=False):
+    """Rates that turn one unit of each currency into `base`.
+
+    Returns (rates, errors) keyed by currency; minor-unit codes are
+    looked up under their main currency. All pairs go in one fetch_many
+    call, so each currency costs one rate lookup however many positions
+    use it.
+    """
+    needed = sorted({split_minor(currency)[0] for currency in currencies} - {base})
+    rates = {base: 1.0}
+    if not needed:
+        return rates, {}
+    metrics.count("fx_rate_lookups_total", len(needed))
+    pairs = {pair_symbol(currency, base): currency for currency in needed}
+    quotes, pair_errors = await fetcher.fetch_many(list(pairs), refresh=refresh)
+
+    errors = {}
+    for pair, currency in pairs.items():
+        quote = quotes.get(pair)
+        if quote is not None and quote.price:
+            rates[currency] = float(quote.price)
+        else:
+            errors[currency] = pair_errors.get(
+                pair, QuoteError(f"No {currency}/{base} exchange rate available"))
+    return rates, errors
+
+
+async def rates_for_quotes(fetcher, symbols, quotes, base, refresh=False, rates=None,
+                           errors=None):
+    """Exchange rates for every currency the quoted symbols are priced in.
+
+    `rates` and `errors` from an earlier fetch_rates() call (for example
+    one made from the symbols' suffixes before the quotes arrived) are
+    extended with the currencies that are still missing.
+    """
+    rates = dict(rates or {base: 1.0})
+    errors = dict(errors or {})
+    currencies = {currency_of(symbol, quotes.get(symbol)) for symbol in symbols}
+    missing = {currency for currency in currencies
+               if split_minor(currency)[0] not in rates and split_minor(currency)[0] not in errors}
+    if missing:
+        more_rates, more_errors = await fetch_rates(fetcher, missing, base, refresh=refresh)
+        rates.update(more_rates)
+        errors.update(more_errors)
+    return rates, errors
+
+
+# (unique currencies, index of each position's currency in them)
+def _factorize(currencies):
+    index = {}
+    codes = [index.setdefault(currency, len(index)) for currency in currencies]
+    return list(index), codes
+
+
+# per-position multipliers from the quoted currency into the base, NaN without a rate
+def conversion_factors(currencies, rates):
+    unique, codes = _factorize(currencies)
+    table = []
+    for currency in unique:
+        major, scale = split_minor(currency)
+        table.append(scale * rates.get(major, math.nan))
+    if len(currencies) <= SMALL_PORTFOLIO:
+        return [table[code] for code in codes]
+
+    import numpy as np
+    return np.array(table, dtype=float)[np.array(codes, dtype=np.intp)]
+
+
+def subtotals(currencies, native_values, base_values):
+    """{currency: (native total, base total)} over the valued positions.
+
+    Native totals are in the main unit, pence are counted as pounds.
+    """
+    unique, codes = _factorize(currencies)
+    majors = [split_minor(currency) for currency in unique]
+    if len(currencies) <= SMALL_PORTFOLIO:
+        native_sums = [0.0] * len(unique)
+        base_sums = [0.0] * len(unique)
+        valued = [False] * len(unique)
+        for code, native, converted in zip(codes, native_values, base_values):
+            if not math.isnan(converted):
+                native_sums[code] += native
+                base_sums[code] += converted
+                valued[code] = True
+    else:
+        import numpy as np
+        codes = np.array(codes, dtype=np.intp)
+        native = np.asarray(native_values, dtype=float)
+        converted = np.asarray(base_values, dtype=float)
+        mask = ~np.isnan(converted)
+        native_sums = np.bincount(codes[mask], weights=native[mask], minlength=len(unique))
+        base_sums = np.bincount(codes[mask], weights=converted[mask], minlength=len(unique))
+        valued = np.bincount(codes[mask], minlength=len(unique)) > 0
+
+    # pence and pounds end up in the same GBP entry
+    totals = {}
+    for i, (major, scale) in enumerate(majors):
+        if not valued[i]:
+            continue
+        native_sum, base_sum = totals.get(major, (0.0, 0.0))
+        totals[major] = (native_sum + float(native_sums[i]) * scale, base_sum + float(base_sums[i]))
+    return dict(sorted(totals.items()))
+
+
+# (converted values, total) for values in their quoted currencies; NaN
+# values and missing rates stay NaN and are left out of the total
+def convert(values, factors):
+    if not hasattr(values, "dtype") and not hasattr(factors, "dtype"):
+        converted = [value * factor for value, factor in zip(values, factors)]
+        return converted, sum((value for value in converted if not math.isnan(value)), 0.0)
+
+    import numpy as np
+    converted = np.asarray(values, dtype=float) * np.asarray(factors, dtype=float)
+    return converted, float(np.nansum(converted))
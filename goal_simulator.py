@@ -0,0 +1,120 @@
+"""Monte Carlo projection of savings towards the cost of a life event.
+
+Plain Python and NumPy, no Tk, so it can be used and tested on its own:
+
+    from goal_simulator import simulate_goal
+    result = simulate_goal(cost=30000, savings=5000, years=4,
+                           monthly_contribution=400, expected_return=0.05,
+                           volatility=0.10, inflation=0.03)
+    print(result.summary())
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+
+DEFAULT_PATHS = 200_000
+
+# paths simulated per block, bounds the memory used at any one time
+CHUNK_SIZE = 50_000
+
+PERCENTILES = (5, 25, 50, 75, 95)
+
+
+class SimulationResult:
+    """Outcome of simulate_goal()."""
+
+    def __init__(self, probability, target, years, bands, final_bands, paths):
+        self.probability = probability  # share of paths that reach the target
+        self.target = target            # event cost at the horizon, after inflation
+        self.years = years              # 0..horizon, one entry per year
+        self.bands = bands              # {percentile: balance per year}
+        self.final_bands = final_bands  # {percentile: balance at the horizon}
+        self.paths = paths
+
+    def summary(self):
+        low, median, high = (self.final_bands[p] for p in (5, 50, 95))
+        return (f"Chance of fully funding: {self.probability * 100:.1f}%\n"
+                f"Cost at the event (with inflation): ${self.target:,.2f}\n"
+                f"Projected savings: median ${median:,.2f} "
+                f"(5th-95th percentile ${low:,.2f} - ${high:,.2f})")
+
+
+# year marks reported for a horizon: every full year, plus the end if it is partial
+def _year_axis(months):
+    axis = list(range(months // 12 + 1))
+    if months % 12:
+        axis.append(months / 12)
+    return np.array(axis, dtype=float)
+
+
+# simulate one block of paths, returns the balance at every year end
+def _simulate_chunk(args):
+    paths, months, savings, contribution, drift, sigma, seed = args
+    rng = np.random.default_rng(seed)
+    balance = np.full(paths, float(savings))
+    yearly = np.empty((len(_year_axis(months)), paths))
+    yearly[0] = balance
+
+    for month in range(1, months + 1):
+        growth = np.exp(drift + sigma * rng.standard_normal(paths))
+        balance *= growth
+        balance += contribution
+        if month % 12 == 0:
+            yearly[month // 12] = balance
+    if months % 12:
+        yearly[-1] = balance
+    return yearly
+
+
+def simulate_goal(cost, savings, years, monthly_contribution=0.0, expected_return=0.05,
+                  volatility=0.10, inflation=0.03, paths=DEFAULT_PATHS, seed=None,
+                  workers=1):
+    """Project savings over `years` and estimate the chance of covering `cost`.
+
+    Returns are log-normal with the given annual expected return and
+    volatility, contributions are added monthly, and the cost grows with
+    inflation until the event. `workers` > 1 spreads the paths over a
+    process pool.
+    """
+    if years <= 0:
+        raise ValueError("years must be positive")
+    if paths < 1:
+        raise ValueError("paths must be at least 1")
+    if volatility < 0:
+        raise ValueError("volatility cannot be negative")
+    if expected_return <= -1:
+        raise ValueError("expected return must be above -100%")
+
+    months = max(1, round(years * 12))
+    sigma = volatility / np.sqrt(12)
+    drift = np.log1p(expected_return) / 12 - sigma ** 2 / 2
+    target = cost * (1 + inflation) ** (months / 12)
+
+    sizes = [min(CHUNK_SIZE, paths - start) for start in range(0, paths, CHUNK_SIZE)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    jobs = [(size, months, savings, monthly_contribution, drift, sigma, chunk_seed)
+            for size, chunk_seed in zip(sizes, seeds)]
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as pool:
+            blocks = list(pool.map(_simulate_chunk, jobs))
+    else:
+        blocks = [_simulate_chunk(job) for job in jobs]
+    yearly = np.concatenate(blocks, axis=1)
+
+    final = yearly[-1]
+    band_values = np.percentile(yearly, PERCENTILES, axis=1)
+    bands = {p: band_values[i] for i, p in enumerate(PERCENTILES)}
+    final_bands = {p: float(band_values[i][-1]) for i, p in enumerate(PERCENTILES)}
+    return SimulationResult(
+        probability=float(np.mean(final >= target)),
+        target=float(target),
+        years=_year_axis(months),
+        bands=bands,
+        final_bands=final_bands,
+        paths=paths,
+    )
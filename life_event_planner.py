@@ -1,11 +1,36 @@
+import json
+import os
+import threading
 import tkinter as tk
+from collections.abc import Mapping
 from tkinter import ttk
 from tkinter import messagebox
+from tkinter import font as tkfont
+
+from goal_simulator import simulate_goal
+
+# JSON file with the events, shaped like DEFAULT_APP_DATA; the built-in
+# data is used when it does not exist
+DEFAULT_DATA_PATH = "life_events.json"
+
+# ticked checklist items, per event
+DEFAULT_STATE_PATH = "life_event_checklists.json"
+
+# height in pixels of one checklist row
+CHECKLIST_ROW_HEIGHT = 26
+
+# pixels of a checklist row taken by the checkbox and padding
+CHECKLIST_CHECK_WIDTH = 40
+
+# milliseconds to wait after a tick before the checklist state is saved
+SAVE_DELAY = 500
+
+TAB_TITLES = ("Checklist", "Financial Impact", "Recommended Products", "Find an Advisor")
 
 # --- Data for the Application ---
 # We store all the text and checklist items in a dictionary
 # for easy access.
-APP_DATA = {
+DEFAULT_APP_DATA = {
     "Marriage": {
         "checklist": [
             "Set a budget (venue, food, attire, etc.)",
@@ -89,11 +114,234 @@ APP_DATA = {
 }
 
 
+class AppData(Mapping):
+    """The events by name, read from `path` on first use.
+
+    Falls back to DEFAULT_APP_DATA when the file does not exist, so the
+    planner works without one; a data file lets checklists grow to
+    thousands of items without touching the code.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.environ.get("PORTFOLIO_LIFE_EVENTS", DEFAULT_DATA_PATH)
+        self._events = None
+
+    def _load(self):
+        if self._events is None:
+            try:
+                with open(self.path, encoding="utf-8") as f:
+                    self._events = json.load(f)
+            except FileNotFoundError:
+                self._events = DEFAULT_APP_DATA
+        return self._events
+
+    def __getitem__(self, name):
+        return self._load()[name]
+
+    def __iter__(self):
+        return iter(self._load())
+
+    def __len__(self):
+        return len(self._load())
+
+
+APP_DATA = AppData()
+
+
+class ChecklistState:
+    """Ticked checklist items per event, kept in a JSON file.
+
+    Items are remembered by their text, so a reordered or extended data
+    file keeps the ticks that still apply.
+    """
+
+    def __init__(self, path=DEFAULT_STATE_PATH):
+        self.path = path
+        self.dirty = False
+        try:
+            with open(path, encoding="utf-8") as f:
+                self._ticked = {event: set(items) for event, items in json.load(f).items()}
+        except (FileNotFoundError, ValueError):
+            self._ticked = {}
+
+    def ticked(self, event, items):
+        """One flag per item of `event`'s checklist."""
+        done = self._ticked.get(event, ())
+        return bytearray(item in done for item in items)
+
+    def set(self, event, item, ticked):
+        done = self._ticked.setdefault(event, set())
+        if ticked:
+            done.add(item)
+        else:
+            done.discard(item)
+        self.dirty = True
+
+    def save(self):
+        if not self.dirty:
+            return
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({event: sorted(items) for event, items in self._ticked.items() if items}, f)
+        os.replace(tmp_path, self.path)
+        self.dirty = False
+
+
+class VirtualChecklist(ttk.Frame):
+    """A scrollable checklist that only has widgets for the visible rows.
+
+    The row widgets are recycled as the list scrolls: each shows the
+    item at `first` plus its position, so thousands of items cost no
+    more than a screenful. Rows have a fixed height, so an item too long
+    for one line is cut short with an ellipsis and shown whole in a
+    tooltip while the pointer is over it. Ticks are kept in `ticked`,
+    one flag per item, and reported through `on_toggle(index, ticked)`.
+    """
+
+    def __init__(self, parent, items, ticked, on_toggle, row_height=CHECKLIST_ROW_HEIGHT):
+        super().__init__(parent)
+        self.items = items
+        self.ticked = ticked
+        self.on_toggle = on_toggle
+        self.row_height = row_height
+        self.first = 0
+        self.rows = []   # (frame, variable, label) per visible row
+        self.font = tkfont.nametofont("TkDefaultFont")
+        self.text_width = 0
+        self.tooltip = None
+
+        self.body = tk.Frame(self, background="#ffffff")
+        self.scrollbar = ttk.Scrollbar(self, orient="vertical", command=self.yview)
+        self.scrollbar.pack(side="right", fill="y")
+        self.body.pack(side="left", fill="both", expand=True)
+        self.body.bind("<Configure>", lambda e: self.layout())
+        for widget in (self.body, self.scrollbar):
+            self.bind_wheel(widget)
+
+    def bind_wheel(self, widget):
+        widget.bind("<MouseWheel>", lambda e: self.scroll(-1 if e.delta > 0 else 1))
+        widget.bind("<Button-4>", lambda e: self.scroll(-1))
+        widget.bind("<Button-5>", lambda e: self.scroll(1))
+
+    @property
+    def visible(self):
+        return max(1, self.body.winfo_height() // self.row_height)
+
+    def layout(self):
+        """Make as many row widgets as fit, then show the items."""
+        width = self.body.winfo_width()
+        while len(self.rows) < min(self.visible, len(self.items)):
+            row = len(self.rows)
+            frame = tk.Frame(self.body, background="#ffffff")
+            variable = tk.IntVar()
+            check = ttk.Checkbutton(frame, variable=variable,
+                                    command=lambda row=row: self.toggled(row))
+            check.pack(side='left', anchor='w', padx=5)
+            label = ttk.Label(frame, background="#ffffff")
+            label.pack(side='left', anchor='w', fill='x', expand=True)
+            for widget in (frame, check, label):
+                self.bind_wheel(widget)
+            label.bind("<Enter>", lambda e, row=row: self.show_tooltip(row))
+            label.bind("<Leave>", lambda e: self.hide_tooltip())
+            self.rows.append((frame, variable, label))
+        self.text_width = width - CHECKLIST_CHECK_WIDTH
+        for row, (frame, variable, label) in enumerate(self.rows):
+            frame.place(x=0, y=row * self.row_height, width=width, height=self.row_height)
+        self.scroll_to(self.first)
+
+    def scroll_to(self, first):
+        self.first = max(0, min(first, len(self.items) - self.visible))
+        for row, (frame, variable, label) in enumerate(self.rows):
+            index = self.first + row
+            if index < len(self.items) and row < self.visible:
+                variable.set(self.ticked[index])
+                label.config(text=self.fit(self.items[index]))
+                frame.place_configure(y=row * self.row_height)
+            else:
+                frame.place_forget()
+        if self.items:
+            self.scrollbar.set(self.first / len(self.items),
+                               min(1.0, (self.first + self.visible) / len(self.items)))
+
+    def fit(self, text):
+        """`text`, cut short with an ellipsis if it is wider than a row."""
+        if self.text_width <= 0 or self.font.measure(text) <= self.text_width:
+            return text
+        # the longest prefix that fits with the ellipsis, by bisection
+        lo, hi = 0, len(text)
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if self.font.measure(text[:mid] + "\u2026") <= self.text_width:
+                lo = mid
+            else:
+                hi = mid - 1
+        return text[:lo].rstrip() + "\u2026"
+
+    def show_tooltip(self, row):
+        index = self.first + row
+        label = self.rows[row][2]
+        if index >= len(self.items) or label.cget("text") == self.items[index]:
+            return
+        self.hide_tooltip()
+        self.tooltip = tk.Toplevel(self)
+        self.tooltip.wm_overrideredirect(True)
+        self.tooltip.wm_geometry(f"+{label.winfo_rootx()}+{label.winfo_rooty() + self.row_height}")
+        tk.Label(self.tooltip, text=self.items[index], wraplength=600, justify='left',
+                 background="#ffffe0", relief='solid', borderwidth=1).pack()
+
+    def hide_tooltip(self):
+        if self.tooltip is not None:
+            self.tooltip.destroy()
+            self.tooltip = None
+
+    def scroll(self, rows):
+        self.hide_tooltip()
+        self.scroll_to(self.first + rows)
+
+    def yview(self, *args):
+        """Scrollbar callback: ("moveto", fraction) or ("scroll", n, units|pages)."""
+        if args[0] == "moveto":
+            self.scroll_to(round(float(args[1]) * len(self.items)))
+        elif args[0] == "scroll":
+            step = self.visible if args[2] == "pages" else 1
+            self.scroll(int(args[1]) * step)
+
+    def toggled(self, row):
+        index = self.first + row
+        ticked = self.rows[row][1].get()
+        self.ticked[index] = ticked
+        self.on_toggle(index, ticked)
+
+
+class SimulatorForm:
+    """The simulator widgets of one event's Financial Impact tab."""
+
+    def __init__(self, cost, savings, years, contribution, expected_return, volatility,
+                 inflation, button, gap_label, result_label):
+        self.cost_entry = cost
+        self.savings_entry = savings
+        self.years_entry = years
+        self.contribution_entry = contribution
+        self.return_entry = expected_return
+        self.volatility_entry = volatility
+        self.inflation_entry = inflation
+        self.calc_button = button
+        self.gap_result_label = gap_label
+        self.sim_result_label = result_label
+
+
 class LifeEventPlannerApp:
-    def __init__(self, root):
+    def __init__(self, root, data=None, state=None):
         self.root = root
         self.root.title("Life Event Planner")
         self.root.geometry("800x600")
+        self.data = APP_DATA if data is None else data
+        self.state = state or ChecklistState()
+        self._save_job = None
+
+        # one notebook per event, built the first time the event is loaded
+        self.notebooks = {}
+        self.current_notebook = None
 
         # Set a modern theme
         self.style = ttk.Style()
@@ -109,7 +357,7 @@ class LifeEventPlannerApp:
 
         ttk.Label(selection_frame, text="Select a Major Life Event:", font=('Arial', 12, 'bold')).pack(side=tk.LEFT, padx=5)
 
-        self.event_options = list(APP_DATA.keys())
+        self.event_options = list(self.data.keys())
         self.current_event = tk.StringVar(self.root)
         self.current_event.set(self.event_options[0])  # Set default
 
@@ -124,78 +372,99 @@ class LifeEventPlannerApp:
         self.content_frame = ttk.Frame(self.root, padding=10)
         self.content_frame.pack(fill='both', expand=True)
 
+        # pending checklist ticks are written before the window goes away
+        self.root.protocol("WM_DELETE_WINDOW", self.close)
+
         # Load the default event on startup
         self.load_event_plan()
 
-    def clear_frame(self, frame):
-        """Helper function to destroy all widgets in a frame."""
-        for widget in frame.winfo_children():
-            widget.destroy()
-
     def load_event_plan(self):
-        """Clears the content_frame and loads the tabs for the selected event."""
-        self.clear_frame(self.content_frame)
+        """Shows the notebook of the selected event, building it the first time.
 
+        Notebooks are kept when another event is shown, so checklist
+        ticks and simulator inputs survive switching back and forth.
+        """
         event_name = self.current_event.get()
-        event_data = APP_DATA.get(event_name)
-
-        if not event_data:
-            messagebox.showerror("Error", "Could not find data for the selected event.")
-            return
-
-        # Create the Notebook (tabbed interface)
-        notebook = ttk.Notebook(self.content_frame)
+        notebook = self.notebooks.get(event_name)
+        if notebook is None:
+            try:
+                event_data = self.data[event_name]
+            except KeyError:
+                messagebox.showerror("Error", "Could not find data for the selected event.")
+                return
+            notebook = self.create_notebook(event_name, event_data)
+            self.notebooks[event_name] = notebook
+
+        if self.current_notebook is not None and self.current_notebook is not notebook:
+            self.current_notebook.pack_forget()
         notebook.pack(fill='both', expand=True)
+        self.current_notebook = notebook
 
-        # Create the four tabs
-        tab1 = self.create_checklist_tab(notebook, event_data['checklist'])
-        tab2 = self.create_financial_tab(notebook, event_data['financial_tips'])
-        tab3 = self.create_products_tab(notebook, event_data['products'])
-        tab4 = self.create_advisor_tab(notebook, event_data['advisor_info'])
-
-        # Add tabs to the notebook
-        notebook.add(tab1, text="Checklist")
-        notebook.add(tab2, text="Financial Impact")
-        notebook.add(tab3, text="Recommended Products")
-        notebook.add(tab4, text="Find an Advisor")
-
-    def create_checklist_tab(self, parent, checklist_items):
-        """Creates the Checklist tab with a scrollable list of checkbuttons."""
-        # This is a bit complex, but it creates a scrollable frame
-        outer_frame = ttk.Frame(parent, padding=10)
-        
-        canvas = tk.Canvas(outer_frame, borderwidth=0, background="#ffffff")
-        scrollbar = ttk.Scrollbar(outer_frame, orient="vertical", command=canvas.yview)
-        scrollable_frame = ttk.Frame(canvas, padding=5)
-
-        scrollable_frame.bind(
-            "<Configure>",
-            lambda e: canvas.configure(
-                scrollregion=canvas.bbox("all")
-            )
+    def create_notebook(self, event_name, event_data):
+        """Creates the Notebook with empty tabs; each is filled when first selected."""
+        notebook = ttk.Notebook(self.content_frame)
+        builders = (
+            lambda parent: self.create_checklist_tab(parent, event_data['checklist'], event_name),
+            lambda parent: self.create_financial_tab(parent, event_data['financial_tips']),
+            lambda parent: self.create_products_tab(parent, event_data['products']),
+            lambda parent: self.create_advisor_tab(parent, event_data['advisor_info']),
         )
+        pending = {}
+        for title, build in zip(TAB_TITLES, builders):
+            tab = ttk.Frame(notebook)
+            notebook.add(tab, text=title)
+            pending[str(tab)] = (tab, build)
+
+        def build_selected(event):
+            entry = pending.pop(notebook.select(), None)
+            if entry is not None:
+                tab, build = entry
+                build(tab).pack(fill='both', expand=True)
+
+        notebook.bind("<<NotebookTabChanged>>", build_selected)
+        # the first tab is shown right away
+        build_selected(None)
+        return notebook
+
+    def create_checklist_tab(self, parent, checklist_items, event_name=None):
+        """Creates the Checklist tab with a virtualized list of checkbuttons."""
+        outer_frame = ttk.Frame(parent, padding=10)
 
-        canvas.create_window((0, 0), window=scrollable_frame, anchor="nw")
-        canvas.configure(yscrollcommand=scrollbar.set)
+        ticked = self.state.ticked(event_name, checklist_items)
+        progress = ttk.Label(outer_frame)
 
-        # Add checklist items
-        for item in checklist_items:
-            var = tk.IntVar()
-            # Create a frame for each checkbutton + label to keep them together
-            item_frame = ttk.Frame(scrollable_frame)
+        def show_progress():
+            progress.config(text=f"{sum(ticked)} of {len(checklist_items)} done")
 
-            cb = ttk.Checkbutton(item_frame, variable=var)
-            cb.pack(side='left', anchor='nw', padx=5)
+        def on_toggle(index, value):
+            self.state.set(event_name, checklist_items[index], value)
+            show_progress()
+            self.schedule_save()
 
-            label = ttk.Label(item_frame, text=item, wraplength=600)
-            label.pack(side='left', anchor='w', fill='x', expand=True)
+        progress.pack(side='bottom', anchor='w', pady=(5, 0))
+        show_progress()
+        checklist = VirtualChecklist(outer_frame, checklist_items, ticked, on_toggle)
+        checklist.pack(fill='both', expand=True)
+        return outer_frame
 
-            item_frame.pack(anchor='w', fill='x', pady=2) # Add a little vertical padding
+    def schedule_save(self):
+        """Saves the checklist state shortly after the last tick."""
+        if self._save_job is not None:
+            self.root.after_cancel(self._save_job)
+        self._save_job = self.root.after(SAVE_DELAY, self.save_state)
 
-        canvas.pack(side="left", fill="both", expand=True)
-        scrollbar.pack(side="right", fill="y")
-        
-        return outer_frame
+    def save_state(self):
+        self._save_job = None
+        try:
+            self.state.save()
+        except OSError as e:
+            messagebox.showwarning("Save Error", f"Could not save the checklist: {e}")
+
+    def close(self):
+        if self._save_job is not None:
+            self.root.after_cancel(self._save_job)
+        self.save_state()
+        self.root.destroy()
 
     def create_financial_tab(self, parent, financial_tips):
         """Creates the Financial Impact tab with the simple simulator."""
@@ -207,21 +476,38 @@ class LifeEventPlannerApp:
 
         # Cost Entry
         ttk.Label(sim_frame, text="Estimated Cost of Event:").grid(row=0, column=0, sticky='w', padx=5, pady=5)
-        self.cost_entry = ttk.Entry(sim_frame, width=20)
-        self.cost_entry.grid(row=0, column=1, sticky='w', padx=5, pady=5)
+        cost_entry = ttk.Entry(sim_frame, width=20)
+        cost_entry.grid(row=0, column=1, sticky='w', padx=5, pady=5)
 
         # Savings Entry
         ttk.Label(sim_frame, text="Current Savings for Event:").grid(row=1, column=0, sticky='w', padx=5, pady=5)
-        self.savings_entry = ttk.Entry(sim_frame, width=20)
-        self.savings_entry.grid(row=1, column=1, sticky='w', padx=5, pady=5)
+        savings_entry = ttk.Entry(sim_frame, width=20)
+        savings_entry.grid(row=1, column=1, sticky='w', padx=5, pady=5)
+
+        # Projection inputs for the Monte Carlo simulation
+        years_entry = self.create_sim_entry(sim_frame, 2, "Years Until Event:", "5")
+        contribution_entry = self.create_sim_entry(sim_frame, 3, "Monthly Contribution:", "0")
+        return_entry = self.create_sim_entry(sim_frame, 4, "Expected Annual Return (%):", "5")
+        volatility_entry = self.create_sim_entry(sim_frame, 5, "Annual Volatility (%):", "10")
+        inflation_entry = self.create_sim_entry(sim_frame, 6, "Inflation (%):", "3")
 
         # Calculate Button
-        calc_button = ttk.Button(sim_frame, text="Calculate Gap", command=self.calculate_gap)
-        calc_button.grid(row=2, column=0, columnspan=2, pady=10)
+        calc_button = ttk.Button(sim_frame, text="Calculate Gap")
+        calc_button.grid(row=7, column=0, columnspan=2, pady=10)
 
         # Result Label
-        self.gap_result_label = ttk.Label(sim_frame, text="Savings Gap: $0.00", font=('Arial', 12, 'bold'))
-        self.gap_result_label.grid(row=3, column=0, columnspan=2, pady=5)
+        gap_result_label = ttk.Label(sim_frame, text="Savings Gap: $0.00", font=('Arial', 12, 'bold'))
+        gap_result_label.grid(row=8, column=0, columnspan=2, pady=5)
+
+        # Simulation Result Label
+        sim_result_label = ttk.Label(sim_frame, text="", justify='left')
+        sim_result_label.grid(row=9, column=0, columnspan=2, pady=5)
+
+        # every event's tab has its own inputs, they stay filled in while cached
+        form = SimulatorForm(cost_entry, savings_entry, years_entry, contribution_entry,
+                             return_entry, volatility_entry, inflation_entry, calc_button,
+                             gap_result_label, sim_result_label)
+        calc_button.config(command=lambda: self.calculate_gap(form))
         
         # --- Tips Frame ---
         tips_frame = ttk.LabelFrame(frame, text="Key Financial Considerations", padding=10)
@@ -232,21 +518,87 @@ class LifeEventPlannerApp:
         
         return frame
 
-    def calculate_gap(self):
-        """Callback for the 'Calculate Gap' button."""
+    def create_sim_entry(self, parent, row, label_text, default):
+        """Adds a labelled entry with a default value to the simulator grid."""
+        ttk.Label(parent, text=label_text).grid(row=row, column=0, sticky='w', padx=5, pady=5)
+        entry = ttk.Entry(parent, width=20)
+        entry.insert(0, default)
+        entry.grid(row=row, column=1, sticky='w', padx=5, pady=5)
+        return entry
+
+    def calculate_gap(self, form):
+        """Callback for the 'Calculate Gap' button of one event's SimulatorForm."""
         try:
-            cost = float(self.cost_entry.get() or 0)
-            savings = float(self.savings_entry.get() or 0)
+            cost = float(form.cost_entry.get() or 0)
+            savings = float(form.savings_entry.get() or 0)
             
             gap = cost - savings
             
             if gap > 0:
-                self.gap_result_label.config(text=f"Savings Gap: ${gap:,.2f}", foreground='red')
+                form.gap_result_label.config(text=f"Savings Gap: ${gap:,.2f}", foreground='red')
             else:
-                self.gap_result_label.config(text=f"Surplus: ${abs(gap):,.2f}", foreground='green')
+                form.gap_result_label.config(text=f"Surplus: ${abs(gap):,.2f}", foreground='green')
                 
         except ValueError:
             messagebox.showwarning("Input Error", "Please enter valid numbers for cost and savings.")
+            return
+
+        try:
+            params = {
+                "cost": cost,
+                "savings": savings,
+                "years": float(form.years_entry.get() or 0),
+                "monthly_contribution": float(form.contribution_entry.get() or 0),
+                "expected_return": float(form.return_entry.get() or 0) / 100,
+                "volatility": float(form.volatility_entry.get() or 0) / 100,
+                "inflation": float(form.inflation_entry.get() or 0) / 100,
+            }
+        except ValueError:
+            messagebox.showwarning("Input Error", "Please enter valid numbers for the projection.")
+            return
+
+        if params["years"] > 0:
+            self.start_simulation(params, form)
+        else:
+            form.sim_result_label.config(text="")
+
+    def start_simulation(self, params, form):
+        """Runs the Monte Carlo projection on a worker thread."""
+        button = form.calc_button
+        label = form.sim_result_label
+        button.state(['disabled'])
+        label.config(text="Running simulation...", foreground='')
+
+        outcome = {}
+
+        def work():
+            try:
+                outcome['result'] = simulate_goal(**params)
+            except Exception as e:
+                outcome['error'] = e
+
+        thread = threading.Thread(target=work, daemon=True)
+        thread.start()
+        self.root.after(100, self.poll_simulation, thread, outcome, button, label)
+
+    def poll_simulation(self, thread, outcome, button, label):
+        """Checks on the worker from the Tk main loop and shows the result."""
+        if thread.is_alive():
+            self.root.after(100, self.poll_simulation, thread, outcome, button, label)
+            return
+
+        # the window was closed while the simulation ran
+        if not label.winfo_exists():
+            return
+
+        button.state(['!disabled'])
+        if 'error' in outcome:
+            label.config(text=f"Simulation failed: {outcome['error']}", foreground='red')
+            return
+
+        result = outcome['result']
+        colour = 'green' if result.probability >= 0.8 else 'red'
+        label.config(text=result.summary(), foreground=colour)
 
     def create_products_tab(self, parent, product_text):
         """Creates the Recommended Products tab."""
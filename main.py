@@ -1,6 +1,19 @@
-import yfinance as yf
-import pandas as pd
 import asyncio
+import importlib
+import os
+import sys
+
+from fx import base_currency, fetch_rates, guess_currency, rates_for_quotes
+from metrics import Profiler, enable_from_env, metrics
+from portfolio_loader import load_portfolio, show_summary
+from portfolio_store import PortfolioStore, store_result
+from quote_cache import DEFAULT_TTL, QuoteCache
+from quote_provider import QuoteFetcher, get_provider
+from report import (ProgressiveReport, Valuation, fetch_valuation, render,
+                    settings_from_env)
+from snapshots import Snapshot, SnapshotStore, diff, render_changes, revalue
+from valuation import holdings_lists
+from watch import file_digest
 
 
 # empty data for user to add entries
@@ -24,13 +37,15 @@ def display_menu():
     print("  b) Display & evaluate portfolio")
     print("  c) Clear portfolio")
     print("  d) Display & evaluate sample portfolio")
+    print("  r) Refresh prices & evaluate portfolio")
+    print("  l) Bulk load entries from a csv file")
     print("  q) Quit")
     print()
     print("-" * 50)
     
     # exception handling
     try:
-        choice = input("Enter your choice (a/b/c/d/q): ").lower().strip()
+        choice = input("Enter your choice (a/b/c/d/r/l/q): ").lower().strip()
         print()
         return choice
     except KeyboardInterrupt:
@@ -46,22 +61,27 @@ def display_menu():
         return ''
 
 
-# read csv file as a whole
-def read_portfolio():
+# load holdings from the store, re-importing portfolio.csv if it was edited
+def read_portfolio(store):
     try:
-        df = pd.read_csv("portfolio.csv", names=['ticker', 'quantity'])
+        with metrics.stage("read_portfolio"):
+            result = store.sync_from_csv()
+            if result is None:
+                # the store is up to date, no need to parse the csv again
+                result = store_result(store)
         
         # Check if CSV is empty
-        if df.empty:
+        if result.empty:
+            if result.error_count:
+                show_summary("Portfolio", result)
             print("Portfolio is empty!")
             print("Use option 'a' to add entries to your portfolio.")
             print("\n" + "=" * 50 + "\n")
             return None
         
-        print("Portfolio:")
-        print(df)
+        show_summary("Portfolio", result)
         print("\n" + "=" * 50 + "\n")
-        return df
+        return result
         
     # exception handling
     except FileNotFoundError:
@@ -78,18 +98,20 @@ def read_portfolio():
 
 def read_sample_portfolio():
     try:
-        df = pd.read_csv("sample.csv", names=['ticker', 'quantity'])
+        with metrics.stage("read_portfolio"):
+            result = load_portfolio("sample.csv")
         
         # checks if CSV is empty
-        if df.empty:
+        if result.empty:
+            if result.error_count:
+                show_summary("Sample Portfolio", result)
             print("Sample portfolio is empty!")
             print("\n" + "=" * 50 + "\n")
             return None
         
-        print("Sample Portfolio:")
-        print(df)
+        show_summary("Sample Portfolio", result)
         print("\n" + "=" * 50 + "\n")
-        return df
+        return result
 
     # exception handling  
     except FileNotFoundError:
@@ -104,70 +126,137 @@ def read_sample_portfolio():
         return None
 
 
-# append entries to the csv file
-def write_csv():
-    while True:
-        try:
-            user_input = input("Write symbol and quantity separated by space. "
-            "(Press Q to go back to menu): ")
+# portfolio.csv is rewritten from the store when entries are saved, which
+# would drop lines that could not be parsed: show them and stop until fixed
+def has_unparsed_lines(store):
+    if not store.unparsed_lines():
+        return False
+    show_summary("Portfolio", store_result(store))
+    print(f"\nFix or remove the malformed line(s) in {store.csv_path} first;"
+          f" saving rewrites the file and would drop them.")
+    return True
 
-            if user_input.strip().lower() == "q":
-                # quit appending
-                return
-            
-            # Check if input is empty
-            if not user_input.strip():
-                print("Error: Please enter a symbol and quantity.")
-                continue
-            
-            # split symbol and quantity as list items
-            split_input = user_input.split(" ")
-            
-            # Check if user entered exactly 2 values
-            if len(split_input) != 2:
-                print("Error: Please enter exactly one symbol and one quantity separated by space.")
-                print("Example: AAPL 50")
-                continue
-            
-            symbol = split_input[0].upper()  # Convert to uppercase
-            quantity_str = split_input[1]
-            
-            # Check if quantity is a valid number
+
+# collect entries and save them to the portfolio in one batch
+def write_csv(store):
+    pending = []
+    try:
+        # pick up manual edits first so the export below keeps them
+        store.sync_from_csv()
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print(f"Error reading portfolio: {e}")
+        return
+    if has_unparsed_lines(store):
+        return
+
+    try:
+        while True:
             try:
-                quantity = int(quantity_str)
-                if quantity <= 0:
-                    print("Error: Quantity must be a positive number.")
+                user_input = input("Write symbol and quantity separated by space. "
+                "(Press Q to save and go back to menu): ")
+
+                if user_input.strip().lower() == "q":
+                    # quit appending
+                    return
+                
+                # Check if input is empty
+                if not user_input.strip():
+                    print("Error: Please enter a symbol and quantity.")
                     continue
-            except ValueError:
-                print("Error: Quantity must be a valid number.")
-                continue
-            
-            data["quantity"].append(quantity)
-            data["symbol"].append(symbol)
+                
+                # split symbol and quantity as list items
+                split_input = user_input.split(" ")
+                
+                # Check if user entered exactly 2 values
+                if len(split_input) != 2:
+                    print("Error: Please enter exactly one symbol and one quantity separated by space.")
+                    print("Example: AAPL 50")
+                    continue
+                
+                symbol = split_input[0].upper()  # Convert to uppercase
+                quantity_str = split_input[1]
+                
+                # Check if quantity is a valid number
+                try:
+                    quantity = int(quantity_str)
+                    if quantity <= 0:
+                        print("Error: Quantity must be a positive number.")
+                        continue
+                except ValueError:
+                    print("Error: Quantity must be a valid number.")
+                    continue
+                
+                data["quantity"].append(quantity)
+                data["symbol"].append(symbol)
+                pending.append((symbol, quantity))
+                
+                print(f"Added {symbol}: {quantity} shares to portfolio.")
+
+            except (KeyboardInterrupt, EOFError):
+                print()
+                return
+            except Exception as e:
+                print(f"Error: {e}")
+                print("Please try again.")
+    finally:
+        save_entries(store, pending)
 
-            # convert to DataFrame and append to CSV
-            df = pd.DataFrame({"ticker": [symbol], "quantity": [quantity]})
-            df.to_csv('portfolio.csv', mode='a', header=False, index=False)
-            
-            print(f"Added {symbol}: {quantity} shares to portfolio.")
-            
-        except PermissionError:
-            print("Error: Cannot write to portfolio.csv - file may be open in another program.")
-            break
-        except Exception as e:
-            print(f"Error: {e}")
-            print("Please try again.")
+
+# write pending entries to the store and portfolio.csv in one transaction
+def save_entries(store, entries):
+    if not entries:
+        return
+    try:
+        store.add_many(entries)
+        store.export_csv()
+        print(f"Saved {len(entries)} entries to portfolio.")
+    except PermissionError:
+        print("Error: Cannot write to portfolio.csv - file may be open in another program.")
+    except Exception as e:
+        print(f"Error saving portfolio: {e}")
 
 
-# to clear all the entries in the csv file
-def clear_csv():
+# load many entries from another csv file in a single transaction
+def bulk_load(store):
+    try:
+        path = input("Path of the csv file to load (ticker,quantity per line): ").strip()
+        if not path:
+            print("Bulk load cancelled.")
+            return
+
+        try:
+            store.sync_from_csv()
+        except FileNotFoundError:
+            pass
+        if has_unparsed_lines(store):
+            return
+        result = store.import_csv(path)
+        store.export_csv()
+
+        show_summary("Loaded", result)
+        print(f"Portfolio now holds {store.count()} symbols.")
+
+    # exception handling
+    except FileNotFoundError:
+        print(f"File '{path}' not found!")
+    except PermissionError:
+        print("Error: Cannot write to portfolio.csv - file may be open in another program.")
+    except Exception as e:
+        print(f"Error loading entries: {e}")
+        print("Please check the file and try again.")
+
+
+# to clear all the entries in the portfolio
+def clear_csv(store):
     try:
         confirm = input("Are you sure you want to clear your entire portfolio? (y/n): ").lower().strip()
         
         if confirm == 'y' or confirm == 'yes':
-            # overwrite existing file with empty dataframe
-            empty_df = pd.DataFrame()
-            empty_df.to_csv("portfolio.csv", index=False)
+            # clear the store in one transaction, then empty the csv copy
+            store.clear()
+            store.export_csv(force=True)
             print("Portfolio cleared successfully!")
         else:
             print("Portfolio clear cancelled.")
@@ -180,97 +269,124 @@ def clear_csv():
         print("Please try again.")
 
 
-# get data from yfinance
-async def fetch_stock(symbol, quantity):
-    try:
-        stock = yf.Ticker(symbol)
-        info = stock.info
-        
-        # check if we got valid data
-        if not info or 'currentPrice' not in info and 'regularMarketPrice' not in info:
-            print(f"{symbol} - Error: Invalid symbol or no price data available")
-            print(f"  Shares: {quantity}")
-            print(f"  Current Price: N/A")
-            print(f"  Position Value: N/A")
-            print("-" * 40)
-            return 0  # return 0 for failed stocks
-        
-        current_price = info.get('currentPrice', info.get('regularMarketPrice', 0))
-        company_name = info.get('longName', symbol)
-        
-        # check if price is valid
-        if current_price == 0:
-            print(f"{symbol} ({company_name}) - Error: No price data available")
-            print(f"  Shares: {quantity}")
-            print(f"  Current Price: N/A")
-            print(f"  Position Value: N/A")
-            print("-" * 40)
-            return 0
-        
-        position_value = current_price * quantity
-        
-        print(f"{symbol} ({company_name})")
-        print(f"  Shares: {quantity}")
-        print(f"  Current Price: ${current_price:.2f}")
-        print(f"  Position Value: ${position_value:.2f}")
-        print("-" * 40)
-        
-        return position_value
-        
-    except Exception as e:
-        print(f"{symbol} - Error fetching data: {e}")
-        print(f"  Shares: {quantity}")
-        print(f"  Current Price: N/A")
-        print(f"  Position Value: N/A")
-        print("-" * 40)
-        return 0  # Return 0 for failed stocks
-
-
-# calculate portfolio value
-async def calculate_portfolio_value(dataFrame):
-    total_value = 0
-    tasks = []
-    
-    # tasks for each stock
-    for index, row in dataFrame.iterrows():
-        symbol = row['ticker']
-        quantity = row['quantity']
-        task = asyncio.create_task(fetch_stock(symbol, quantity))
-        tasks.append(task)
-    
-    # wait for all tasks, then sum values
-    for task in tasks:
-        position_value = await task
-        total_value += position_value
+# calculate portfolio value, refresh=True ignores cached prices; the report
+# is written in one go, or row by row as quotes arrive when progressive.
+# With `snapshots`, the valuation starts from the last snapshot of the
+# `source` file, is saved as the next one, and the changes are reported
+async def calculate_portfolio_value(portfolio, fetcher, refresh=False, fmt="table",
+                                    progressive=False, base=None, snapshots=None, source=None):
+    # repeated tickers are merged so every symbol is fetched only once
+    symbols, quantities = holdings_lists(portfolio)
+    base = base or base_currency()
+
+    if fetcher.cache is not None:
+        fetcher.cache.reset_stats()
+    previous = snapshots.latest(source) if snapshots is not None else None
+    digest = file_digest(source) if previous is not None and os.path.exists(source) else None
+
+    progress = None
+    fetched = None
+    rates_at = None
+    if progressive and fmt == "table":
+        with metrics.stage("fetch"):
+            # rows are converted as they are shown, so the rates come first
+            expected = {guess_currency(symbol) for symbol in symbols}
+            rates, rate_errors = await fetch_rates(fetcher, expected, base, refresh=refresh)
+            progress = ProgressiveReport(symbols, quantities, rates, base)
+            # one batched request per group of symbols instead of one per row
+            quotes, errors = await fetcher.fetch_many(symbols, refresh=refresh,
+                                                      on_quotes=progress.add)
+            rates, rate_errors = await rates_for_quotes(fetcher, symbols, quotes, base, refresh,
+                                                        rates, rate_errors)
+        # small portfolios are valued in plain Python, large ones as NumPy vectors
+        with metrics.stage("value"):
+            valuation = Valuation(symbols, quantities, quotes, errors, rates, base, rate_errors)
+    elif previous is not None:
+        # only new symbols and stale prices are fetched, the rest comes from the snapshot
+        ttl = fetcher.cache.ttl if fetcher.cache is not None else DEFAULT_TTL
+        valuation, fetched, rates_at = await revalue(fetcher, symbols, quantities, previous,
+                                                     base, refresh, ttl, digest)
+    else:
+        # quotes and exchange rates in batched requests, then valued as vectors
+        valuation = await fetch_valuation(fetcher, symbols, quantities, base, refresh)
+
+    with metrics.stage("render"):
+        if progress is not None:
+            progress.finish(valuation)
+        else:
+            render(valuation, fmt)
+
+    if snapshots is not None:
+        if digest is None and os.path.exists(source):
+            digest = file_digest(source)
+        current = Snapshot.from_valuation(source, valuation, digest, rates_at)
+        snapshots.save(current)
+        changes = diff(previous, current) if previous is not None else None
+        if changes is not None and fmt == "table":
+            print("\n" + render_changes(changes), end="")
+        if fetched is not None and fmt == "table":
+            known = set(previous.symbols)
+            new = sum(1 for symbol in fetched if symbol not in known)
+            print(f"Prices: {len(fetched)} fetched ({new} new, {len(fetched) - new} "
+                  f"{'refreshed' if refresh else 'stale'}), "
+                  f"{len(symbols) - len(fetched)} reused from the last valuation")
+
+    if fetcher.cache is not None and fmt == "table":
+        print(f"Quote cache: {fetcher.cache.hits} hits, {fetcher.cache.misses} misses")
+    return valuation
 
-    print(f"\nTotal Portfolio Value: ${total_value:.2f}")
+
+# value a portfolio, profiled when PORTFOLIO_PROFILE is set
+async def evaluate(portfolio, fetcher, profiler, settings, refresh=False, snapshots=None,
+                   source=None):
+    fmt, progressive = settings
+    with profiler:
+        await calculate_portfolio_value(portfolio, fetcher, refresh=refresh, fmt=fmt,
+                                        progressive=progressive, snapshots=snapshots,
+                                        source=source)
+    metrics.count("valuations_total")
 
 
 async def main():
+    metrics_path = enable_from_env()
+    profiler = Profiler()
+    settings = settings_from_env()
+    fetcher = QuoteFetcher(get_provider(), cache=QuoteCache.from_env())
+    store = PortfolioStore()
+    snapshots = SnapshotStore.from_env()
     try:
         while True:
             choice = display_menu()
             
             if choice == 'a':
-                write_csv()
+                write_csv(store)
             elif choice == 'b':
-                data = read_portfolio()
+                data = read_portfolio(store)
 
                 # proceeds only if some data exists
                 if data is not None:
-                    await calculate_portfolio_value(data)
+                    await evaluate(data, fetcher, profiler, settings, snapshots=snapshots,
+                                   source=store.csv_path)
             elif choice == "c":
-                clear_csv()
+                clear_csv(store)
             elif choice == "d":
                 sample_data = read_sample_portfolio()
                 if sample_data is not None:
-                    await calculate_portfolio_value(sample_data)
+                    await evaluate(sample_data, fetcher, profiler, settings,
+                                   snapshots=snapshots, source="sample.csv")
+            elif choice == "r":
+                data = read_portfolio(store)
+                if data is not None:
+                    await evaluate(data, fetcher, profiler, settings, refresh=True,
+                                   snapshots=snapshots, source=store.csv_path)
+            elif choice == "l":
+                bulk_load(store)
             elif choice == 'q':
                 print("Thank you for using Portfolio Analyzer!")
                 print("=" * 50)
                 break
             else:
-                print("Invalid choice. Please select 'a', 'b', 'c', 'd', or 'q'.")
+                print("Invalid choice. Please select 'a', 'b', 'c', 'd', 'r', 'l', or 'q'.")
                 print("-" * 40)
             
             print("\n")
@@ -280,9 +396,44 @@ async def main():
     except Exception as e:
         print(f"\nUnexpected error occurred: {e}")
         print("The program will now exit.")
+    finally:
+        fetcher.close()
+        store.close()
+        if snapshots is not None:
+            snapshots.close()
+        if metrics_path:
+            metrics.write(metrics_path)
+
+
+# headless sub-commands: name -> (module, help text)
+COMMANDS = {
+    "value": ("batch_cli", "value portfolio files and write JSON/CSV results"),
+    "bulk": ("bulk", "total many account files at once as a sparse holdings matrix"),
+    "history": ("price_history", "daily portfolio value over a date range"),
+    "risk": ("risk", "volatility, correlation, beta and VaR of the holdings"),
+    "optimize": ("optimizer", "efficient frontier and rebalancing trades, offline"),
+    "watch": ("watch", "keep the portfolio value current with periodic refreshes"),
+    "serve": ("service", "value posted portfolios over HTTP for many clients"),
+}
+
+
+# run a sub-command such as `python main.py value portfolios/`
+def run_command(argv):
+    name = argv[0]
+    if name not in COMMANDS:
+        print(f"Unknown command '{name}'. Available commands:")
+        for command, (module, help_text) in COMMANDS.items():
+            print(f"  {command:10} {help_text}")
+        print("Run without arguments for the interactive menu.")
+        return 2
+    module = importlib.import_module(COMMANDS[name][0])
+    return module.run(argv[1:])
 
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        sys.exit(run_command(sys.argv[1:]))
+
     # exception handling
     try:
         asyncio.run(main())
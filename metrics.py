@@ -0,0 +1,276 @@
+"""Opt-in timers, counters and latency histograms for valuation runs.
+
+Instrumentation is off by default and every recording call returns at
+once, so the hot paths pay one attribute check. It is switched on by
+setting PORTFOLIO_METRICS to an output file (``.json`` for JSON,
+anything else for Prometheus text) or by calling metrics.enable().
+
+    with metrics.stage("fetch"):
+        ...
+    metrics.observe("quote_request_seconds", elapsed, kind="batch")
+    metrics.count("quote_retries_total")
+
+PORTFOLIO_PROFILE=cprofile or tracemalloc profiles a single valuation
+run, see Profiler.
+"""
+import json
+import os
+import sys
+import time
+
+
+# upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+PROFILERS = ("cprofile", "tracemalloc")
+
+# lines of profiler output printed after a profiled run
+PROFILE_LINES = 20
+
+
+class _NullStage:
+    """Stands in for a Stage while metrics are disabled."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class Stage:
+    """Times a with-block and adds it to the stage's total."""
+
+    __slots__ = ("metrics", "name", "started")
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe_stage(self.name, time.perf_counter() - self.started)
+        return False
+
+
+class Histogram:
+    """Cumulative bucket counts, sum and count, as Prometheus keeps them."""
+
+    __slots__ = ("bounds", "buckets", "sum", "count")
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.buckets = [0] * len(bounds)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(self.bounds):
+            if value <= bound:
+                self.buckets[i] += 1
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding quantile q, inf past the last one."""
+        rank = q * self.count
+        for bound, cumulative in zip(self.bounds, self.buckets):
+            if cumulative >= rank:
+                return bound
+        return float("inf")
+
+
+def _label_text(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+class Metrics:
+    """Registry of counters, stage timers and histograms.
+
+    Metric keys are (name, labels) with labels a sorted tuple of
+    (key, value) pairs.
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.counters = {}
+        self.stages = {}        # name -> [seconds, calls]
+        self.histograms = {}
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        self.counters.clear()
+        self.stages.clear()
+        self.histograms.clear()
+
+    def stage(self, name):
+        if not self.enabled:
+            return _NULL_STAGE
+        return Stage(self, name)
+
+    def observe_stage(self, name, seconds):
+        entry = self.stages.setdefault(name, [0.0, 0])
+        entry[0] += seconds
+        entry[1] += 1
+
+    def count(self, name, value=1, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        histogram.observe(value)
+
+    def counter(self, name, **labels):
+        return self.counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def cache_hit_ratio(self):
+        hits = self.counter("quote_cache_hits_total")
+        lookups = hits + self.counter("quote_cache_misses_total")
+        return hits / lookups if lookups else None
+
+    def snapshot(self):
+        """Everything recorded so far as plain dicts and lists."""
+        return {
+            "stages": {name: {"seconds": seconds, "calls": calls}
+                       for name, (seconds, calls) in self.stages.items()},
+            "counters": [{"name": name, "labels": dict(labels), "value": value}
+                         for (name, labels), value in self.counters.items()],
+            "histograms": [{
+                "name": name,
+                "labels": dict(labels),
+                "count": h.count,
+                "sum": h.sum,
+                "buckets": dict(zip(map(str, h.bounds), h.buckets)),
+                # None past the last bucket, JSON has no infinity
+                **{f"p{round(q * 100)}": (h.quantile(q) if h.quantile(q) != float("inf") else None)
+                   for q in (0.5, 0.95, 0.99)},
+            } for (name, labels), h in self.histograms.items()],
+            "cache_hit_ratio": self.cache_hit_ratio(),
+        }
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=2)
+
+    def to_prometheus(self, prefix="portfolio_"):
+        lines = []
+        if self.stages:
+            lines.append(f"# TYPE {prefix}stage_seconds_total counter")
+            for name, (seconds, calls) in self.stages.items():
+                lines.append(f'{prefix}stage_seconds_total{{stage="{name}"}} {seconds:.6f}')
+            lines.append(f"# TYPE {prefix}stage_calls_total counter")
+            for name, (seconds, calls) in self.stages.items():
+                lines.append(f'{prefix}stage_calls_total{{stage="{name}"}} {calls}')
+
+        for name in sorted({name for name, labels in self.counters}):
+            lines.append(f"# TYPE {prefix}{name} counter")
+            for (counter_name, labels), value in self.counters.items():
+                if counter_name == name:
+                    lines.append(f"{prefix}{name}{_label_text(labels)} {value}")
+
+        for name in sorted({name for name, labels in self.histograms}):
+            lines.append(f"# TYPE {prefix}{name} histogram")
+            for (histogram_name, labels), h in self.histograms.items():
+                if histogram_name != name:
+                    continue
+                for bound, cumulative in zip(h.bounds, h.buckets):
+                    bucket_labels = labels + (("le", f"{bound:g}"),)
+                    lines.append(f"{prefix}{name}_bucket{_label_text(bucket_labels)} {cumulative}")
+                lines.append(f"{prefix}{name}_bucket{_label_text(labels + (('le', '+Inf'),))}"
+                             f" {h.count}")
+                lines.append(f"{prefix}{name}_sum{_label_text(labels)} {h.sum:.6f}")
+                lines.append(f"{prefix}{name}_count{_label_text(labels)} {h.count}")
+
+        ratio = self.cache_hit_ratio()
+        if ratio is not None:
+            lines.append(f"# TYPE {prefix}quote_cache_hit_ratio gauge")
+            lines.append(f"{prefix}quote_cache_hit_ratio {ratio:.6f}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """Write JSON for a .json path, Prometheus text format otherwise."""
+        text = self.to_json() if path.endswith(".json") else self.to_prometheus()
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+
+
+metrics = Metrics()
+
+
+# turn metrics on when PORTFOLIO_METRICS names an output file, returns the path
+def enable_from_env():
+    path = os.environ.get("PORTFOLIO_METRICS")
+    if path:
+        metrics.enable()
+    return path
+
+
+class Profiler:
+    """Profiles one run with cProfile or tracemalloc.
+
+    `kind` None (the default reads PORTFOLIO_PROFILE) or an empty string
+    does nothing. The top entries go to `out`; with `output` set, cProfile
+    stats are also saved there for pstats or snakeviz.
+    """
+
+    def __init__(self, kind=None, output=None, out=None):
+        if kind is None:
+            kind = os.environ.get("PORTFOLIO_PROFILE", "")
+        kind = kind.lower()
+        if kind and kind not in PROFILERS:
+            raise ValueError(f"Unknown profiler '{kind}'. Choose one of: {', '.join(PROFILERS)}")
+        self.kind = kind
+        self.output = output
+        self.out = out or sys.stderr
+        self._profiler = None
+
+    def __enter__(self):
+        if self.kind == "cprofile":
+            import cProfile
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        elif self.kind == "tracemalloc":
+            import tracemalloc
+            tracemalloc.start()
+        return self
+
+    def __exit__(self, *exc):
+        if self.kind == "cprofile":
+            import pstats
+            self._profiler.disable()
+            stats = pstats.Stats(self._profiler, stream=self.out)
+            stats.sort_stats("cumulative").print_stats(PROFILE_LINES)
+            if self.output:
+                stats.dump_stats(self.output)
+        elif self.kind == "tracemalloc":
+            import tracemalloc
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(f"Memory: {current / 1e6:.1f} MB still allocated, peak {peak / 1e6:.1f} MB",
+                  file=self.out)
+            for stat in snapshot.statistics("lineno")[:PROFILE_LINES]:
+                print(f"  {stat}", file=self.out)
+        return False
@@ -0,0 +1,629 @@
+"""Mean-variance optimization and rebalancing of the holdings.
+
+    python main.py optimize portfolio.csv --target max-sharpe --cash 5000 --lot 1
+
+Works offline on the daily closes kept by the price history store (see
+price_history.py; --update fetches what is missing first). Expected
+returns and the covariance are annualized from daily returns, and the
+covariance is shrunk towards a scaled identity (Ledoit-Wolf) so it stays
+well conditioned with more assets than days. Portfolios are long-only
+and fully invested, optionally with a cap per asset. Prices are
+converted into the base currency with the stored closes of the exchange
+rate pairs (AUDUSD=X and so on), so weights, trades and cash all add up
+in one currency.
+
+The solver minimizes w'Cw - lambda * m'w over the capped simplex with
+accelerated projected gradient steps (FISTA with adaptive restart),
+which find the assets at zero or at the cap; the remaining weights are
+then solved for exactly as one linear system. The frontier is traced
+over a grid of lambda, each point starting from the one before, and the
+max-Sharpe portfolio is a golden-section search along it. An Optimizer
+keeps its solutions (and can save them next to the price store), so a
+re-optimization after the inputs moved a little starts with the right
+assets and mostly needs a single solve per point.
+"""
+import argparse
+import math
+import os
+import sys
+import time
+from datetime import date, timedelta
+
+import numpy as np
+
+from fx import base_currency, rate_pairs
+from portfolio_loader import load_portfolio
+from price_history import DEFAULT_DIRECTORY, PriceHistoryStore, base_price_matrix, parse_date
+from quote_provider import get_provider
+from risk import TRADING_DAYS, daily_returns
+
+
+TARGETS = ("max-sharpe", "min-variance")
+
+# frontier points traced between the minimum-variance and the highest-return portfolio
+DEFAULT_POINTS = 25
+
+# solver stops when no weight moves by more than this in an iteration
+DEFAULT_TOLERANCE = 1e-9
+
+MAX_ITERATIONS = 20_000
+
+# iterations the set of assets at zero or at the cap must hold before it is solved for
+SUPPORT_STEADY = 5
+
+# the max-Sharpe lambda is found to this relative precision
+SHARPE_TOLERANCE = 1e-6
+
+# relative width of the first bracket searched around the last max-Sharpe lambda
+SHARPE_BRACKET = 0.1
+
+STATE_FILE = "optimizer_state.npz"
+
+_GOLDEN = (math.sqrt(5) - 1) / 2
+
+
+def shrunk_covariance(returns):
+    """Ledoit-Wolf shrinkage of the sample covariance towards m * I.
+
+    `m` is the average variance; the shrinkage intensity is estimated
+    from the returns, so short histories are shrunk more.
+    """
+    n, p = returns.shape
+    centered = returns - returns.mean(axis=0)
+    sample = centered.T @ centered / n
+    mu = np.trace(sample) / p
+    target_distance = ((sample - mu * np.eye(p)) ** 2).sum()
+    if target_distance == 0:
+        return sample * n / max(n - 1, 1)
+    # sum over days of ||x x' - S||^2, from the row norms without forming x x'
+    norms = (centered ** 2).sum(axis=1)
+    spread = ((norms ** 2).sum() - n * (sample ** 2).sum()) / n ** 2
+    shrinkage = min(max(spread, 0.0), target_distance) / target_distance
+    covariance = shrinkage * mu * np.eye(p) + (1 - shrinkage) * sample
+    return covariance * n / max(n - 1, 1)
+
+
+def annualized_inputs(prices):
+    """(expected returns, covariance), annualized, from a days x assets price matrix."""
+    returns = daily_returns(prices)
+    if len(returns) < 2:
+        raise ValueError("at least three days of prices are needed")
+    return returns.mean(axis=0) * TRADING_DAYS, shrunk_covariance(returns) * TRADING_DAYS
+
+
+def project(v, cap=None):
+    """Euclidean projection of `v` onto {w : sum(w) = 1, 0 <= w <= cap}."""
+    if cap is None:
+        # sort-based projection onto the simplex
+        u = np.sort(v)[::-1]
+        cumulative = np.cumsum(u) - 1
+        k = np.arange(1, len(v) + 1)
+        rho = np.nonzero(u > cumulative / k)[0][-1]
+        return np.maximum(v - cumulative[rho] / (rho + 1), 0.0)
+    if cap * len(v) <= 1 + 1e-12:
+        # a cap of exactly 1/n leaves equal weights as the only choice;
+        # Optimizer.optimize() refuses caps below that
+        return np.full(len(v), 1.0 / len(v))
+    # with a cap, sum(clip(v - t, 0, cap)) is piecewise linear in t with kinks
+    # at v and v - cap; walk the kinks downwards to the one where it passes 1
+    kinks = np.concatenate([v, v - cap])
+    order = np.argsort(kinks)[::-1]
+    kinks = kinks[order]
+    # entries start counting below v and stop growing below v - cap
+    active = np.cumsum(np.where(order < len(v), 1, -1))
+    totals = np.concatenate([[0.0], np.cumsum(active[:-1] * -np.diff(kinks))])
+    k = int(np.searchsorted(totals, 1.0))
+    threshold = kinks[k - 1] - (1.0 - totals[k - 1]) / active[k - 1]
+    return np.clip(v - threshold, 0.0, cap)
+
+
+def largest_eigenvalue(matrix, start=None, tol=1e-10, max_iter=1000):
+    """(eigenvalue, eigenvector) by power iteration, from `start` if given."""
+    vector = np.ones(len(matrix)) if start is None else start.copy()
+    vector /= np.linalg.norm(vector)
+    value = 0.0
+    for _ in range(max_iter):
+        product = matrix @ vector
+        new_value = float(vector @ product)
+        vector = product / np.linalg.norm(product)
+        if abs(new_value - value) <= tol * abs(new_value):
+            break
+        value = new_value
+    return new_value, vector
+
+
+def _exact(cov, mean, lam, w, cap):
+    """The optimum for the support of `w`, or None when it is not optimal.
+
+    With the assets at zero and at the cap fixed, the free weights solve
+    a linear system; the answer is kept if it stays inside the bounds
+    and the fixed assets' gradients say none of them should move.
+    """
+    at_cap = np.zeros(len(w), dtype=bool) if cap is None else w >= cap
+    free = (w > 0) & ~at_cap
+    if not free.any():
+        return None
+    fixed = cap * at_cap.sum() if cap is not None else 0.0
+    rhs = lam * mean[free]
+    if at_cap.any():
+        rhs = rhs - 2 * cap * cov[np.ix_(free, at_cap)].sum(axis=1)
+    try:
+        solved = np.linalg.solve(cov[np.ix_(free, free)], np.column_stack([rhs, np.ones(free.sum())]))
+    except np.linalg.LinAlgError:
+        return None
+    a, b = solved[:, 0] / 2, solved[:, 1] / 2
+    # the budget multiplier makes the weights sum to one
+    nu = (1 - fixed - a.sum()) / b.sum()
+    weights = np.zeros(len(w))
+    weights[free] = a + nu * b
+    weights[at_cap] = cap if cap is not None else 0.0
+    if (weights[free] <= 0).any() or (cap is not None and (weights[free] >= cap).any()):
+        return None
+    gradient = 2 * (cov @ weights) - lam * mean
+    slack = 1e-9 * (np.abs(gradient).max() + abs(nu) + 1e-12)
+    if (gradient[~free & ~at_cap] < nu - slack).any() or (gradient[at_cap] > nu + slack).any():
+        return None
+    return weights
+
+
+def solve(cov, mean, lam, start, step, cap=None, tol=DEFAULT_TOLERANCE, max_iter=MAX_ITERATIONS):
+    """Minimize w'Cw - lam * m'w over the capped simplex, starting at `start`.
+
+    `step` is 1 / the gradient's Lipschitz constant (2 * the largest
+    eigenvalue of C). Projected gradient steps find which assets are at
+    zero or at the cap; once that stops changing the free weights are
+    solved for exactly. A start next to the answer usually has the right
+    assets already and needs one solve. Returns (weights, iterations).
+    """
+    w = project(start, cap)
+    y = w
+    t = 1.0
+    lam_mean = lam * mean
+    support = None
+    steady = SUPPORT_STEADY
+    for iteration in range(1, max_iter + 1):
+        if steady >= SUPPORT_STEADY:
+            steady = -max_iter
+            exact = _exact(cov, mean, lam, w, cap)
+            if exact is not None:
+                return exact, iteration
+        gradient = 2 * (cov @ y) - lam_mean
+        new_w = project(y - step * gradient, cap)
+        if np.abs(new_w - w).max() <= tol:
+            return new_w, iteration
+        new_support = (new_w > 0).tobytes() if cap is None else (
+            (new_w > 0).tobytes() + (new_w >= cap).tobytes())
+        if new_support == support:
+            steady += 1
+        else:
+            support = new_support
+            steady = 0
+        # restart the momentum when it points uphill
+        if (y - new_w) @ (new_w - w) > 0:
+            t = 1.0
+            y = new_w
+        else:
+            new_t = (1 + math.sqrt(1 + 4 * t * t)) / 2
+            y = new_w + ((t - 1) / new_t) * (new_w - w)
+            t = new_t
+        w = new_w
+    return w, max_iter
+
+
+def portfolio_stats(weights, mean, cov, risk_free=0.0):
+    """(expected return, volatility, Sharpe ratio), annualized."""
+    ret = float(weights @ mean)
+    vol = math.sqrt(max(float(weights @ cov @ weights), 0.0))
+    return ret, vol, (ret - risk_free) / vol if vol > 0 else math.nan
+
+
+def _sharpe_key(point):
+    return -math.inf if math.isnan(point.sharpe) else point.sharpe
+
+
+def _golden_section(point_at, lo, hi):
+    """Frontier point of the best Sharpe ratio for lambda in [lo, hi]."""
+    a, b = lo, hi
+    c, d = b - _GOLDEN * (b - a), a + _GOLDEN * (b - a)
+    while b - a > SHARPE_TOLERANCE * max(b, 1e-12):
+        if _sharpe_key(point_at(c)) >= _sharpe_key(point_at(d)):
+            b, d = d, c
+            c = b - _GOLDEN * (b - a)
+        else:
+            a, c = c, d
+            d = a + _GOLDEN * (b - a)
+    return max((point_at(a), point_at(c), point_at(b)), key=_sharpe_key)
+
+
+class FrontierPoint:
+    """One portfolio on the efficient frontier."""
+
+    __slots__ = ("lam", "weights", "ret", "vol", "sharpe")
+
+    def __init__(self, lam, weights, ret, vol, sharpe):
+        self.lam = lam
+        self.weights = weights
+        self.ret = ret
+        self.vol = vol
+        self.sharpe = sharpe
+
+
+class Frontier:
+    """Outcome of Optimizer.optimize()."""
+
+    def __init__(self, symbols, points, min_variance, max_sharpe, iterations, seconds):
+        self.symbols = symbols
+        self.points = points              # FrontierPoints by increasing lambda
+        self.min_variance = min_variance
+        self.max_sharpe = max_sharpe
+        self.iterations = iterations      # solver iterations over all points
+        self.seconds = seconds
+
+
+class Optimizer:
+    """Efficient frontier, minimum-variance and max-Sharpe portfolios.
+
+    The solutions of the last optimize() call are kept and used as
+    starting points for the next one. Symbols that were not in the last
+    call start at zero weight, symbols that left are dropped.
+    """
+
+    def __init__(self, max_weight=None, risk_free=0.0, points=DEFAULT_POINTS,
+                 tol=DEFAULT_TOLERANCE):
+        if max_weight is not None and not 0 < max_weight <= 1:
+            raise ValueError("max_weight must be in (0, 1]")
+        if points < 2:
+            raise ValueError("points must be at least 2")
+        self.max_weight = max_weight
+        self.risk_free = risk_free
+        self.points = points
+        self.tol = tol
+        self._symbols = None
+        self._weights = None       # points x symbols, the last frontier
+        self._sharpe = None        # (lambda, weights) of the last max-Sharpe portfolio
+        self._eigenvector = None
+
+    def _starts(self, symbols):
+        """Previous frontier weights rearranged for `symbols`, or None."""
+        if self._symbols is None:
+            return None, None, None
+        if self._symbols == symbols:
+            return self._weights, self._sharpe, self._eigenvector
+        old = {symbol: i for i, symbol in enumerate(self._symbols)}
+        columns = np.array([old.get(symbol, -1) for symbol in symbols])
+        known = columns >= 0
+        if not known.any():
+            return None, None, None
+
+        def remap(matrix):
+            result = np.zeros(matrix.shape[:-1] + (len(symbols),))
+            result[..., known] = matrix[..., columns[known]]
+            return result
+
+        sharpe = (self._sharpe[0], remap(self._sharpe[1])) if self._sharpe is not None else None
+        vector = remap(self._eigenvector) + 1e-3
+        return remap(self._weights), sharpe, vector
+
+    def optimize(self, symbols, mean, cov):
+        started = time.perf_counter()
+        symbols = list(symbols)
+        mean = np.asarray(mean, dtype=float)
+        cov = np.asarray(cov, dtype=float)
+        n = len(symbols)
+        cap = self.max_weight
+        if cap is not None and cap * n < 1 - 1e-12:
+            raise ValueError(f"a max weight of {cap:g} cannot be met with {n} assets, "
+                             f"it needs at least {math.ceil(1 / cap - 1e-9)}")
+        starts, sharpe_start, vector = self._starts(symbols)
+
+        eigenvalue, vector = largest_eigenvalue(cov, vector)
+        # a little slack, power iteration approaches the eigenvalue from below
+        step = 1 / (2 * eigenvalue * 1.01)
+        spread = float(mean.max() - mean.min())
+        scale = 2 * eigenvalue / spread if spread > 0 else 1.0
+        lambdas = np.concatenate([[0.0], scale * np.geomspace(1e-3, 1e2, self.points - 1)])
+
+        iterations = 0
+        points = []
+        weights = np.full(n, 1.0 / n)
+        for k, lam in enumerate(lambdas):
+            start = starts[k] if starts is not None and k < len(starts) else weights
+            weights, used = solve(cov, mean, lam, start, step, cap, self.tol)
+            iterations += used
+            points.append(FrontierPoint(lam, weights, *portfolio_stats(
+                weights, mean, cov, self.risk_free)))
+
+        # the best frontier point brackets the max-Sharpe portfolio with its neighbours
+        best = max(range(len(points)), key=lambda k: _sharpe_key(points[k]))
+        lo = lambdas[max(best - 1, 0)]
+        hi = lambdas[min(best + 1, len(lambdas) - 1)]
+        solved = {p.lam: p for p in points[max(best - 1, 0):best + 2]}
+
+        def point_at(lam):
+            nonlocal iterations
+            if lam not in solved:
+                nearest = min(solved.values(), key=lambda p: abs(p.lam - lam))
+                w, used = solve(cov, mean, lam, nearest.weights, step, cap, self.tol)
+                iterations += used
+                solved[lam] = FrontierPoint(lam, w, *portfolio_stats(
+                    w, mean, cov, self.risk_free))
+            return solved[lam]
+
+        if sharpe_start is not None and lo < sharpe_start[0] < hi:
+            # look next to the last answer first; when the best point comes out
+            # at the edge of that narrow bracket the answer moved further
+            lam = sharpe_start[0]
+            w, used = solve(cov, mean, lam, sharpe_start[1], step, cap, self.tol)
+            iterations += used
+            solved[lam] = FrontierPoint(lam, w, *portfolio_stats(w, mean, cov, self.risk_free))
+            a = max(lo, lam * (1 - SHARPE_BRACKET))
+            b = min(hi, lam * (1 + SHARPE_BRACKET))
+            max_sharpe = _golden_section(point_at, a, b)
+            edge = (b - a) * 0.01
+            if (max_sharpe.lam - a < edge and a > lo) or (b - max_sharpe.lam < edge and b < hi):
+                max_sharpe = _golden_section(point_at, lo, hi)
+        else:
+            max_sharpe = _golden_section(point_at, lo, hi)
+        max_sharpe = max([max_sharpe, points[best]], key=_sharpe_key)
+
+        self._symbols = symbols
+        self._weights = np.array([p.weights for p in points])
+        self._sharpe = (max_sharpe.lam, max_sharpe.weights)
+        self._eigenvector = vector
+        return Frontier(symbols, points, points[0], max_sharpe, iterations,
+                        time.perf_counter() - started)
+
+    def save(self, path):
+        """Keep the last solutions in an .npz file for the next run's warm start."""
+        if self._symbols is None:
+            return
+        tmp_path = path + ".tmp.npz"
+        np.savez(tmp_path, symbols=np.array(self._symbols), weights=self._weights,
+                 sharpe_lambda=self._sharpe[0], sharpe_weights=self._sharpe[1],
+                 eigenvector=self._eigenvector)
+        os.replace(tmp_path, path)
+
+    def load(self, path):
+        """Start from the solutions saved by save(); a missing or stale file is ignored."""
+        try:
+            with np.load(path) as state:
+                symbols = state["symbols"].tolist()
+                weights = state["weights"]
+                sharpe = (float(state["sharpe_lambda"]), state["sharpe_weights"])
+                vector = state["eigenvector"]
+        except (OSError, KeyError, ValueError):
+            return False
+        if weights.shape != (self.points, len(symbols)):
+            return False
+        self._symbols, self._weights, self._sharpe, self._eigenvector = (
+            symbols, weights, sharpe, vector)
+        return True
+
+
+class Rebalance:
+    """Share trades that move the holdings to target weights."""
+
+    def __init__(self, symbols, quantities, prices, targets, weights, cash, value):
+        self.symbols = symbols
+        self.quantities = quantities      # held now
+        self.prices = prices
+        self.targets = targets            # held after the trades
+        self.weights = weights            # target weights
+        self.trades = targets - quantities
+        self.cash = cash                  # left after the trades
+        self.value = value                # holdings plus cash
+
+    @property
+    def bought(self):
+        return float(np.clip(self.trades, 0, None) @ self.prices)
+
+    @property
+    def sold(self):
+        return float(-np.clip(self.trades, None, 0) @ self.prices)
+
+
+def rebalance(symbols, quantities, prices, weights, cash=0.0, lot=1.0):
+    """Trades from `quantities` to the target `weights`, in whole lots.
+
+    The holdings plus `cash` are spread by weight and rounded down to
+    lots of `lot` shares (a number or one per symbol), so the trades
+    never spend more than the sales and the cash bring in. What the
+    rounding leaves is spent a lot at a time on the positions furthest
+    below target, while a lot is closer to the target than none.
+    """
+    quantities = np.asarray(quantities, dtype=float)
+    prices = np.asarray(prices, dtype=float)
+    weights = np.asarray(weights, dtype=float)
+    lots = np.broadcast_to(np.asarray(lot, dtype=float), prices.shape)
+    if cash < 0:
+        raise ValueError("cash cannot be negative")
+    if (lots <= 0).any():
+        raise ValueError("lot sizes must be positive")
+    if (prices <= 0).any() or not np.isfinite(prices).all():
+        raise ValueError("every symbol needs a positive price")
+
+    value = float(quantities @ prices) + cash
+    target_values = weights * value
+    lot_costs = prices * lots
+    # a hair of slack so 9.999999 lots from float error still count as 10
+    targets = np.floor(target_values / lot_costs + 1e-9) * lots
+    left = value - float(targets @ prices)
+
+    shortfall = target_values - targets * prices
+    while True:
+        wanted = (lot_costs <= left + 1e-9) & (shortfall > lot_costs / 2)
+        if not wanted.any():
+            break
+        i = int(np.argmax(np.where(wanted, shortfall, -np.inf)))
+        targets[i] += lots[i]
+        shortfall[i] -= lot_costs[i]
+        left -= lot_costs[i]
+    return Rebalance(list(symbols), quantities, prices, targets, weights, max(left, 0.0), value)
+
+
+def show_frontier(frontier, current=None):
+    print(f"Efficient frontier ({len(frontier.symbols)} assets, {frontier.iterations} "
+          f"solver iterations in {frontier.seconds * 1000:.0f} ms)")
+    print(f"  {'Return':>8} {'Volatility':>11} {'Sharpe':>7}")
+    shown = set()
+    for point in frontier.points:
+        key = (round(point.ret, 4), round(point.vol, 4))
+        if key in shown:
+            continue
+        shown.add(key)
+        print(f"  {point.ret * 100:7.2f}% {point.vol * 100:10.2f}% {point.sharpe:7.2f}")
+    for label, point in (("Current", current), ("Minimum variance", frontier.min_variance),
+                         ("Maximum Sharpe", frontier.max_sharpe)):
+        if point is not None:
+            print(f"{label + ':':18} return {point.ret * 100:6.2f}%, volatility "
+                  f"{point.vol * 100:6.2f}%, Sharpe {point.sharpe:5.2f}")
+
+
+def show_rebalance(plan, base, top=30):
+    """The `top` largest trades by value, then the totals in `base`."""
+    current_weights = plan.quantities * plan.prices / plan.value
+    print(f"\n{'Symbol':12} {'Weight':>7} {'Target':>7} {'Shares':>12} {'Target':>12} "
+          f"{'Trade':>12} {'Value ' + base:>14}")
+    order = np.argsort(-np.abs(plan.trades * plan.prices), kind="stable")
+    for i in order[:top]:
+        print(f"{plan.symbols[i]:12} {current_weights[i] * 100:6.2f}% {plan.weights[i] * 100:6.2f}% "
+              f"{plan.quantities[i]:12g} {plan.targets[i]:12g} {plan.trades[i]:+12g} "
+              f"{plan.trades[i] * plan.prices[i]:+14,.2f}")
+    if len(order) > top:
+        print(f"... and {len(order) - top} more")
+    print(f"\nBuy {plan.bought:,.2f} {base}, sell {plan.sold:,.2f} {base}, cash left "
+          f"{plan.cash:,.2f} {base} of {plan.value:,.2f} {base}")
+
+
+def write_frontier(frontier, path):
+    with open(path, "w") as f:
+        f.write("lambda,return,volatility,sharpe," + ",".join(frontier.symbols) + "\n")
+        for point in frontier.points:
+            f.write(f"{point.lam:.6g},{point.ret:.6f},{point.vol:.6f},{point.sharpe:.6f},"
+                    + ",".join(f"{w:.6f}" for w in point.weights) + "\n")
+
+
+def optimize_holdings(symbols, quantities, store, start, end, target="max-sharpe", cash=0.0,
+                      lot=1.0, max_weight=None, risk_free=0.0, points=DEFAULT_POINTS,
+                      frontier_path=None, warm_start=True, base=None):
+    """Optimize and rebalance holdings from the stored price history.
+
+    Prices, `cash` and the trade values are in the `base` currency.
+    Prints the frontier and the trades. Symbols without history keep
+    their quantities and are left out. Returns (frontier, rebalance),
+    or None when there is not enough history.
+    """
+    base = base or base_currency()
+    dates, matrix = base_price_matrix(store, symbols, start, end, base)
+    if len(dates) < 3:
+        print("Not enough stored price history for this range; run with --update, "
+              "or `main.py history` for the holdings first.")
+        return None
+    # only assets with a price over the whole range can be optimized
+    usable = ~np.isnan(matrix).any(axis=0)
+    missing = [s for s, ok in zip(symbols, usable) if not ok]
+    if not usable.any():
+        print("No holding has stored prices over the whole range.")
+        return None
+    if missing:
+        print(f"Left out, without prices for the whole range: {', '.join(missing)}")
+    symbols = [s for s, ok in zip(symbols, usable) if ok]
+    quantities = np.asarray(quantities, dtype=float)[usable]
+    matrix = matrix[:, usable]
+
+    mean, cov = annualized_inputs(matrix)
+    optimizer = Optimizer(max_weight=max_weight, risk_free=risk_free, points=points)
+    state_path = os.path.join(store.directory, STATE_FILE)
+    if warm_start:
+        optimizer.load(state_path)
+    frontier = optimizer.optimize(symbols, mean, cov)
+    if warm_start:
+        optimizer.save(state_path)
+
+    prices = matrix[-1]
+    current_weights = quantities * prices / float(quantities @ prices)
+    current = FrontierPoint(None, current_weights,
+                            *portfolio_stats(current_weights, mean, cov, risk_free))
+    print(f"Price history {dates[0]} to {dates[-1]} ({len(dates)} days)")
+    show_frontier(frontier, current)
+    if frontier_path:
+        write_frontier(frontier, frontier_path)
+        print(f"Frontier written to {frontier_path}")
+
+    chosen = frontier.max_sharpe if target == "max-sharpe" else frontier.min_variance
+    plan = rebalance(symbols, quantities, prices, chosen.weights, cash, lot)
+    show_rebalance(plan, base)
+    return frontier, plan
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="main.py optimize",
+        description="Efficient frontier and rebalancing trades for the holdings, offline.")
+    parser.add_argument("path", nargs="?", default="portfolio.csv",
+                        help="portfolio csv file (default: portfolio.csv)")
+    parser.add_argument("--target", choices=TARGETS, default="max-sharpe",
+                        help="portfolio to rebalance to (default: max-sharpe)")
+    parser.add_argument("--start", type=parse_date,
+                        default=date.today() - timedelta(days=365),
+                        help="first day of history, YYYY-MM-DD (default: one year ago)")
+    parser.add_argument("--end", type=parse_date, default=date.today(),
+                        help="last day of history (default: today)")
+    parser.add_argument("--cash", type=float, default=0.0,
+                        help="cash available to invest, in the base currency")
+    parser.add_argument("--lot", type=float, default=1.0,
+                        help="shares per trading lot (default: 1; e.g. 0.001 for fractions)")
+    parser.add_argument("--max-weight", type=float, help="largest weight of one asset, e.g. 0.2")
+    parser.add_argument("--risk-free", type=float, default=0.0,
+                        help="annual risk-free rate for the Sharpe ratio (default: 0)")
+    parser.add_argument("--points", type=int, default=DEFAULT_POINTS,
+                        help=f"frontier points (default: {DEFAULT_POINTS})")
+    parser.add_argument("--frontier", help="write the frontier and its weights to this csv file")
+    parser.add_argument("--no-warm-start", action="store_true",
+                        help="ignore the solutions saved by earlier runs")
+    parser.add_argument("--base-currency",
+                        help="currency of prices and cash (default: PORTFOLIO_BASE_CURRENCY or USD)")
+    parser.add_argument("--update", action="store_true",
+                        help="fetch missing price history first (otherwise fully offline)")
+    parser.add_argument("--provider", help="quote provider for --update")
+    parser.add_argument("--store", default=DEFAULT_DIRECTORY,
+                        help=f"price history directory (default: {DEFAULT_DIRECTORY})")
+    return parser
+
+
+def run(argv):
+    args = build_parser().parse_args(argv)
+    if args.end < args.start:
+        print("Error: --end is before --start.", file=sys.stderr)
+        return 2
+    try:
+        result = load_portfolio(args.path)
+    except OSError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 2
+    if result.empty:
+        print("Portfolio is empty!", file=sys.stderr)
+        return 2
+
+    base = (args.base_currency or base_currency()).upper()
+    store = PriceHistoryStore(args.store)
+    try:
+        if args.update:
+            provider = get_provider(args.provider)
+            pairs = list(rate_pairs(result.tickers, base).values())
+            try:
+                store.update(provider, result.tickers + pairs, args.start, args.end)
+            except Exception as e:
+                print(f"Error fetching price history: {e}", file=sys.stderr)
+                return 2
+            if store.unfetched:
+                print(f"No history returned for: {', '.join(store.unfetched)} (will retry next run)",
+                      file=sys.stderr)
+        outcome = optimize_holdings(
+            result.tickers, result.quantities, store, args.start, args.end, args.target,
+            args.cash, args.lot, args.max_weight, args.risk_free, args.points, args.frontier,
+            warm_start=not args.no_warm_start, base=base)
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 2
+    return 0 if outcome is not None else 1
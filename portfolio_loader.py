@@ -0,0 +1,112 @@
+import csv
+import itertools
+
+
+# rows parsed per chunk, memory use is bounded by this and the symbol count
+DEFAULT_CHUNK_SIZE = 100_000
+
+# malformed lines kept for reporting, the rest are only counted
+MAX_REPORTED_ERRORS = 1000
+
+
+class LoadResult:
+    """Outcome of streaming a holdings file.
+
+    Holdings are kept as plain lists so small portfolios never need
+    pandas; the `holdings` DataFrame is only built when asked for.
+    """
+
+    def __init__(self, tickers, quantities, rows, errors, error_count):
+        self.tickers = tickers          # one entry per ticker, in first-seen order
+        self.quantities = quantities    # summed quantity for each ticker
+        self.rows = rows                # number of valid rows read
+        self.errors = errors            # [(line_number, reason)] for the first bad lines
+        self.error_count = error_count  # total number of bad lines
+        self._holdings = None
+
+    @property
+    def empty(self):
+        return not self.tickers
+
+    @property
+    def holdings(self):
+        """The holdings as a ticker/quantity DataFrame."""
+        if self._holdings is None:
+            import pandas as pd
+            self._holdings = pd.DataFrame({'ticker': self.tickers, 'quantity': self.quantities})
+        return self._holdings
+
+
+# check one parsed csv row, returns (ticker, quantity) or raises ValueError
+def parse_row(fields):
+    if len(fields) != 2:
+        raise ValueError(f"expected 2 fields (ticker,quantity), got {len(fields)}")
+
+    ticker = fields[0].strip()
+    if not ticker:
+        raise ValueError("missing ticker")
+
+    quantity_str = fields[1].strip()
+    try:
+        quantity = float(quantity_str)
+    except ValueError:
+        raise ValueError(f"quantity '{quantity_str}' is not a number") from None
+    if not quantity > 0:
+        raise ValueError(f"quantity must be positive, got '{quantity_str}'")
+    if quantity.is_integer():
+        quantity = int(quantity)
+    return ticker, quantity
+
+
+# stream a ticker,quantity csv file in chunks, aggregating as it goes
+def load_portfolio(path, chunk_size=DEFAULT_CHUNK_SIZE):
+    totals = {}
+    rows = 0
+    errors = []
+    error_count = 0
+
+    with open(path, newline='') as f:
+        reader = csv.reader(f)
+        while True:
+            # pair every row with its line number as it is read
+            chunk = [(reader.line_num, fields)
+                     for fields in itertools.islice(reader, chunk_size)]
+            if not chunk:
+                break
+
+            for line_number, fields in chunk:
+                # blank lines (and the single empty line left by a clear) are skipped
+                if not fields or fields == ['']:
+                    continue
+                try:
+                    ticker, quantity = parse_row(fields)
+                except ValueError as e:
+                    error_count += 1
+                    if len(errors) < MAX_REPORTED_ERRORS:
+                        errors.append((line_number, str(e)))
+                    continue
+                totals[ticker] = totals.get(ticker, 0) + quantity
+                rows += 1
+
+    return LoadResult(list(totals.keys()), list(totals.values()), rows, errors, error_count)
+
+
+# print a short summary of a loaded portfolio instead of the whole frame
+def show_summary(title, result, head=20, max_errors=10):
+    print(f"{title}: {result.rows} rows, {len(result.tickers)} symbols")
+    if not result.empty:
+        shown = list(zip(result.tickers[:head], result.quantities[:head]))
+        ticker_width = max(len("ticker"), *(len(t) for t, q in shown))
+        quantity_width = max(len("quantity"), *(len(str(q)) for t, q in shown))
+        print(f"{'ticker':>{ticker_width}}  {'quantity':>{quantity_width}}")
+        for ticker, quantity in shown:
+            print(f"{ticker:>{ticker_width}}  {quantity!s:>{quantity_width}}")
+        if len(result.tickers) > head:
+            print(f"... and {len(result.tickers) - head} more symbols")
+
+    if result.error_count:
+        print(f"\nSkipped {result.error_count} malformed line(s):")
+        for line_number, reason in result.errors[:max_errors]:
+            print(f"  line {line_number}: {reason}")
+        if result.error_count > max_errors:
+            print(f"  ... and {result.error_count - max_errors} more")
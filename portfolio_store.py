@@ -0,0 +1,201 @@
+import json
+import os
+import sqlite3
+
+from portfolio_loader import DEFAULT_CHUNK_SIZE, LoadResult, load_portfolio
+
+
+DEFAULT_DB_PATH = "portfolio.db"
+DEFAULT_CSV_PATH = "portfolio.csv"
+
+# insert a holding, or add to the quantity of one that already exists
+UPSERT_ADD = ("INSERT INTO holdings (symbol, quantity) VALUES (?, ?)"
+              " ON CONFLICT(symbol) DO UPDATE SET quantity = quantity + excluded.quantity")
+
+
+class PortfolioStore:
+    """Holdings kept in SQLite, one row per symbol.
+
+    The symbol is the primary key, so lookups and in-place quantity
+    updates are indexed. `csv_path` stays the human-editable copy: every
+    change is exported to it, and edits made to it by hand are picked up
+    by sync_from_csv() the next time the store is read.
+    """
+
+    def __init__(self, path=DEFAULT_DB_PATH, csv_path=DEFAULT_CSV_PATH):
+        self.path = path
+        self.csv_path = csv_path
+        self._db = sqlite3.connect(path)
+        with self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS holdings ("
+                " symbol TEXT PRIMARY KEY,"
+                " quantity REAL NOT NULL)"
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS meta ("
+                " key TEXT PRIMARY KEY,"
+                " value TEXT)"
+            )
+
+    # --- reads ---
+
+    def get(self, symbol):
+        """Quantity held for `symbol`, or None."""
+        row = self._db.execute(
+            "SELECT quantity FROM holdings WHERE symbol = ?", (symbol,)).fetchone()
+        return None if row is None else _as_number(row[0])
+
+    def count(self):
+        return self._db.execute("SELECT COUNT(*) FROM holdings").fetchone()[0]
+
+    def rows(self):
+        """All holdings as a list of (symbol, quantity) pairs."""
+        return [(symbol, _as_number(quantity)) for symbol, quantity in self._db.execute(
+            "SELECT symbol, quantity FROM holdings ORDER BY rowid")]
+
+    def load(self):
+        """All holdings as a ticker/quantity DataFrame."""
+        import pandas as pd
+        rows = self._db.execute("SELECT symbol, quantity FROM holdings ORDER BY rowid").fetchall()
+        return pd.DataFrame({
+            'ticker': [symbol for symbol, quantity in rows],
+            'quantity': [_as_number(quantity) for symbol, quantity in rows],
+        })
+
+    # --- writes ---
+
+    def add_many(self, entries):
+        """Merge (symbol, quantity) pairs into the store in one transaction.
+
+        A symbol that is already held has the new quantity added to it.
+        """
+        with self._db:
+            self._db.executemany(UPSERT_ADD, entries)
+
+    def add(self, symbol, quantity):
+        self.add_many([(symbol, quantity)])
+
+    def set_quantity(self, symbol, quantity):
+        """Replace the quantity held for `symbol`."""
+        with self._db:
+            self._db.execute(
+                "INSERT INTO holdings (symbol, quantity) VALUES (?, ?)"
+                " ON CONFLICT(symbol) DO UPDATE SET quantity = excluded.quantity",
+                (symbol, quantity))
+
+    def remove(self, symbol):
+        with self._db:
+            self._db.execute("DELETE FROM holdings WHERE symbol = ?", (symbol,))
+
+    def clear(self):
+        """Drop every holding in a single transaction."""
+        with self._db:
+            self._db.execute("DELETE FROM holdings")
+
+    # --- csv import / export ---
+
+    def import_csv(self, path, replace=False, chunk_size=DEFAULT_CHUNK_SIZE):
+        """Load a ticker,quantity csv file in one transaction.
+
+        With replace=True the current holdings are dropped first. Returns
+        the LoadResult so malformed lines can be reported.
+        """
+        result = load_portfolio(path, chunk_size=chunk_size)
+        entries = zip(result.tickers, result.quantities)
+        with self._db:
+            if replace:
+                self._db.execute("DELETE FROM holdings")
+            self._db.executemany(UPSERT_ADD, entries)
+        return result
+
+    def export_csv(self, path=None, force=False):
+        """Write the holdings to csv, replacing the file atomically.
+
+        Lines of csv_path that could not be parsed are not in the store,
+        so rewriting csv_path while it has any raises ValueError, unless
+        `force` (as for clearing the portfolio) drops them on purpose.
+        """
+        path = path or self.csv_path
+        if path == self.csv_path and not force and self.unparsed_lines():
+            raise ValueError(f"{path} has {self.unparsed_lines()} malformed line(s); "
+                             f"fix or remove them first, saving would drop them")
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", newline="") as f:
+            for symbol, quantity in self._db.execute(
+                    "SELECT symbol, quantity FROM holdings ORDER BY rowid"):
+                f.write(f"{symbol},{_as_number(quantity)}\n")
+        os.replace(tmp_path, path)
+        if path == self.csv_path:
+            self._remember_csv()
+            self._forget_malformed()
+
+    def sync_from_csv(self):
+        """Re-import csv_path if it changed since the store last saw it.
+
+        Returns the LoadResult of the import, or None when the store was
+        already up to date. Raises FileNotFoundError (after emptying the
+        store) when the csv file does not exist.
+        """
+        try:
+            stat = os.stat(self.csv_path)
+        except FileNotFoundError:
+            self.clear()
+            self._set_meta("csv_signature", None)
+            self._forget_malformed()
+            raise
+
+        if self._get_meta("csv_signature") == _signature(stat):
+            return None
+        result = self.import_csv(self.csv_path, replace=True)
+        self._remember_csv()
+        self._set_meta("csv_malformed", result.error_count)
+        self._set_meta("csv_errors", json.dumps(result.errors))
+        return result
+
+    def unparsed_lines(self):
+        """Malformed lines csv_path had when it was last synced."""
+        return int(self._get_meta("csv_malformed") or 0)
+
+    def malformed_lines(self):
+        """[(line_number, reason)] for the first malformed lines of that sync."""
+        return [tuple(error) for error in json.loads(self._get_meta("csv_errors") or "[]")]
+
+    def _forget_malformed(self):
+        self._set_meta("csv_malformed", 0)
+        self._set_meta("csv_errors", None)
+
+    def _remember_csv(self):
+        self._set_meta("csv_signature", _signature(os.stat(self.csv_path)))
+
+    def _get_meta(self, key):
+        row = self._db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return None if row is None else row[0]
+
+    def _set_meta(self, key, value):
+        with self._db:
+            self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def close(self):
+        self._db.close()
+
+
+# size and modification time identify a version of the csv file
+def _signature(stat):
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+# whole-number quantities are shown without a trailing .0
+def _as_number(quantity):
+    if isinstance(quantity, float) and quantity.is_integer():
+        return int(quantity)
+    return quantity
+
+
+# wrap the store's current holdings as a LoadResult for display, with the
+# malformed lines of the last csv import that the store does not hold
+def store_result(store):
+    rows = store.rows()
+    return LoadResult([symbol for symbol, quantity in rows],
+                      [quantity for symbol, quantity in rows], len(rows),
+                      store.malformed_lines(), store.unparsed_lines())
@@ -0,0 +1,321 @@
+"""Local daily price store and historical portfolio valuation.
+
+Closes are kept per symbol as a dense float64 .npy column indexed by
+calendar day (NaN on days without a close), so a cached column can be
+memory-mapped and sliced without parsing. index.json records which
+date range each column covers; only the days outside that range are
+fetched from the provider later on.
+
+    python main.py history portfolio.csv --start 2015-01-01 --output values.csv
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from urllib.parse import quote as quote_filename
+
+import numpy as np
+
+from fx import base_currency, guess_currency, rate_pairs, split_minor
+from portfolio_loader import load_portfolio
+from quote_provider import DEFAULT_BATCH_SIZE, DEFAULT_MAX_CONCURRENCY, get_provider
+
+
+DEFAULT_DIRECTORY = "price_history"
+
+EPOCH = np.datetime64("1970-01-01", "D")
+
+
+def _day(value):
+    """Day number since 1970-01-01 for a date or datetime64."""
+    return int((np.datetime64(value, "D") - EPOCH).astype(np.int64))
+
+
+class PriceHistoryStore:
+    """Daily closes for many symbols, cached on disk as .npy columns."""
+
+    def __init__(self, directory=DEFAULT_DIRECTORY):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._index_path = os.path.join(directory, "index.json")
+        try:
+            with open(self._index_path) as f:
+                self.index = json.load(f)
+        except FileNotFoundError:
+            self.index = {}
+        self.unfetched = []
+
+    def _column_path(self, symbol):
+        return os.path.join(self.directory, quote_filename(symbol, safe="") + ".npy")
+
+    def _save_index(self):
+        tmp_path = self._index_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.index, f)
+        os.replace(tmp_path, self._index_path)
+
+    def column(self, symbol):
+        """(first_day, closes) for a cached symbol, memory-mapped; or None."""
+        entry = self.index.get(symbol)
+        if entry is None:
+            return None
+        return entry["first"], np.load(self._column_path(symbol), mmap_mode="r")
+
+    def missing_ranges(self, symbol, first, last):
+        """Day ranges in [first, last] not yet covered for `symbol`."""
+        entry = self.index.get(symbol)
+        if entry is None:
+            return [(first, last)]
+        ranges = []
+        if first < entry["first"]:
+            ranges.append((first, entry["first"] - 1))
+        if last > entry["last"]:
+            ranges.append((entry["last"] + 1, last))
+        return ranges
+
+    def merge(self, symbol, first, last, dates, closes):
+        """Add fetched closes for the day range [first, last] to a column."""
+        entry = self.index.get(symbol)
+        if entry is None:
+            new_first, new_last = first, last
+            old = None
+        else:
+            new_first = min(first, entry["first"])
+            new_last = max(last, entry["last"])
+            old = np.load(self._column_path(symbol))
+
+        column = np.full(new_last - new_first + 1, np.nan)
+        if old is not None:
+            offset = entry["first"] - new_first
+            column[offset:offset + len(old)] = old
+        if len(dates):
+            days = (np.asarray(dates, dtype="datetime64[D]") - EPOCH).astype(np.int64)
+            keep = (days >= new_first) & (days <= new_last)
+            column[days[keep] - new_first] = closes[keep]
+
+        tmp_path = self._column_path(symbol) + ".tmp.npy"
+        np.save(tmp_path, column)
+        os.replace(tmp_path, self._column_path(symbol))
+        self.index[symbol] = {"first": new_first, "last": new_last}
+
+    def update(self, provider, symbols, start, end, batch_size=DEFAULT_BATCH_SIZE,
+               max_concurrency=DEFAULT_MAX_CONCURRENCY):
+        """Fetch whatever part of [start, end] is not cached yet.
+
+        Symbols that miss the same day range are requested together in
+        batches. Today is not requested, since its close can still
+        change. Returns the number of provider requests made; provider
+        errors are raised. Symbols the provider sent no closes for are
+        left in self.unfetched and their range stays missing, so the
+        next update asks for it again.
+        """
+        self.unfetched = []
+        first = _day(start)
+        last = min(_day(end), _day(date.today()) - 1)
+        if last < first:
+            return 0
+
+        # group symbols by the range they are missing so they can be batched
+        wanted = {}
+        for symbol in dict.fromkeys(symbols):
+            for missing in self.missing_ranges(symbol, first, last):
+                wanted.setdefault(missing, []).append(symbol)
+
+        jobs = []
+        for (lo, hi), group in wanted.items():
+            for i in range(0, len(group), batch_size):
+                jobs.append((lo, hi, group[i:i + batch_size]))
+        if not jobs:
+            return 0
+
+        def fetch(job):
+            lo, hi, batch = job
+            return provider.get_history(batch, (EPOCH + lo).item(), (EPOCH + hi).item())
+
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            results = list(executor.map(fetch, jobs))
+
+        for (lo, hi, batch), history in zip(jobs, results):
+            for symbol in batch:
+                dates, closes = history.get(symbol, ((), np.empty(0)))
+                closes = np.asarray(closes, dtype=float)
+                if not np.isfinite(closes).any():
+                    # nothing came back (yfinance offline returns an empty frame)
+                    if symbol not in self.unfetched:
+                        self.unfetched.append(symbol)
+                    continue
+                self.merge(symbol, lo, hi, dates, closes)
+        self._save_index()
+        return len(jobs)
+
+    def price_matrix(self, symbols, start, end):
+        """Aligned closes for [start, end]: (dates, matrix[days, symbols]).
+
+        Days where no symbol traded are dropped. Gaps are filled with the
+        previous close; before a symbol's first close its price is NaN.
+        """
+        first = _day(start)
+        last = _day(end)
+        n_days = last - first + 1
+        matrix = np.full((n_days, len(symbols)), np.nan)
+
+        for j, symbol in enumerate(symbols):
+            cached = self.column(symbol)
+            if cached is None:
+                continue
+            column_first, column = cached
+            lo = max(first, column_first)
+            hi = min(last, column_first + len(column) - 1)
+            if lo > hi:
+                continue
+            matrix[lo - first:hi - first + 1, j] = column[lo - column_first:hi - column_first + 1]
+
+        traded = ~np.isnan(matrix).all(axis=1)
+        dates = (EPOCH + first + np.arange(n_days))[traded]
+        return dates, forward_fill(matrix[traded])
+
+
+# carry the last known value down each column over NaN gaps
+def forward_fill(matrix):
+    if matrix.size == 0:
+        return matrix
+    rows = np.arange(matrix.shape[0])[:, None]
+    last_valid = np.where(np.isnan(matrix), 0, rows)
+    np.maximum.accumulate(last_valid, axis=0, out=last_valid)
+    filled = matrix[last_valid, np.arange(matrix.shape[1])]
+    return filled
+
+
+# portfolio value per day: the price matrix times the holdings vector
+def value_history(price_matrix, quantities):
+    prices = np.nan_to_num(price_matrix, nan=0.0)
+    return prices @ np.asarray(quantities, dtype=float)
+
+
+def base_price_matrix(store, symbols, start, end, base):
+    """Stored closes of `symbols` in the `base` currency: (dates, matrix).
+
+    A symbol's currency comes from its exchange suffix. Each day uses the
+    last stored close of the rate pair on or before it. Raises ValueError
+    when a rate is missing on a day a symbol in that currency has a price.
+    """
+    dates, matrix = store.price_matrix(symbols, start, end)
+    if not len(dates):
+        return dates, matrix
+    currencies = [split_minor(guess_currency(symbol)) for symbol in symbols]
+    priced = [s for s, ok in zip(symbols, ~np.isnan(matrix).all(axis=0)) if ok]
+    pairs = rate_pairs(priced, base)
+    rates = {base: np.ones(len(dates))}
+    if pairs:
+        pair_dates, pair_matrix = store.price_matrix(list(pairs.values()), start, end)
+        rows = np.searchsorted(pair_dates, dates, side="right") - 1
+        missing = []
+        for j, (currency, pair) in enumerate(pairs.items()):
+            column = np.full(len(dates), np.nan)
+            if len(pair_dates):
+                column[rows >= 0] = pair_matrix[rows[rows >= 0], j]
+            needed = matrix[:, [major == currency for major, _ in currencies]]
+            if (np.isnan(column) & ~np.isnan(needed).all(axis=1)).any():
+                missing.append(f"{currency}/{base} ({pair})")
+            rates[currency] = column
+        if missing:
+            raise ValueError(f"no stored exchange rates over the whole range for "
+                             f"{', '.join(missing)}; fetch them with main.py history or optimize --update")
+    converted = np.empty_like(matrix)
+    for j, (major, scale) in enumerate(currencies):
+        # symbols without prices may lack a rate too, they stay NaN and are left out
+        converted[:, j] = matrix[:, j] * scale * rates.get(major, np.nan)
+    return dates, converted
+
+
+def parse_date(text):
+    if text == "today":
+        return date.today()
+    return datetime.strptime(text, "%Y-%m-%d").date()
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="main.py history",
+        description="Daily value of a portfolio over a date range.")
+    parser.add_argument("path", nargs="?", default="portfolio.csv",
+                        help="portfolio csv file (default: portfolio.csv)")
+    parser.add_argument("--start", type=parse_date,
+                        default=date.today() - timedelta(days=365),
+                        help="first day, YYYY-MM-DD (default: one year ago)")
+    parser.add_argument("--end", type=parse_date, default=date.today(),
+                        help="last day, YYYY-MM-DD or 'today' (default: today)")
+    parser.add_argument("--output", "-o", help="write date,value rows to this csv file")
+    parser.add_argument("--base-currency", help="currency of the values (default: PORTFOLIO_BASE_CURRENCY or USD)")
+    parser.add_argument("--provider", help="quote provider (default: PORTFOLIO_PROVIDER or yfinance)")
+    parser.add_argument("--store", default=DEFAULT_DIRECTORY,
+                        help=f"price history directory (default: {DEFAULT_DIRECTORY})")
+    return parser
+
+
+def run(argv):
+    args = build_parser().parse_args(argv)
+    if args.end < args.start:
+        print("Error: --end is before --start.", file=sys.stderr)
+        return 2
+
+    try:
+        result = load_portfolio(args.path)
+        provider = get_provider(args.provider)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 2
+    if result.empty:
+        print("Portfolio is empty!", file=sys.stderr)
+        return 2
+
+    symbols = result.tickers
+    quantities = np.asarray(result.quantities, dtype=float)
+    base = (args.base_currency or base_currency()).upper()
+    pairs = list(rate_pairs(symbols, base).values())
+    store = PriceHistoryStore(args.store)
+
+    started = time.perf_counter()
+    try:
+        requests = store.update(provider, symbols + pairs, args.start, args.end)
+    except Exception as e:
+        print(f"Error fetching price history: {e}", file=sys.stderr)
+        return 2
+    fetched = time.perf_counter()
+    try:
+        dates, matrix = base_price_matrix(store, symbols, args.start, args.end, base)
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 2
+    values = value_history(matrix, quantities)
+    finished = time.perf_counter()
+
+    if not len(values):
+        print("No price history available for this range.", file=sys.stderr)
+        return 1
+
+    missing = [s for s, has_data in zip(symbols, ~np.isnan(matrix).all(axis=0)) if not has_data]
+    print(f"Portfolio history {dates[0]} to {dates[-1]} ({len(dates)} trading days, "
+          f"{len(symbols)} symbols)")
+    print(f"  Start value: {values[0]:,.2f} {base}")
+    print(f"  End value:   {values[-1]:,.2f} {base}")
+    print(f"  Low / high:  {values.min():,.2f} / {values.max():,.2f} {base}")
+    if values[0]:
+        print(f"  Change:      {(values[-1] / values[0] - 1) * 100:+.2f}%")
+    print(f"  {requests} history request(s) in {fetched - started:.2f}s, "
+          f"valued in {finished - fetched:.3f}s")
+    if store.unfetched:
+        print(f"  No history returned for: {', '.join(store.unfetched)} (will retry next run)")
+    if missing:
+        print(f"  No history for: {', '.join(missing)}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write("date,value\n")
+            for day, value in zip(dates, values):
+                f.write(f"{day},{value:.2f}\n")
+        print(f"Daily values written to {args.output}")
+    return 1 if missing else 0
@@ -0,0 +1,150 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from quote_provider import Quote
+
+
+# seconds a cached price stays fresh
+DEFAULT_TTL = 300
+
+# maximum number of symbols kept in memory and on disk
+DEFAULT_MAX_ENTRIES = 10000
+
+DEFAULT_PATH = "quote_cache.db"
+
+
+class QuoteCache:
+    """TTL quote cache with LRU eviction and an optional SQLite backing file.
+
+    Recently used quotes live in memory; everything written is also kept
+    in the SQLite file (when `path` is set) so a restarted program can
+    reuse prices that are still fresh.
+    """
+
+    def __init__(self, path=DEFAULT_PATH, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES):
+        if max_entries < 1:
+            raise ValueError("max_entries must be at least 1")
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS quotes ("
+                " symbol TEXT PRIMARY KEY,"
+                " price REAL NOT NULL,"
+                " name TEXT,"
+                " fetched_at REAL NOT NULL,"
+                " currency TEXT)"
+            )
+            columns = {row[1] for row in self._db.execute("PRAGMA table_info(quotes)")}
+            if "currency" not in columns:
+                # cache files written before quotes had a currency
+                self._db.execute("ALTER TABLE quotes ADD COLUMN currency TEXT")
+            self._db.execute("CREATE INDEX IF NOT EXISTS quotes_fetched_at ON quotes (fetched_at)")
+            self._db.commit()
+
+    @classmethod
+    def from_env(cls):
+        """Build a cache configured by the PORTFOLIO_CACHE_* variables."""
+        return cls(
+            path=os.environ.get("PORTFOLIO_CACHE_PATH", DEFAULT_PATH),
+            ttl=float(os.environ.get("PORTFOLIO_CACHE_TTL", DEFAULT_TTL)),
+            max_entries=int(os.environ.get("PORTFOLIO_CACHE_SIZE", DEFAULT_MAX_ENTRIES)),
+        )
+
+    def _remember(self, symbol, entry):
+        self._entries[symbol] = entry
+        self._entries.move_to_end(symbol)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _lookup(self, symbol, now):
+        entry = self._entries.get(symbol)
+        if entry is None and self._db is not None:
+            row = self._db.execute(
+                "SELECT price, name, fetched_at, currency FROM quotes WHERE symbol = ?", (symbol,)
+            ).fetchone()
+            if row is not None:
+                entry = row
+                self._remember(symbol, entry)
+        if entry is None or now - entry[2] > self.ttl:
+            return None
+        self._entries.move_to_end(symbol)
+        return Quote(symbol, entry[0], entry[1], entry[3], entry[2])
+
+    def get(self, symbol):
+        """Return a fresh cached Quote, or None on a miss."""
+        with self._lock:
+            quote = self._lookup(symbol, time.time())
+            if quote is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return quote
+
+    def get_many(self, symbols):
+        """Split symbols into ({symbol: Quote} hits, [symbol] misses)."""
+        found = {}
+        missing = []
+        now = time.time()
+        with self._lock:
+            for symbol in symbols:
+                quote = self._lookup(symbol, now)
+                if quote is None:
+                    missing.append(symbol)
+                else:
+                    found[symbol] = quote
+            self.hits += len(found)
+            self.misses += len(missing)
+        return found, missing
+
+    def put_many(self, quotes):
+        """Store an iterable of Quote objects."""
+        now = time.time()
+        rows = [(q.symbol, q.price, q.name, now, q.currency) for q in quotes]
+        if not rows:
+            return
+        with self._lock:
+            for symbol, price, name, fetched_at, currency in rows:
+                self._remember(symbol, (price, name, fetched_at, currency))
+            if self._db is not None:
+                with self._db:
+                    self._db.executemany(
+                        "INSERT OR REPLACE INTO quotes (symbol, price, name, fetched_at, currency)"
+                        " VALUES (?, ?, ?, ?, ?)", rows)
+                    # keep the file bounded by dropping the oldest quotes
+                    self._db.execute(
+                        "DELETE FROM quotes WHERE symbol IN ("
+                        " SELECT symbol FROM quotes ORDER BY fetched_at DESC"
+                        " LIMIT -1 OFFSET ?)", (self.max_entries,))
+
+    def put(self, quote):
+        self.put_many([quote])
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                with self._db:
+                    self._db.execute("DELETE FROM quotes")
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
@@ -0,0 +1,512 @@
+import asyncio
+import os
+import random
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from metrics import metrics
+
+
+# how many blocking quote requests may run at the same time
+DEFAULT_MAX_CONCURRENCY = 32
+
+# how many symbols go into one batched quote request
+DEFAULT_BATCH_SIZE = 50
+
+
+class QuoteError(Exception):
+    """Raised when a provider cannot return a usable quote for a symbol."""
+
+
+class Quote:
+    """Price information for a single symbol.
+
+    `currency` is the code the price is quoted in, None when the
+    provider did not say (fx.currency_of() then guesses it).
+    `fetched_at` is when a cached price was fetched, None for one that
+    just came from the provider.
+    """
+
+    __slots__ = ("symbol", "price", "name", "currency", "fetched_at")
+
+    def __init__(self, symbol, price, name=None, currency=None, fetched_at=None):
+        self.symbol = symbol
+        self.price = price
+        self.name = name or symbol
+        self.currency = currency
+        self.fetched_at = fetched_at
+
+    def __repr__(self):
+        return f"Quote({self.symbol!r}, {self.price!r}, {self.name!r}, {self.currency!r})"
+
+
+class QuoteProvider:
+    """Base class for quote backends.
+
+    Subclasses implement get_quote(), which is a plain blocking call.
+    QuoteFetcher takes care of running it off the event loop.
+    Backends that can price many symbols in one round trip also
+    override get_quotes(). get_history() returns daily closes for the
+    historical valuation in price_history.py.
+    """
+
+    name = "base"
+
+    def get_quote(self, symbol):
+        raise NotImplementedError
+
+    def get_quotes(self, symbols):
+        """Return a {symbol: Quote} dict; symbols that fail are left out."""
+        quotes = {}
+        for symbol in symbols:
+            try:
+                quotes[symbol] = self.get_quote(symbol)
+            except QuoteError:
+                pass
+        return quotes
+
+    def get_history(self, symbols, start, end):
+        """Daily closes between two dates (inclusive) for many symbols.
+
+        Returns {symbol: (dates, closes)} with datetime64[D] dates and
+        float closes; symbols without data are left out.
+        """
+        raise NotImplementedError(f"the {self.name} provider has no price history")
+
+
+class YFinanceProvider(QuoteProvider):
+    """Quotes from Yahoo Finance through the yfinance package.
+
+    yfinance is imported on first use, it takes a large share of the
+    program's start-up time otherwise.
+    """
+
+    name = "yfinance"
+
+    def get_quote(self, symbol):
+        import yfinance as yf
+        info = yf.Ticker(symbol).info
+
+        # check if we got valid data
+        if not info or 'currentPrice' not in info and 'regularMarketPrice' not in info:
+            raise QuoteError("Invalid symbol or no price data available")
+
+        current_price = info.get('currentPrice', info.get('regularMarketPrice', 0))
+        company_name = info.get('longName', symbol)
+        return Quote(symbol, current_price, company_name, info.get('currency'))
+
+    def get_quotes(self, symbols):
+        # one download call for the whole batch, only the closing prices
+        # are read instead of the full .info payload per symbol; the
+        # download has no currency, it is taken from the exchange suffix
+        import yfinance as yf
+        symbols = list(symbols)
+        history = yf.download(symbols, period="5d", interval="1d", group_by="column",
+                              auto_adjust=False, progress=False, threads=False)
+        if history is None or history.empty:
+            return {}
+
+        closes = history["Close"]
+        if not hasattr(closes, "columns"):
+            closes = closes.to_frame(symbols[0])
+
+        quotes = {}
+        for symbol in symbols:
+            if symbol not in closes.columns:
+                continue
+            prices = closes[symbol].dropna()
+            if prices.empty:
+                continue
+            quotes[symbol] = Quote(symbol, float(prices.iloc[-1]))
+        return quotes
+
+    def get_history(self, symbols, start, end):
+        import numpy as np
+        import yfinance as yf
+        symbols = list(symbols)
+        history = yf.download(symbols, start=start.isoformat(),
+                              end=(end + timedelta(days=1)).isoformat(), interval="1d",
+                              group_by="column", auto_adjust=True, progress=False, threads=False)
+        if history is None or history.empty:
+            return {}
+
+        closes = history["Close"]
+        if not hasattr(closes, "columns"):
+            closes = closes.to_frame(symbols[0])
+        dates = closes.index.tz_localize(None).to_numpy().astype("datetime64[D]")
+
+        result = {}
+        for symbol in symbols:
+            if symbol not in closes.columns:
+                continue
+            values = closes[symbol].to_numpy(dtype=float)
+            valid = ~np.isnan(values)
+            if valid.any():
+                result[symbol] = (dates[valid], values[valid])
+        return result
+
+
+# made-up US dollar value of one unit of each currency, for the local provider
+LOCAL_USD_RATES = {
+    "USD": 1.0, "AUD": 0.66, "NZD": 0.61, "CAD": 0.73, "GBP": 1.27, "EUR": 1.08,
+    "CHF": 1.12, "SEK": 0.095, "NOK": 0.094, "DKK": 0.145, "JPY": 0.0067,
+    "HKD": 0.128, "CNY": 0.138, "KRW": 0.00075, "TWD": 0.031, "SGD": 0.74,
+    "INR": 0.012, "ZAR": 0.054, "BRL": 0.2, "MXN": 0.058, "ILS": 0.27,
+}
+
+
+class LocalQuoteProvider(QuoteProvider):
+    """In-process stand-in for a real backend, with simulated latency
+    and, optionally, simulated failures.
+
+    Prices come from the `prices` dict when given, otherwise a stable
+    made-up price is derived from the symbol so any ticker resolves.
+    """
+
+    name = "local"
+
+    def __init__(self, prices=None, latency=0.0, jitter=0.0, seed=None,
+                 tick_volatility=0.0, tick_probability=0.5, error_rate=0.0, down=False):
+        self.prices = prices
+        self.latency = latency
+        self.jitter = jitter
+        # simulated outages: a share of requests fail, or all of them while down
+        self.error_rate = error_rate
+        self.down = down
+        # live quotes move by a random factor so watch mode sees changes
+        self.tick_volatility = tick_volatility
+        self.tick_probability = tick_probability
+        self._moves = {}
+        self._random = random.Random(seed)
+
+    def _sleep(self):
+        delay = self.latency
+        if self.jitter:
+            delay += self._random.uniform(0, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+        if self.down or (self.error_rate and self._random.random() < self.error_rate):
+            raise ConnectionError("simulated provider failure")
+
+    def price_for(self, symbol):
+        if symbol.endswith("=X") and len(symbol) == 8:
+            # exchange rate pair such as AUDUSD=X
+            source, target = symbol[:3], symbol[3:6]
+            if source not in LOCAL_USD_RATES or target not in LOCAL_USD_RATES:
+                raise QuoteError("Invalid symbol or no price data available")
+            return LOCAL_USD_RATES[source] / LOCAL_USD_RATES[target]
+        if self.prices is not None:
+            if symbol not in self.prices:
+                raise QuoteError("Invalid symbol or no price data available")
+            return self.prices[symbol]
+        # stable pseudo price between 5 and 505
+        return 5 + (zlib.crc32(symbol.encode()) % 50000) / 100
+
+    def live_price(self, symbol):
+        price = self.price_for(symbol)
+        if not self.tick_volatility:
+            return price
+        move = self._moves.get(symbol, 1.0)
+        if self._random.random() < self.tick_probability:
+            move *= 1 + self._random.gauss(0, self.tick_volatility)
+            self._moves[symbol] = move
+        return round(price * move, 2)
+
+    def _quote(self, symbol):
+        from fx import guess_currency
+        return Quote(symbol, self.live_price(symbol), f"{symbol} (local)", guess_currency(symbol))
+
+    def get_quote(self, symbol):
+        self._sleep()
+        return self._quote(symbol)
+
+    def get_quotes(self, symbols):
+        # a batch costs a single simulated round trip
+        self._sleep()
+        quotes = {}
+        for symbol in symbols:
+            try:
+                quotes[symbol] = self._quote(symbol)
+            except QuoteError:
+                pass
+        return quotes
+
+    def get_history(self, symbols, start, end):
+        # a smooth made-up path per symbol, the same for a day no matter
+        # which range it is requested in, weekends have no data
+        import numpy as np
+        self._sleep()
+        days = np.arange(np.datetime64(start, "D"), np.datetime64(end, "D") + 1)
+        days = days[np.is_busday(days)]
+        t = days.astype(np.int64).astype(float)
+
+        result = {}
+        for symbol in symbols:
+            try:
+                base = self.price_for(symbol)
+            except QuoteError:
+                continue
+            seed = zlib.crc32(symbol.encode()) % 1000
+            noise = np.sin(t * 12.9898 + seed) * 43758.5453
+            noise = (noise - np.floor(noise)) - 0.5
+            log_move = (0.15 * np.sin(t / (90 + seed % 60) + seed)
+                        + 0.05 * np.sin(t / 17 + seed / 7) + 0.02 * noise)
+            result[symbol] = (days, base * np.exp(log_move))
+        return result
+
+
+PROVIDERS = {
+    YFinanceProvider.name: YFinanceProvider,
+    LocalQuoteProvider.name: LocalQuoteProvider,
+}
+
+
+# pick a provider by name, defaulting to the PORTFOLIO_PROVIDER env variable
+def get_provider(name=None, **kwargs):
+    name = (name or os.environ.get("PORTFOLIO_PROVIDER") or YFinanceProvider.name).lower()
+    if name not in PROVIDERS:
+        raise ValueError(f"Unknown quote provider '{name}'. "
+                         f"Choose one of: {', '.join(PROVIDERS)}")
+    return PROVIDERS[name](**kwargs)
+
+
+class QuoteFetcher:
+    """Runs blocking provider calls on a bounded thread pool.
+
+    At most `max_concurrency` requests are in flight at once; the rest
+    wait in the pool's queue without blocking the event loop.
+    fetch_many() groups symbols into batches of `batch_size`. When a
+    `cache` (see quote_cache.QuoteCache) is given, fresh cached quotes
+    are used instead of asking the provider. Every provider call goes
+    through a request_scheduler.RequestScheduler for rate limiting,
+    retries and circuit breaking.
+    """
+
+    def __init__(self, provider, max_concurrency=None, batch_size=None, cache=None,
+                 scheduler=None):
+        from request_scheduler import RequestScheduler
+
+        if max_concurrency is None:
+            max_concurrency = int(os.environ.get("PORTFOLIO_MAX_CONCURRENCY",
+                                                 DEFAULT_MAX_CONCURRENCY))
+        if batch_size is None:
+            batch_size = int(os.environ.get("PORTFOLIO_BATCH_SIZE", DEFAULT_BATCH_SIZE))
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency must be at least 1")
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least 1")
+        self.provider = provider
+        self.max_concurrency = max_concurrency
+        self.batch_size = batch_size
+        self.cache = cache
+        self.scheduler = scheduler or RequestScheduler.from_env(max_concurrency=max_concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency,
+                                            thread_name_prefix="quote")
+
+    async def _call(self, function, argument, kind="single"):
+        # run a blocking provider call on the pool, under the scheduler's rules
+        loop = asyncio.get_running_loop()
+        if not metrics.enabled:
+            return await self.scheduler.call(
+                lambda: loop.run_in_executor(self._executor, function, argument))
+
+        started = time.perf_counter()
+        try:
+            result = await self.scheduler.call(
+                lambda: loop.run_in_executor(self._executor, function, argument))
+        except Exception as e:
+            metrics.count("quote_requests_total", kind=kind, outcome=type(e).__name__)
+            raise
+        finally:
+            metrics.observe("quote_request_seconds", time.perf_counter() - started, kind=kind)
+        metrics.count("quote_requests_total", kind=kind, outcome="ok")
+        return result
+
+    async def fetch(self, symbol, refresh=False):
+        if self.cache is not None and not refresh:
+            quote = self.cache.get(symbol)
+            metrics.count("quote_cache_misses_total" if quote is None else "quote_cache_hits_total")
+            if quote is not None:
+                return quote
+        quote = await self._call(self.provider.get_quote, symbol)
+        if self.cache is not None:
+            self.cache.put(quote)
+        return quote
+
+    async def _fetch_batch(self, symbols):
+        try:
+            return await self._call(self.provider.get_quotes, symbols, kind="batch")
+        except Exception:
+            # the whole batch failed, every symbol gets a per-symbol retry
+            return {}
+
+    async def _fetch_one(self, symbol):
+        try:
+            return await self._call(self.provider.get_quote, symbol)
+        except Exception as e:
+            return e
+
+    async def fetch_many(self, symbols, refresh=False, on_quotes=None):
+        """Fetch quotes for many symbols in batches.
+
+        Returns (quotes, errors): a {symbol: Quote} dict and a
+        {symbol: exception} dict for symbols that could not be priced.
+        Symbols missing from a batch answer are retried one by one.
+        With refresh=True the cache is bypassed and then refilled.
+        `on_quotes`, when given, is called with each {symbol: Quote}
+        group as soon as it is available: cached quotes first, then
+        every batch in the order the batches finish.
+        """
+        unique = list(dict.fromkeys(symbols))
+        if self.cache is not None and not refresh:
+            cached, to_fetch = self.cache.get_many(unique)
+            metrics.count("quote_cache_hits_total", len(cached))
+            metrics.count("quote_cache_misses_total", len(to_fetch))
+        else:
+            cached, to_fetch = {}, unique
+        batches = [to_fetch[i:i + self.batch_size]
+                   for i in range(0, len(to_fetch), self.batch_size)]
+
+        if on_quotes is not None and cached:
+            on_quotes(cached)
+
+        fetched = {}
+        if on_quotes is None:
+            for batch_quotes in await asyncio.gather(*(self._fetch_batch(b) for b in batches)):
+                fetched.update(batch_quotes)
+        else:
+            for next_batch in asyncio.as_completed([self._fetch_batch(b) for b in batches]):
+                batch_quotes = await next_batch
+                fetched.update(batch_quotes)
+                if batch_quotes:
+                    on_quotes(batch_quotes)
+
+        # per-symbol fallback for whatever the batches did not return
+        missing = [symbol for symbol in to_fetch if symbol not in fetched]
+        errors = {}
+        results = await asyncio.gather(*(self._fetch_one(symbol) for symbol in missing))
+        recovered = {}
+        for symbol, result in zip(missing, results):
+            if isinstance(result, Exception):
+                errors[symbol] = result
+            else:
+                recovered[symbol] = result
+        fetched.update(recovered)
+        if on_quotes is not None and recovered:
+            on_quotes(recovered)
+
+        if self.cache is not None:
+            self.cache.put_many(fetched.values())
+        metrics.count("quote_symbols_failed_total", len(errors))
+        quotes = dict(cached)
+        quotes.update(fetched)
+        return quotes, errors
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        if self.cache is not None:
+            self.cache.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# result of an in-flight request whose caller was cancelled
+_REFETCH = object()
+
+
+class CoalescingFetcher:
+    """Shares in-flight quote requests between concurrent callers.
+
+    Wraps a QuoteFetcher with the same fetch_many() interface. A symbol
+    that is already being fetched for one caller is not requested again
+    for another: the second caller waits for the first request's
+    result. Finished quotes are then served by the shared cache.
+    """
+
+    def __init__(self, fetcher):
+        self.fetcher = fetcher
+        self.cache = fetcher.cache
+        self.requested = 0   # symbols this wrapper asked the fetcher for
+        self.coalesced = 0   # symbols served by another caller's request
+        self._inflight = {}  # symbol -> future of (quote, error)
+
+    async def fetch(self, symbol, refresh=False):
+        quotes, errors = await self.fetch_many([symbol], refresh=refresh)
+        if symbol in errors:
+            raise errors[symbol]
+        return quotes[symbol]
+
+    async def fetch_many(self, symbols, refresh=False, on_quotes=None):
+        unique = list(dict.fromkeys(symbols))
+        loop = asyncio.get_running_loop()
+        shared = {}
+        own = {}
+        for symbol in unique:
+            future = self._inflight.get(symbol)
+            if future is None:
+                own[symbol] = self._inflight[symbol] = loop.create_future()
+            else:
+                shared[symbol] = future
+        self.requested += len(own)
+        self.coalesced += len(shared)
+        metrics.count("quote_symbols_coalesced_total", len(shared))
+
+        try:
+            quotes, errors = await self.fetcher.fetch_many(list(own), refresh=refresh,
+                                                           on_quotes=on_quotes)
+        except Exception as e:
+            # waiting callers get the failure as a per-symbol error
+            for future in own.values():
+                future.set_result((None, e))
+            raise
+        except BaseException:
+            # this caller was cancelled (a timeout, say), which says nothing
+            # about the symbols: waiting callers fetch them themselves
+            for future in own.values():
+                future.set_result(_REFETCH)
+            raise
+        finally:
+            for symbol in own:
+                del self._inflight[symbol]
+        for symbol, future in own.items():
+            if not future.done():
+                future.set_result((quotes.get(symbol), errors.get(symbol)))
+
+        if shared:
+            # shield: a cancelled caller must not cancel another caller's request
+            await asyncio.shield(asyncio.gather(*shared.values()))
+            joined = {}
+            refetch = []
+            for symbol, future in shared.items():
+                if future.result() is _REFETCH:
+                    refetch.append(symbol)
+                    continue
+                quote, error = future.result()
+                if quote is not None:
+                    joined[symbol] = quote
+                else:
+                    errors[symbol] = error
+            quotes.update(joined)
+            if on_quotes is not None and joined:
+                on_quotes(joined)
+            if refetch:
+                more_quotes, more_errors = await self.fetch_many(refetch, refresh=refresh,
+                                                                 on_quotes=on_quotes)
+                quotes.update(more_quotes)
+                errors.update(more_errors)
+        return quotes, errors
+
+    def close(self):
+        self.fetcher.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
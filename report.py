@@ -0,0 +1,348 @@
+"""Valuation results as records, and renderers that write them in one go.
+
+Fetching and valuing return data only; values are converted into one
+base currency (see fx.py) and subtotalled per quoted currency. Nothing
+is printed until a renderer formats the whole report into one string
+and writes it with a single call. ProgressiveReport writes rows as
+their quotes arrive.
+"""
+import asyncio
+import csv
+import io
+import json
+import math
+import os
+import sys
+import time
+
+from fx import (DEFAULT_BASE, conversion_factors, convert, currency_of, fetch_rates,
+                guess_currency, rates_for_quotes, split_minor, subtotals)
+from metrics import metrics
+from quote_provider import QuoteError
+from valuation import value_positions
+
+
+FORMATS = ("table", "json", "csv")
+
+# longest company name shown in the table, longer ones are cut
+NAME_WIDTH = 30
+
+
+def table_header(base):
+    return (f"{'Symbol':12} {'Name':{NAME_WIDTH}} {'Shares':>12} "
+            f"{'Price':>16} {'Value (' + base + ')':>16}")
+
+
+# the message shown for a position that could not be priced
+def error_text(error):
+    if error is None:
+        return "No price data available"
+    if isinstance(error, QuoteError):
+        return f"Error: {error}"
+    return f"Error fetching data: {error}"
+
+
+class Position:
+    """One valued holding.
+
+    `price` is in the quoted `currency`, `value` in the base currency;
+    both are None when the holding has no price.
+    """
+
+    __slots__ = ("symbol", "name", "quantity", "currency", "price", "value", "error")
+
+    def __init__(self, symbol, name, quantity, currency=None, price=None, value=None, error=None):
+        self.symbol = symbol
+        self.name = name
+        self.quantity = quantity
+        self.currency = currency
+        self.price = price
+        self.value = value
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.value is not None
+
+    def as_dict(self):
+        return {"symbol": self.symbol, "name": self.name, "quantity": self.quantity,
+                "currency": self.currency, "price": self.price, "value": self.value,
+                "error": self.error}
+
+    def __repr__(self):
+        return (f"Position({self.symbol!r}, {self.quantity!r}, "
+                f"price={self.price!r}, currency={self.currency!r})")
+
+
+# a Position for one quote, or for the error that replaced it; `rate`
+# converts the quoted currency into the base, 1 leaves it unconverted
+def make_position(symbol, quantity, quote=None, error=None, rate=1.0):
+    currency = currency_of(symbol, quote)
+    if quote is None or not quote.price:
+        name = quote.name if quote is not None else symbol
+        return Position(symbol, name, quantity, currency, error=error_text(error))
+    value = quote.price * quantity * rate
+    # a missing exchange rate (NaN) leaves the position without a value
+    return Position(symbol, quote.name, quantity, currency, quote.price,
+                    None if math.isnan(value) else value)
+
+
+class Valuation:
+    """A valued portfolio kept as parallel columns.
+
+    Prices and native values are in each position's quoted currency,
+    `values` and `total` in `base`. Values are NaN for positions without
+    a price or an exchange rate; they are left out of `total`. `rates`
+    are the exchange rates used and `quoted_at` the time each price was
+    fetched (NaN without a price). Position records are only made on
+    request.
+    """
+
+    __slots__ = ("symbols", "names", "quantities", "currencies", "prices", "native_values",
+                 "values", "errors", "total", "base", "subtotals", "rates", "quoted_at")
+
+    def __init__(self, symbols, quantities, quotes, errors, rates=None, base=DEFAULT_BASE,
+                 rate_errors=None):
+        prices, native_values, native_total = value_positions(symbols, quantities, quotes)
+        self.symbols = symbols
+        self.names = [quotes[s].name if s in quotes else s for s in symbols]
+        self.quantities = quantities
+        self.currencies = [currency_of(s, quotes.get(s)) for s in symbols]
+        self.base = base
+        self.rates = rates or {base: 1.0}
+
+        # one rate per currency, applied to all positions at once
+        factors = conversion_factors(self.currencies, self.rates)
+        values, self.total = convert(native_values, factors)
+
+        # plain floats format faster than NumPy scalars
+        self.prices = prices.tolist() if hasattr(prices, "tolist") else prices
+        self.native_values = (native_values.tolist() if hasattr(native_values, "tolist")
+                              else native_values)
+        self.values = values.tolist() if hasattr(values, "tolist") else values
+        now = time.time()
+        self.quoted_at = [math.nan if s not in quotes
+                          else quotes[s].fetched_at if quotes[s].fetched_at is not None else now
+                          for s in symbols]
+        self._finish(errors, rate_errors)
+
+    @classmethod
+    def from_columns(cls, symbols, names, quantities, currencies, prices, native_values, values,
+                     total, errors, rates, base=DEFAULT_BASE, rate_errors=None, quoted_at=None):
+        """A Valuation of columns that are already valued, such as an
+        incremental revaluation (see snapshots.revalue) produces."""
+        self = cls.__new__(cls)
+        self.symbols = symbols
+        self.names = names
+        self.quantities = quantities
+        self.currencies = currencies
+        self.prices = prices
+        self.native_values = native_values
+        self.values = values
+        self.total = total
+        self.base = base
+        self.rates = rates
+        self.quoted_at = quoted_at if quoted_at is not None else [math.nan] * len(symbols)
+        self._finish(errors, rate_errors)
+        return self
+
+    def _finish(self, errors, rate_errors):
+        self.subtotals = subtotals(self.currencies, self.native_values, self.values)
+        self.errors = errors
+        unconverted = [i for i, (price, value) in enumerate(zip(self.prices, self.values))
+                       if math.isnan(value) and not math.isnan(price)]
+        if unconverted:
+            self.errors = dict(errors)
+            for i in unconverted:
+                currency = split_minor(self.currencies[i])[0]
+                cause = (rate_errors or {}).get(currency)
+                self.errors[self.symbols[i]] = QuoteError(
+                    f"No {currency}/{self.base} exchange rate available"
+                    + (f" ({cause})" if cause is not None else ""))
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def failed(self):
+        return [symbol for symbol, value in zip(self.symbols, self.values) if math.isnan(value)]
+
+    def position(self, i):
+        value = self.values[i]
+        if math.isnan(value):
+            price = self.prices[i]
+            return Position(self.symbols[i], self.names[i], self.quantities[i],
+                            self.currencies[i], None if math.isnan(price) else price,
+                            error=error_text(self.errors.get(self.symbols[i])))
+        return Position(self.symbols[i], self.names[i], self.quantities[i],
+                        self.currencies[i], self.prices[i], value)
+
+    def positions(self):
+        return [self.position(i) for i in range(len(self.symbols))]
+
+    def columns(self):
+        return zip(self.symbols, self.names, self.quantities, self.currencies,
+                   self.prices, self.values)
+
+
+async def fetch_valuation(fetcher, symbols, quantities, base=DEFAULT_BASE, refresh=False):
+    """Fetch quotes and exchange rates for the holdings and value them.
+
+    The rates for the currencies the symbols' exchanges suggest are
+    fetched alongside the quotes, as one batch for all currencies.
+    """
+    expected = {guess_currency(symbol) for symbol in symbols}
+    with metrics.stage("fetch"):
+        (quotes, errors), (rates, rate_errors) = await asyncio.gather(
+            fetcher.fetch_many(symbols, refresh=refresh),
+            fetch_rates(fetcher, expected, base, refresh=refresh))
+        # a quote may report a currency its suffix did not suggest
+        rates, rate_errors = await rates_for_quotes(fetcher, symbols, quotes, base, refresh,
+                                                    rates, rate_errors)
+    with metrics.stage("value"):
+        return Valuation(symbols, quantities, quotes, errors, rates, base, rate_errors)
+
+
+def _table_row(symbol, name, quantity, currency, price, value):
+    price_text = "N/A" if math.isnan(price) else f"{price:,.2f} {currency}"
+    value_text = "N/A" if math.isnan(value) else f"{value:,.2f}"
+    return (f"{symbol:12} {name[:NAME_WIDTH]:{NAME_WIDTH}} {quantity!s:>12} "
+            f"{price_text:>16} {value_text:>16}")
+
+
+def _position_row(position):
+    return _table_row(position.symbol, position.name, position.quantity, position.currency,
+                      math.nan if position.price is None else position.price,
+                      math.nan if position.value is None else position.value)
+
+
+def _table_footer(valuation, max_failed=10):
+    lines = ["-" * len(table_header(valuation.base))]
+    subtotals = valuation.subtotals
+    if len(subtotals) > 1 or any(currency != valuation.base for currency in subtotals):
+        lines.append("\nBy currency:")
+        for currency, (native, converted) in subtotals.items():
+            lines.append(f"  {currency:4} {native:18,.2f} {currency}  = "
+                         f"{converted:18,.2f} {valuation.base}")
+    lines.append(f"\nTotal Portfolio Value: {valuation.total:,.2f} {valuation.base}")
+
+    # failed positions are reported, never silently counted as $0
+    failed = valuation.failed()
+    if failed:
+        shown = ", ".join(failed[:max_failed]) + (", ..." if len(failed) > max_failed else "")
+        lines.append(f"Not included: {len(failed)} position(s) could not be priced ({shown})")
+        for symbol in failed[:max_failed]:
+            lines.append(f"  {symbol}: {error_text(valuation.errors.get(symbol))}")
+    return lines
+
+
+def render_table(valuation):
+    header = table_header(valuation.base)
+    lines = [header, "-" * len(header)]
+    lines.extend(_table_row(*row) for row in valuation.columns())
+    lines.extend(_table_footer(valuation))
+    return "\n".join(lines) + "\n"
+
+
+def render_json(valuation):
+    # one position per line: readable, and the C encoder is used throughout
+    # (indent= would switch json to its much slower pure-Python encoder)
+    encode = json.JSONEncoder().encode
+    errors = valuation.errors
+    rows = ",\n    ".join(
+        encode({"symbol": symbol, "name": name, "quantity": quantity, "currency": currency,
+                "price": price, "value": value, "error": None})
+        if not math.isnan(value) else
+        encode({"symbol": symbol, "name": name, "quantity": quantity, "currency": currency,
+                "price": None if math.isnan(price) else price, "value": None,
+                "error": error_text(errors.get(symbol))})
+        for symbol, name, quantity, currency, price, value in valuation.columns())
+    subtotals = {currency: {"native": native, "value": converted}
+                 for currency, (native, converted) in valuation.subtotals.items()}
+    return (f'{{\n  "base_currency": {encode(valuation.base)},\n'
+            f'  "total": {encode(valuation.total)},\n'
+            f'  "subtotals": {encode(subtotals)},\n'
+            f'  "failed_symbols": {encode(valuation.failed())},\n'
+            f'  "positions": [\n    {rows}\n  ]\n}}\n')
+
+
+def _csv_number(number, digits):
+    return "" if math.isnan(number) else f"{number:.{digits}f}"
+
+
+def render_csv(valuation):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(["ticker", "name", "quantity", "currency", "price",
+                     f"value_{valuation.base.lower()}", "status"])
+    writer.writerows(
+        (symbol, name, quantity, currency, _csv_number(price, 4), _csv_number(value, 2),
+         "failed" if math.isnan(value) else "ok")
+        for symbol, name, quantity, currency, price, value in valuation.columns())
+    for currency, (native, converted) in valuation.subtotals.items():
+        writer.writerow([f"SUBTOTAL {currency}", "", "", currency, "",
+                         f"{converted:.2f}", f"{native:.2f} {currency}"])
+    writer.writerow(["TOTAL", "", "", valuation.base, "", f"{valuation.total:.2f}", ""])
+    return buffer.getvalue()
+
+
+RENDERERS = {
+    "table": render_table,
+    "json": render_json,
+    "csv": render_csv,
+}
+
+
+# the report format and progressive flag set by PORTFOLIO_REPORT_FORMAT
+# and PORTFOLIO_PROGRESSIVE
+def settings_from_env():
+    fmt = os.environ.get("PORTFOLIO_REPORT_FORMAT", "table").lower()
+    if fmt not in RENDERERS:
+        raise ValueError(f"Unknown report format '{fmt}'. Choose one of: {', '.join(FORMATS)}")
+    progressive = os.environ.get("PORTFOLIO_PROGRESSIVE", "") not in ("", "0")
+    return fmt, progressive
+
+
+# format the whole report and write it with a single call
+def render(valuation, fmt="table", out=None):
+    if fmt not in RENDERERS:
+        raise ValueError(f"Unknown report format '{fmt}'. Choose one of: {', '.join(FORMATS)}")
+    out = out or sys.stdout
+    out.write(RENDERERS[fmt](valuation))
+    out.flush()
+
+
+class ProgressiveReport:
+    """Writes table rows as quotes arrive, one write per batch of quotes.
+
+    Pass add() as fetch_many's on_quotes callback; finish() writes the
+    positions that never got a quote and the footer. `rates` must hold
+    the exchange rates already, rows are converted as they are written.
+    """
+
+    def __init__(self, symbols, quantities, rates, base=DEFAULT_BASE, out=None):
+        self.quantities = dict(zip(symbols, quantities))
+        self.rates = rates
+        self.out = out or sys.stdout
+        self.shown = set()
+        header = table_header(base)
+        self.out.write(header + "\n" + "-" * len(header) + "\n")
+        self.out.flush()
+
+    def add(self, quotes):
+        lines = []
+        for symbol, quote in quotes.items():
+            if symbol in self.shown or symbol not in self.quantities:
+                continue
+            self.shown.add(symbol)
+            factor = conversion_factors([currency_of(symbol, quote)], self.rates)[0]
+            lines.append(_position_row(make_position(symbol, self.quantities[symbol], quote,
+                                                     rate=factor)))
+        if lines:
+            self.out.write("\n".join(lines) + "\n")
+            self.out.flush()
+
+    def finish(self, valuation):
+        lines = [_table_row(*row) for row in valuation.columns() if row[0] not in self.shown]
+        lines.extend(_table_footer(valuation))
+        self.out.write("\n".join(lines) + "\n")
+        self.out.flush()
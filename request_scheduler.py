@@ -0,0 +1,211 @@
+import asyncio
+import os
+import random
+import time
+
+from metrics import metrics
+from quote_provider import QuoteError
+
+
+# retries after the first attempt for a failed request
+DEFAULT_RETRIES = 2
+
+# first backoff delay in seconds, doubled on every retry
+DEFAULT_BACKOFF = 0.25
+MAX_BACKOFF = 8.0
+
+# consecutive failures that open the circuit, and how long it stays open
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_COOLDOWN = 30.0
+
+
+class CircuitOpenError(QuoteError):
+    """Raised instead of calling a backend that is currently failing."""
+
+
+class TokenBucket:
+    """Allows `rate` requests per second on average, bursts up to `capacity`."""
+
+    def __init__(self, rate, capacity=None):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        while True:
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class CircuitBreaker:
+    """Stops calls to a backend after repeated failures.
+
+    After `failure_threshold` failures in a row the circuit opens and
+    calls fail at once with CircuitOpenError. Once `cooldown` seconds
+    have passed a single trial call is let through: success closes the
+    circuit, failure opens it again.
+    """
+
+    def __init__(self, failure_threshold=DEFAULT_FAILURE_THRESHOLD, cooldown=DEFAULT_COOLDOWN):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.times_opened = 0
+        self._trial_running = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            return "half-open"
+        return "open"
+
+    def before_call(self):
+        """Raise CircuitOpenError, or let the call through; True for the trial call."""
+        state = self.state
+        if state == "open" or (state == "half-open" and self._trial_running):
+            raise CircuitOpenError("Quote provider unavailable (circuit open), not retried")
+        if state == "half-open":
+            self._trial_running = True
+            return True
+        return False
+
+    def end_trial(self):
+        """The trial call is over; a cancelled one counts as neither outcome."""
+        self._trial_running = False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self._trial_running or self.failures >= self.failure_threshold:
+            if self.opened_at is None or self._trial_running:
+                self.times_opened += 1
+            self.opened_at = time.monotonic()
+            self._trial_running = False
+
+
+class RequestScheduler:
+    """Runs provider calls with a rate limit, bounded concurrency,
+    jittered exponential backoff retries and a circuit breaker.
+
+    QuoteError means the backend answered but has no data for the
+    symbol; it is not retried and does not count against the breaker.
+    Any other exception is treated as a transient failure.
+    """
+
+    def __init__(self, rate=None, burst=None, max_concurrency=None, retries=DEFAULT_RETRIES,
+                 backoff=DEFAULT_BACKOFF, max_backoff=MAX_BACKOFF, breaker=None, seed=None):
+        self.bucket = TokenBucket(rate, burst) if rate else None
+        self.max_concurrency = max_concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.breaker = breaker or CircuitBreaker()
+        self.calls = 0
+        self.retried = 0
+        self.failed = 0
+        self.rejected = 0
+        self._random = random.Random(seed)
+        self._semaphore = None
+        self._loop = None
+
+    @classmethod
+    def from_env(cls, max_concurrency=None):
+        """Build a scheduler configured by the PORTFOLIO_* variables."""
+        rate = os.environ.get("PORTFOLIO_RATE_LIMIT")
+        return cls(
+            rate=float(rate) if rate else None,
+            max_concurrency=max_concurrency,
+            retries=int(os.environ.get("PORTFOLIO_RETRIES", DEFAULT_RETRIES)),
+            breaker=CircuitBreaker(
+                failure_threshold=int(os.environ.get("PORTFOLIO_BREAKER_THRESHOLD",
+                                                     DEFAULT_FAILURE_THRESHOLD)),
+                cooldown=float(os.environ.get("PORTFOLIO_BREAKER_COOLDOWN", DEFAULT_COOLDOWN)),
+            ),
+        )
+
+    def _limit(self):
+        # asyncio primitives belong to one event loop, make a new one per loop
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._semaphore = asyncio.Semaphore(self.max_concurrency) if self.max_concurrency else None
+        return self._semaphore
+
+    def backoff_delay(self, attempt):
+        """Full-jitter backoff: uniform between 0 and base * 2**attempt."""
+        return self._random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    async def _attempt(self, make_call):
+        semaphore = self._limit()
+        if self.bucket is not None:
+            await self.bucket.acquire()
+        if semaphore is None:
+            return await make_call()
+        async with semaphore:
+            return await make_call()
+
+    async def call(self, make_call):
+        """Await make_call() under the scheduler's rules and return its result.
+
+        `make_call` is a function returning a new awaitable per attempt.
+        """
+        self.calls += 1
+        last_error = None
+        for attempt in range(self.retries + 1):
+            try:
+                trial = self.breaker.before_call()
+            except CircuitOpenError:
+                self.rejected += 1
+                metrics.count("quote_circuit_rejected_total")
+                raise
+            try:
+                result = await self._attempt(make_call)
+            except QuoteError:
+                self.breaker.record_success()
+                raise
+            except Exception as e:
+                self.breaker.record_failure()
+                last_error = e
+            else:
+                self.breaker.record_success()
+                return result
+            finally:
+                # CancelledError skips the handlers above; the next call is the trial then
+                if trial:
+                    self.breaker.end_trial()
+
+            if attempt < self.retries:
+                self.retried += 1
+                metrics.count("quote_retries_total")
+                await asyncio.sleep(self.backoff_delay(attempt))
+        self.failed += 1
+        metrics.count("quote_failures_total")
+        raise last_error
+
+    def stats(self):
+        return {
+            "calls": self.calls,
+            "retries": self.retried,
+            "failures": self.failed,
+            "rejected": self.rejected,
+            "circuit": self.breaker.state,
+            "circuit_opened": self.breaker.times_opened,
+        }
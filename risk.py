@@ -0,0 +1,279 @@
+"""Risk analytics for the holdings, from the cached daily price history.
+
+Everything works on a price matrix (days x symbols) as returned by
+PriceHistoryStore.price_matrix(), using plain NumPy matrix operations.
+
+    python main.py risk portfolio.csv --start 2023-01-01 --benchmark ^GSPC
+"""
+import argparse
+import sys
+from datetime import date, timedelta
+from statistics import NormalDist
+
+import numpy as np
+
+from fx import base_currency, rate_pairs
+from portfolio_loader import load_portfolio
+from price_history import DEFAULT_DIRECTORY, PriceHistoryStore, base_price_matrix, parse_date
+from quote_provider import get_provider
+
+
+TRADING_DAYS = 252
+
+
+# simple daily returns; days before a symbol's first close count as 0
+def daily_returns(prices):
+    prices = np.asarray(prices, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        returns = prices[1:] / prices[:-1] - 1
+    returns[~np.isfinite(returns)] = 0.0
+    return returns
+
+
+# weights of each holding at the last price, summing to 1
+def portfolio_weights(prices, quantities):
+    last = np.nan_to_num(np.asarray(prices, dtype=float)[-1])
+    values = last * np.asarray(quantities, dtype=float)
+    total = values.sum()
+    return values / total if total else values
+
+
+def covariance(returns):
+    centered = returns - returns.mean(axis=0)
+    return centered.T @ centered / (len(returns) - 1)
+
+
+def correlation(cov):
+    std = np.sqrt(np.diag(cov))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        corr = cov / np.outer(std, std)
+    corr[~np.isfinite(corr)] = 0.0
+    np.fill_diagonal(corr, 1.0)
+    return corr
+
+
+def annualized_volatility(returns):
+    return returns.std(axis=0, ddof=1) * np.sqrt(TRADING_DAYS)
+
+
+# beta of every column of `returns` to the benchmark returns
+def beta(returns, benchmark_returns):
+    bench = benchmark_returns - benchmark_returns.mean()
+    variance = bench @ bench
+    if not variance:
+        return np.zeros(returns.shape[1] if returns.ndim > 1 else 1)
+    return (returns - returns.mean(axis=0)).T @ bench / variance
+
+
+def historical_var(portfolio_returns, level=0.95):
+    """(VaR, CVaR) as positive loss fractions from the empirical returns."""
+    cutoff = np.quantile(portfolio_returns, 1 - level)
+    tail = portfolio_returns[portfolio_returns <= cutoff]
+    return -cutoff, -tail.mean()
+
+
+def parametric_var(portfolio_returns, level=0.95):
+    """(VaR, CVaR) as positive loss fractions under a normal assumption."""
+    mu = portfolio_returns.mean()
+    sigma = portfolio_returns.std(ddof=1)
+    normal = NormalDist()
+    z = normal.inv_cdf(1 - level)
+    var = -(mu + z * sigma)
+    cvar = -(mu - sigma * normal.pdf(z) / (1 - level))
+    return var, cvar
+
+
+class RollingRisk:
+    """Mean and covariance over the last `window` days, updated per day.
+
+    Keeps running sums of the returns and of their outer products, so a
+    new day costs one rank-one update and downdate instead of a full
+    recomputation over the window.
+    """
+
+    def __init__(self, n_assets, window):
+        if window < 2:
+            raise ValueError("window must be at least 2 days")
+        self.window = window
+        self._buffer = np.zeros((window, n_assets))
+        self._sum = np.zeros(n_assets)
+        self._cross = np.zeros((n_assets, n_assets))
+        self._count = 0
+        self._next = 0
+
+    def update(self, returns):
+        """Add one day of asset returns, dropping the oldest day if full."""
+        returns = np.asarray(returns, dtype=float)
+        if self._count == self.window:
+            oldest = self._buffer[self._next]
+            self._sum -= oldest
+            self._cross -= np.outer(oldest, oldest)
+        else:
+            self._count += 1
+        self._buffer[self._next] = returns
+        self._sum += returns
+        self._cross += np.outer(returns, returns)
+        self._next = (self._next + 1) % self.window
+
+    def extend(self, returns):
+        for row in returns[-self.window:]:
+            self.update(row)
+
+    @property
+    def ready(self):
+        return self._count >= 2
+
+    def mean(self):
+        return self._sum / self._count
+
+    def covariance(self):
+        n = self._count
+        mean = self.mean()
+        return (self._cross - n * np.outer(mean, mean)) / (n - 1)
+
+    def volatility(self):
+        return np.sqrt(np.clip(np.diag(self.covariance()), 0, None) * TRADING_DAYS)
+
+    def portfolio_volatility(self, weights):
+        variance = weights @ self.covariance() @ weights
+        return float(np.sqrt(max(variance, 0.0) * TRADING_DAYS))
+
+
+class RiskReport:
+    """All risk figures for one portfolio over one history window."""
+
+    def __init__(self, symbols, prices, quantities, benchmark_prices=None,
+                 level=0.95, window=63, base="USD"):
+        self.symbols = list(symbols)
+        self.level = level
+        self.base = base
+        self.returns = daily_returns(prices)
+        self.weights = portfolio_weights(prices, quantities)
+        self.value = float(np.nan_to_num(np.asarray(prices)[-1]) @ np.asarray(quantities, dtype=float))
+
+        self.portfolio_returns = self.returns @ self.weights
+        self.cov = covariance(self.returns)
+        self.corr = correlation(self.cov)
+        self.volatility = annualized_volatility(self.returns)
+        self.portfolio_volatility = float(np.sqrt(self.weights @ self.cov @ self.weights * TRADING_DAYS))
+        self.historical = historical_var(self.portfolio_returns, level)
+        self.parametric = parametric_var(self.portfolio_returns, level)
+
+        self.beta = None
+        self.portfolio_beta = None
+        if benchmark_prices is not None:
+            bench_returns = daily_returns(np.asarray(benchmark_prices, dtype=float)[:, None])[:, 0]
+            self.beta = beta(self.returns, bench_returns)
+            self.portfolio_beta = float(self.weights @ self.beta)
+
+        self.rolling = RollingRisk(len(self.symbols), min(window, max(len(self.returns), 2)))
+        self.rolling.extend(self.returns)
+
+    def show(self, top=10):
+        level = int(self.level * 100)
+        print(f"Portfolio value: {self.value:,.2f} {self.base} over {len(self.returns)} daily returns")
+        print(f"  Annualized volatility: {self.portfolio_volatility * 100:.2f}%")
+        if self.rolling.ready:
+            print(f"  Rolling {self.rolling.window}-day volatility: "
+                  f"{self.rolling.portfolio_volatility(self.weights) * 100:.2f}%")
+        if self.portfolio_beta is not None:
+            print(f"  Beta to benchmark: {self.portfolio_beta:.2f}")
+        hist_var, hist_cvar = self.historical
+        par_var, par_cvar = self.parametric
+        print(f"  1-day {level}% VaR  (historical): {hist_var * self.value:,.2f} {self.base}"
+              f"  CVaR: {hist_cvar * self.value:,.2f} {self.base}")
+        print(f"  1-day {level}% VaR  (parametric): {par_var * self.value:,.2f} {self.base}"
+              f"  CVaR: {par_cvar * self.value:,.2f} {self.base}")
+
+        if len(self.symbols) > 1:
+            upper = self.corr[np.triu_indices(len(self.symbols), k=1)]
+            print(f"  Average pairwise correlation: {upper.mean():.2f}")
+
+        print(f"\nLargest holdings:")
+        print(f"  {'Symbol':10} {'Weight':>8} {'Vol':>8}" + (f" {'Beta':>6}" if self.beta is not None else ""))
+        for i in np.argsort(-self.weights)[:top]:
+            line = f"  {self.symbols[i]:10} {self.weights[i] * 100:7.2f}% {self.volatility[i] * 100:7.2f}%"
+            if self.beta is not None:
+                line += f" {self.beta[i]:6.2f}"
+            print(line)
+
+    def write_correlation(self, path):
+        with open(path, "w") as f:
+            f.write("symbol," + ",".join(self.symbols) + "\n")
+            for symbol, row in zip(self.symbols, self.corr):
+                f.write(symbol + "," + ",".join(f"{x:.4f}" for x in row) + "\n")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="main.py risk",
+        description="Volatility, correlation, beta and VaR for a portfolio.")
+    parser.add_argument("path", nargs="?", default="portfolio.csv",
+                        help="portfolio csv file (default: portfolio.csv)")
+    parser.add_argument("--start", type=parse_date,
+                        default=date.today() - timedelta(days=365),
+                        help="first day of history, YYYY-MM-DD (default: one year ago)")
+    parser.add_argument("--end", type=parse_date, default=date.today(),
+                        help="last day of history (default: today)")
+    parser.add_argument("--benchmark", help="benchmark symbol for beta, e.g. ^GSPC")
+    parser.add_argument("--level", type=float, default=0.95, help="VaR confidence level (default: 0.95)")
+    parser.add_argument("--window", type=int, default=63, help="rolling window in days (default: 63)")
+    parser.add_argument("--correlation", help="write the correlation matrix to this csv file")
+    parser.add_argument("--base-currency", help="currency of the values (default: PORTFOLIO_BASE_CURRENCY or USD)")
+    parser.add_argument("--provider", help="quote provider (default: PORTFOLIO_PROVIDER or yfinance)")
+    parser.add_argument("--store", default=DEFAULT_DIRECTORY,
+                        help=f"price history directory (default: {DEFAULT_DIRECTORY})")
+    return parser
+
+
+def run(argv):
+    args = build_parser().parse_args(argv)
+    if not 0.5 < args.level < 1:
+        print("Error: --level must be between 0.5 and 1.", file=sys.stderr)
+        return 2
+
+    try:
+        result = load_portfolio(args.path)
+        provider = get_provider(args.provider)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 2
+    if result.empty:
+        print("Portfolio is empty!", file=sys.stderr)
+        return 2
+
+    symbols = result.tickers
+    quantities = np.asarray(result.quantities, dtype=float)
+    wanted = symbols + ([args.benchmark] if args.benchmark else [])
+    base = (args.base_currency or base_currency()).upper()
+    pairs = list(rate_pairs(wanted, base).values())
+
+    store = PriceHistoryStore(args.store)
+    try:
+        store.update(provider, wanted + pairs, args.start, args.end)
+    except Exception as e:
+        print(f"Error fetching price history: {e}", file=sys.stderr)
+        return 2
+    if store.unfetched:
+        print(f"No history returned for: {', '.join(store.unfetched)} (will retry next run)",
+              file=sys.stderr)
+    try:
+        dates, matrix = base_price_matrix(store, wanted, args.start, args.end, base)
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 2
+    if len(dates) < 3:
+        print("Not enough price history for this range.", file=sys.stderr)
+        return 1
+
+    benchmark_prices = matrix[:, -1] if args.benchmark else None
+    prices = matrix[:, :len(symbols)]
+    report = RiskReport(symbols, prices, quantities, benchmark_prices,
+                        level=args.level, window=args.window, base=base)
+
+    print(f"Risk for {args.path}, {dates[0]} to {dates[-1]}")
+    report.show()
+    if args.correlation:
+        report.write_correlation(args.correlation)
+        print(f"\nCorrelation matrix written to {args.correlation}")
+    return 0
@@ -0,0 +1,360 @@
+"""Long-running local HTTP service that values posted portfolios.
+
+    python main.py serve --port 8080
+
+    curl -s localhost:8080/value -d '{"holdings": [["AAPL", 50], ["BHP.AX", 100]]}'
+    curl -s localhost:8080/value -H 'Content-Type: text/csv' --data-binary @portfolio.csv
+
+POST /value takes JSON ({"holdings": [["AAPL", 50], ...] or
+[{"ticker": "AAPL", "quantity": 50}, ...], "base_currency": "EUR"}) or
+a ticker,quantity csv body (base currency from ?base=EUR) and answers
+with the JSON report from report.render_json(). GET /health, GET /stats
+and GET /metrics (Prometheus text) are there for monitoring.
+
+All requests share one fetcher and one in-memory quote cache, and
+concurrent requests for the same symbol share a single upstream fetch
+(quote_provider.CoalescingFetcher). At most --max-active valuations run
+at once and --max-queue more may wait; beyond that requests are turned
+away with 503 and a Retry-After header instead of piling up.
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+from urllib.parse import parse_qs, urlsplit
+
+from fx import base_currency
+from metrics import metrics
+from portfolio_loader import parse_row
+from quote_cache import QuoteCache
+from quote_provider import CoalescingFetcher, LocalQuoteProvider, QuoteFetcher, get_provider
+from report import fetch_valuation, render_json
+from valuation import aggregate
+
+
+DEFAULT_PORT = 8080
+DEFAULT_MAX_ACTIVE = 64
+DEFAULT_MAX_QUEUE = 1024
+DEFAULT_MAX_POSITIONS = 100_000
+DEFAULT_MAX_BODY = 8 * 1024 * 1024
+DEFAULT_TIMEOUT = 30.0
+
+# invalid holdings listed in a 400 answer, the rest are only counted
+MAX_REPORTED_ERRORS = 20
+
+# longest request line or header line accepted
+MAX_LINE = 8192
+
+REASONS = {
+    200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+    408: "Request Timeout", 411: "Length Required", 413: "Payload Too Large",
+    500: "Internal Server Error", 503: "Service Unavailable", 504: "Gateway Timeout",
+}
+
+
+class HTTPError(Exception):
+    """Ends a request with an error status and a JSON message."""
+
+    def __init__(self, status, message, details=None):
+        super().__init__(message)
+        self.status = status
+        self.details = details or {}  # extra fields for the JSON answer
+
+
+# (tickers, quantities) merged per ticker, or HTTPError(400) for bad holdings
+def parse_holdings(rows):
+    tickers = []
+    quantities = []
+    errors = []
+    error_count = 0
+    for number, fields in rows:
+        if not fields or fields == [""]:
+            continue
+        try:
+            ticker, quantity = parse_row([str(field) for field in fields])
+        except ValueError as e:
+            error_count += 1
+            if len(errors) < MAX_REPORTED_ERRORS:
+                errors.append({"holding": number, "reason": str(e)})
+            continue
+        tickers.append(ticker)
+        quantities.append(quantity)
+    if error_count:
+        raise HTTPError(400, f"{error_count} invalid holding(s)", {"errors": errors})
+    if not tickers:
+        raise HTTPError(400, "no holdings to value")
+    return aggregate(tickers, quantities)
+
+
+# (tickers, quantities, base currency or None) from a request body
+def parse_payload(body, content_type, query):
+    base = query.get("base", [None])[0]
+    if content_type.startswith("text/csv") or content_type.startswith("text/plain"):
+        import csv
+        lines = body.decode("utf-8").splitlines()
+        rows = enumerate(csv.reader(lines), start=1)
+        return (*parse_holdings(rows), base)
+
+    try:
+        payload = json.loads(body)
+    except (UnicodeDecodeError, ValueError) as e:
+        raise HTTPError(400, f"body is not valid JSON: {e}") from None
+    if not isinstance(payload, dict) or not isinstance(payload.get("holdings"), list):
+        raise HTTPError(400, 'expected a JSON object with a "holdings" list')
+    rows = []
+    for number, holding in enumerate(payload["holdings"], start=1):
+        if isinstance(holding, dict):
+            holding = [holding.get("ticker", holding.get("symbol", "")),
+                       holding.get("quantity", "")]
+        elif not isinstance(holding, list):
+            holding = [holding]
+        rows.append((number, holding))
+    return (*parse_holdings(rows), payload.get("base_currency") or base)
+
+
+class ValuationService:
+    """Values portfolios for many concurrent clients over one shared fetcher."""
+
+    def __init__(self, fetcher, max_active=DEFAULT_MAX_ACTIVE, max_queue=DEFAULT_MAX_QUEUE,
+                 max_positions=DEFAULT_MAX_POSITIONS, max_body=DEFAULT_MAX_BODY,
+                 timeout=DEFAULT_TIMEOUT, base=None):
+        self.fetcher = CoalescingFetcher(fetcher)
+        self.max_active = max_active
+        self.max_queue = max_queue
+        self.max_positions = max_positions
+        self.max_body = max_body
+        self.timeout = timeout
+        self.base = base or base_currency()
+        self.active = 0
+        self.queued = 0
+        self.served = 0
+        self.rejected = 0
+        self.started = time.time()
+        self._slots = None
+
+    def stats(self):
+        cache = self.fetcher.cache
+        return {
+            "uptime": time.time() - self.started,
+            "active": self.active,
+            "queued": self.queued,
+            "served": self.served,
+            "rejected": self.rejected,
+            "symbols_requested": self.fetcher.requested,
+            "symbols_coalesced": self.fetcher.coalesced,
+            "cache": cache.stats() if cache is not None else None,
+            "scheduler": self.fetcher.fetcher.scheduler.stats(),
+        }
+
+    async def value(self, body, content_type, query):
+        tickers, quantities, base = parse_payload(body, content_type, query)
+        if len(tickers) > self.max_positions:
+            raise HTTPError(413, f"more than {self.max_positions} positions")
+        base = (base or self.base).upper()
+
+        # backpressure: a bounded number of valuations run, a bounded number wait
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_active)
+        if self.active >= self.max_active and self.queued >= self.max_queue:
+            self.rejected += 1
+            metrics.count("service_rejected_total")
+            raise HTTPError(503, "too many valuations in progress", {"retry_after": 1})
+        self.queued += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.queued -= 1
+        self.active += 1
+        try:
+            with metrics.stage("service_valuation"):
+                valuation = await asyncio.wait_for(
+                    fetch_valuation(self.fetcher, tickers, quantities, base), self.timeout)
+        except asyncio.TimeoutError:
+            raise HTTPError(504, f"valuation took longer than {self.timeout:g}s") from None
+        finally:
+            self.active -= 1
+            self._slots.release()
+        self.served += 1
+        return render_json(valuation)
+
+    async def dispatch(self, method, target, headers, body):
+        url = urlsplit(target)
+        query = parse_qs(url.query)
+        if url.path == "/value":
+            if method != "POST":
+                raise HTTPError(405, "use POST")
+            text = await self.value(body, headers.get("content-type", "application/json"), query)
+            return 200, text
+        if method != "GET":
+            raise HTTPError(405, "use GET")
+        if url.path == "/health":
+            return 200, '{"status": "ok"}\n'
+        if url.path == "/stats":
+            return 200, json.dumps(self.stats(), indent=2) + "\n"
+        if url.path == "/metrics":
+            return 200, metrics.to_prometheus()
+        raise HTTPError(404, f"no such endpoint {url.path}")
+
+    async def _read_request(self, reader):
+        """(method, target, headers, body), or None when the client is done."""
+        line = await reader.readline()
+        if not line:
+            return None
+        if len(line) > MAX_LINE:
+            raise HTTPError(400, "request line too long")
+        try:
+            method, target, version = line.decode("latin-1").split()
+        except ValueError:
+            raise HTTPError(400, "malformed request line") from None
+
+        headers = {"_version": version}
+        while True:
+            line = await reader.readline()
+            if len(line) > MAX_LINE:
+                raise HTTPError(400, "header line too long")
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        if "chunked" in headers.get("transfer-encoding", ""):
+            raise HTTPError(411, "chunked bodies are not supported, send Content-Length")
+        try:
+            length = int(headers.get("content-length", 0))
+        except ValueError:
+            raise HTTPError(400, "bad Content-Length") from None
+        if length > self.max_body:
+            raise HTTPError(413, f"body larger than {self.max_body} bytes")
+        body = await reader.readexactly(length) if length else b""
+        return method.upper(), target, headers, body
+
+    async def handle(self, reader, writer):
+        """Serve one connection, keeping it open between requests."""
+        try:
+            while True:
+                keep_alive = True
+                extra = {}
+                request = None
+                try:
+                    request = await self._read_request(reader)
+                    if request is None:
+                        break
+                    method, target, headers, body = request
+                    connection = headers.get("connection", "").lower()
+                    keep_alive = (connection != "close"
+                                  and (headers["_version"] != "HTTP/1.0"
+                                       or connection == "keep-alive"))
+                    status, text = await self.dispatch(method, target, headers, body)
+                    content_type = ("text/plain; version=0.0.4" if target.startswith("/metrics")
+                                    else "application/json")
+                except HTTPError as e:
+                    status = e.status
+                    content_type = "application/json"
+                    text = json.dumps({"error": str(e), **e.details}) + "\n"
+                    if "retry_after" in e.details:
+                        extra["Retry-After"] = str(e.details["retry_after"])
+                    if request is None:
+                        # the request was not read to its end, the stream is out of step
+                        keep_alive = False
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                except Exception as e:
+                    status, content_type = 500, "application/json"
+                    text = json.dumps({"error": f"internal error: {e}"}) + "\n"
+                    keep_alive = False
+
+                metrics.count("service_responses_total", status=status)
+                data = text.encode()
+                head = [f"HTTP/1.1 {status} {REASONS.get(status, '')}",
+                        f"Content-Type: {content_type}",
+                        f"Content-Length: {len(data)}",
+                        f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+                head.extend(f"{name}: {value}" for name, value in extra.items())
+                writer.write(("\r\n".join(head) + "\r\n\r\n").encode() + data)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host, port, on_ready=None):
+        """Serve until cancelled; on_ready gets the bound port (useful with port 0)."""
+        server = await asyncio.start_server(self.handle, host, port, limit=MAX_LINE * 2,
+                                            backlog=1024)
+        if on_ready is not None:
+            on_ready(server.sockets[0].getsockname()[1])
+        async with server:
+            await server.serve_forever()
+
+
+# every client connection is a file descriptor, allow as many as the system does
+def raise_file_limit():
+    try:
+        import resource
+    except ImportError:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or soft < hard:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        except (ValueError, OSError):
+            pass
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="main.py serve",
+        description="Value posted portfolios over HTTP, sharing quotes between clients.")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT,
+                        help=f"port to listen on (default: {DEFAULT_PORT})")
+    parser.add_argument("--provider", help="quote provider (default: PORTFOLIO_PROVIDER or yfinance)")
+    parser.add_argument("--max-concurrency", type=int, help="quote requests in flight at once")
+    parser.add_argument("--batch-size", type=int, help="symbols per batched quote request")
+    parser.add_argument("--max-active", type=int, default=DEFAULT_MAX_ACTIVE,
+                        help="valuations running at once")
+    parser.add_argument("--max-queue", type=int, default=DEFAULT_MAX_QUEUE,
+                        help="valuations waiting for a slot before new ones get 503")
+    parser.add_argument("--max-positions", type=int, default=DEFAULT_MAX_POSITIONS,
+                        help="largest portfolio accepted")
+    parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT,
+                        help="seconds a valuation may take before it fails with 504")
+    parser.add_argument("--cache-ttl", type=float, default=60.0,
+                        help="seconds a shared quote stays fresh (default: 60)")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="local provider only: simulated seconds per request")
+    return parser
+
+
+def run(argv):
+    args = build_parser().parse_args(argv)
+    try:
+        provider = get_provider(args.provider)
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 2
+    if isinstance(provider, LocalQuoteProvider):
+        provider.latency = args.latency
+
+    metrics.enable()
+    cache = QuoteCache(path=None, ttl=args.cache_ttl)
+    fetcher = QuoteFetcher(provider, max_concurrency=args.max_concurrency,
+                           batch_size=args.batch_size, cache=cache)
+    service = ValuationService(fetcher, max_active=args.max_active, max_queue=args.max_queue,
+                               max_positions=args.max_positions, timeout=args.timeout)
+    raise_file_limit()
+
+    def on_ready(port):
+        print(f"Serving valuations on http://{args.host}:{port} (Ctrl+C to stop)", flush=True)
+
+    try:
+        asyncio.run(service.serve(args.host, args.port, on_ready))
+    except KeyboardInterrupt:
+        print()
+    finally:
+        fetcher.close()
+    print(f"Stopped after {service.served} valuations ({service.rejected} turned away).")
+    return 0
@@ -0,0 +1,408 @@
+"""Valuation snapshots and incremental revaluation.
+
+Every valuation made from the menu is saved as a snapshot: holdings,
+the prices and exchange rates used, each position's value and a hash of
+the portfolio file. The next valuation of the same portfolio starts from
+its latest snapshot. Only new symbols and symbols whose price is older
+than the quote cache's TTL are fetched. Only positions whose quantity,
+price or exchange rate changed are revalued, and the total is moved by
+their difference. diff() compares two snapshots for the change report.
+
+Snapshots are kept in SQLite (snapshots.db), one row per snapshot with
+its columns packed into a zlib-compressed blob; only the newest
+PORTFOLIO_SNAPSHOT_KEEP snapshots of each portfolio are kept.
+"""
+import json
+import math
+import os
+import sqlite3
+import struct
+import sys
+import time
+import zlib
+from array import array
+from datetime import datetime
+
+from fx import DEFAULT_BASE, conversion_factors, currency_of, rates_for_quotes, split_minor
+from metrics import metrics
+from quote_cache import DEFAULT_TTL
+from quote_provider import Quote
+from report import Valuation, fetch_valuation
+
+
+DEFAULT_PATH = "snapshots.db"
+
+# snapshots kept per portfolio, older ones are deleted as new ones are saved
+DEFAULT_KEEP = 20
+
+# changed positions listed in the change report, largest changes first
+MAX_CHANGE_ROWS = 20
+
+# positions and length of the text part at the start of a packed snapshot
+_HEADER = struct.Struct("<II")
+
+
+class Snapshot:
+    """One saved valuation of a portfolio.
+
+    Columns are parallel lists as in report.Valuation: `prices` in the
+    quoted currencies, `values` and `total` in `base`, NaN where a
+    position had no value. `quoted_at` is when each price was fetched,
+    `rates_at` when the exchange rates were.
+    """
+
+    __slots__ = ("portfolio", "taken_at", "digest", "base", "total", "rates", "rates_at",
+                 "symbols", "names", "quantities", "currencies", "prices", "values",
+                 "quoted_at")
+
+    def __init__(self, portfolio, taken_at, digest, base, total, rates, rates_at, symbols,
+                 names, quantities, currencies, prices, values, quoted_at):
+        self.portfolio = portfolio
+        self.taken_at = taken_at
+        self.digest = digest
+        self.base = base
+        self.total = total
+        self.rates = rates
+        self.rates_at = rates_at
+        self.symbols = symbols
+        self.names = names
+        self.quantities = quantities
+        self.currencies = currencies
+        self.prices = prices
+        self.values = values
+        self.quoted_at = quoted_at
+
+    @classmethod
+    def from_valuation(cls, portfolio, valuation, digest=None, rates_at=None, taken_at=None):
+        taken_at = time.time() if taken_at is None else taken_at
+        return cls(portfolio, taken_at, digest, valuation.base, valuation.total,
+                   dict(valuation.rates), taken_at if rates_at is None else rates_at,
+                   list(valuation.symbols), list(valuation.names), list(valuation.quantities),
+                   list(valuation.currencies), list(valuation.prices), list(valuation.values),
+                   list(valuation.quoted_at))
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def index(self):
+        """{symbol: position} for lookups by symbol."""
+        return {symbol: i for i, symbol in enumerate(self.symbols)}
+
+    def quote(self, i):
+        """The price of position i as the Quote it was made from."""
+        return Quote(self.symbols[i], self.prices[i], self.names[i], self.currencies[i],
+                     self.quoted_at[i])
+
+
+def _float_bytes(column):
+    data = array("d", column)
+    if sys.byteorder == "big":
+        data.byteswap()
+    return data.tobytes()
+
+
+def _float_column(blob, start, count):
+    data = array("d")
+    data.frombytes(blob[start:start + 8 * count])
+    if sys.byteorder == "big":
+        data.byteswap()
+    return data.tolist()
+
+
+# whole-number quantities come back as ints, as the loader reads them
+def _as_number(quantity):
+    return int(quantity) if quantity.is_integer() else quantity
+
+
+def pack(snapshot):
+    """The columns of a snapshot as one compressed blob.
+
+    Text columns are JSON, numeric ones little-endian float64 arrays.
+    """
+    text = json.dumps([snapshot.symbols, snapshot.names, snapshot.currencies, snapshot.rates],
+                      separators=(",", ":")).encode()
+    numbers = b"".join(_float_bytes(column) for column in (
+        snapshot.quantities, snapshot.prices, snapshot.values, snapshot.quoted_at))
+    return zlib.compress(_HEADER.pack(len(snapshot), len(text)) + text + numbers)
+
+
+# (symbols, names, currencies, rates, quantities, prices, values, quoted_at) of a packed blob
+def unpack(blob):
+    blob = zlib.decompress(blob)
+    count, text_length = _HEADER.unpack_from(blob)
+    start = _HEADER.size + text_length
+    symbols, names, currencies, rates = json.loads(blob[_HEADER.size:start])
+    quantities, prices, values, quoted_at = (
+        _float_column(blob, start + 8 * count * k, count) for k in range(4))
+    return (symbols, names, currencies, rates, [_as_number(q) for q in quantities], prices,
+            values, quoted_at)
+
+
+class SnapshotStore:
+    """Snapshots in SQLite, keyed by portfolio and kept for the last `keep` runs."""
+
+    def __init__(self, path=DEFAULT_PATH, keep=DEFAULT_KEEP):
+        if keep < 1:
+            raise ValueError("keep must be at least 1")
+        self.path = path
+        self.keep = keep
+        self._db = sqlite3.connect(path)
+        with self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS snapshots ("
+                " id INTEGER PRIMARY KEY,"
+                " portfolio TEXT NOT NULL,"
+                " taken_at REAL NOT NULL,"
+                " digest TEXT,"
+                " base TEXT NOT NULL,"
+                " total REAL NOT NULL,"
+                " rates_at REAL NOT NULL,"
+                " positions INTEGER NOT NULL,"
+                " data BLOB NOT NULL)"
+            )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS snapshots_portfolio ON snapshots (portfolio, id)")
+
+    @classmethod
+    def from_env(cls):
+        """A store configured by PORTFOLIO_SNAPSHOT_*, None when turned off.
+
+        An empty PORTFOLIO_SNAPSHOT_PATH turns snapshots off.
+        """
+        path = os.environ.get("PORTFOLIO_SNAPSHOT_PATH", DEFAULT_PATH)
+        if not path:
+            return None
+        return cls(path, keep=int(os.environ.get("PORTFOLIO_SNAPSHOT_KEEP", DEFAULT_KEEP)))
+
+    def save(self, snapshot):
+        """Add a snapshot and drop the portfolio's snapshots past `keep`."""
+        with self._db:
+            self._db.execute(
+                "INSERT INTO snapshots (portfolio, taken_at, digest, base, total, rates_at,"
+                " positions, data) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (snapshot.portfolio, snapshot.taken_at, snapshot.digest, snapshot.base,
+                 snapshot.total, snapshot.rates_at, len(snapshot), pack(snapshot)))
+            self._db.execute(
+                "DELETE FROM snapshots WHERE portfolio = ? AND id NOT IN ("
+                " SELECT id FROM snapshots WHERE portfolio = ? ORDER BY id DESC LIMIT ?)",
+                (snapshot.portfolio, snapshot.portfolio, self.keep))
+
+    def latest(self, portfolio):
+        """The newest Snapshot of `portfolio`, or None."""
+        row = self._db.execute(
+            "SELECT taken_at, digest, base, total, rates_at, data FROM snapshots"
+            " WHERE portfolio = ? ORDER BY id DESC LIMIT 1", (portfolio,)).fetchone()
+        if row is None:
+            return None
+        taken_at, digest, base, total, rates_at, data = row
+        symbols, names, currencies, rates, quantities, prices, values, quoted_at = unpack(data)
+        return Snapshot(portfolio, taken_at, digest, base, total, rates, rates_at, symbols, names,
+                        quantities, currencies, prices, values, quoted_at)
+
+    def history(self, portfolio):
+        """(taken_at, total, base, positions) of the kept snapshots, oldest first."""
+        return self._db.execute(
+            "SELECT taken_at, total, base, positions FROM snapshots"
+            " WHERE portfolio = ? ORDER BY id", (portfolio,)).fetchall()
+
+    def close(self):
+        self._db.close()
+
+
+def _same(a, b):
+    return a == b or (a != a and b != b)
+
+
+def _nonzero(value):
+    return 0.0 if math.isnan(value) else value
+
+
+async def revalue(fetcher, symbols, quantities, previous, base=DEFAULT_BASE, refresh=False,
+                  ttl=DEFAULT_TTL, digest=None):
+    """Value the holdings starting from `previous`, the portfolio's last Snapshot.
+
+    Prices younger than `ttl` seconds are taken from the snapshot, the
+    rest (all of them with refresh=True) are fetched. Positions whose
+    quantity, price and exchange rate are unchanged keep their value;
+    the total is the snapshot's, moved by the difference of the others.
+    When `digest`, the hash of the portfolio file, is the snapshot's,
+    the holdings are the snapshot's and are not compared again.
+    Returns (valuation, fetched symbols, rates_at).
+    """
+    now = time.time()
+    if previous.base != base:
+        # values in another currency cannot be carried over
+        valuation = await fetch_valuation(fetcher, symbols, quantities, base, refresh)
+        return valuation, list(symbols), now
+
+    same_holdings = digest is not None and digest == previous.digest
+    if same_holdings:
+        # positions line up one to one with the snapshot's
+        symbols, quantities = previous.symbols, previous.quantities
+        positions = range(len(symbols))
+    else:
+        old = previous.index()
+        positions = [old.get(symbol) for symbol in symbols]
+    reused = {}
+    if not refresh:
+        for symbol, i in zip(symbols, positions):
+            if (i is not None and not math.isnan(previous.prices[i])
+                    and now - previous.quoted_at[i] <= ttl):
+                reused[symbol] = previous.quote(i)
+    fetched = [symbol for symbol in symbols if symbol not in reused]
+    metrics.count("snapshot_prices_reused_total", len(reused))
+
+    with metrics.stage("fetch"):
+        quotes, errors = ((await fetcher.fetch_many(fetched, refresh=refresh)) if fetched
+                          else ({}, {}))
+        quotes.update(reused)
+        rates = None
+        rates_at = now
+        if not refresh and now - previous.rates_at <= ttl:
+            rates, rates_at = previous.rates, previous.rates_at
+        rates, rate_errors = await rates_for_quotes(fetcher, symbols, quotes, base, refresh,
+                                                    rates)
+
+    with metrics.stage("value"):
+        currencies = [currency_of(symbol, quotes.get(symbol)) for symbol in symbols]
+        factors = conversion_factors(currencies, rates)
+        factors = factors.tolist() if hasattr(factors, "tolist") else factors
+        moved_rates = {currency for currency in set(rates) | set(previous.rates)
+                       if not _same(rates.get(currency), previous.rates.get(currency))}
+
+        # sold positions leave the total, the rest move it by their change
+        total = previous.total
+        if not same_holdings:
+            held = set(symbols)
+            for symbol, i in old.items():
+                if symbol not in held:
+                    total -= _nonzero(previous.values[i])
+
+        names, prices, native_values, values, quoted_at = [], [], [], [], []
+        for symbol, quantity, currency, factor, i in zip(symbols, quantities, currencies,
+                                                         factors, positions):
+            quote = quotes.get(symbol)
+            price = quote.price if quote is not None and quote.price else math.nan
+            if (i is not None and (same_holdings or quantity == previous.quantities[i])
+                    and _same(price, previous.prices[i]) and currency == previous.currencies[i]
+                    and split_minor(currency)[0] not in moved_rates):
+                value = previous.values[i]
+            else:
+                value = quantity * price * factor
+                total += _nonzero(value) - (_nonzero(previous.values[i]) if i is not None else 0.0)
+            names.append(quote.name if quote is not None else symbol)
+            prices.append(price)
+            native_values.append(quantity * price)
+            values.append(value)
+            quoted_at.append(math.nan if quote is None
+                             else quote.fetched_at if quote.fetched_at is not None else now)
+
+        valuation = Valuation.from_columns(
+            symbols, names, quantities, currencies, prices, native_values, values, total,
+            errors, rates, base, rate_errors, quoted_at)
+    return valuation, fetched, rates_at
+
+
+class Changes:
+    """What changed between two snapshots of a portfolio.
+
+    `market` is the P&L of the positions held in both, from price and
+    exchange rate moves on the earlier quantities; `flows` is the value
+    added or removed by buying and selling. `unpriced` is the rest of
+    the change, from positions that had a value in only one snapshot.
+    `rows` are (symbol, old quantity, new quantity, old value, new
+    value, kind) for every position whose value or quantity changed.
+    """
+
+    __slots__ = ("since", "base", "previous_total", "total", "market", "flows", "unpriced",
+                 "rows", "holdings_changed")
+
+    def __init__(self, since, base, previous_total, total, market, flows, rows,
+                 holdings_changed):
+        self.since = since
+        self.base = base
+        self.previous_total = previous_total
+        self.total = total
+        self.market = market
+        self.flows = flows
+        self.unpriced = (total - previous_total) - market - flows
+        self.rows = rows
+        self.holdings_changed = holdings_changed
+
+
+def diff(previous, current):
+    """Changes from `previous` to `current`, None when their base currencies differ."""
+    if previous.base != current.base:
+        return None
+    if current.digest is not None and current.digest == previous.digest:
+        # same file, same holdings in the same order: only values can differ
+        old = {}
+        positions = range(len(current))
+    else:
+        old = previous.index()
+        positions = [old.pop(symbol, None) for symbol in current.symbols]
+    market = flows = 0.0
+    rows = []
+    for symbol, quantity, value, i in zip(current.symbols, current.quantities, current.values,
+                                          positions):
+        if i is None:
+            flows += _nonzero(value)
+            rows.append((symbol, None, quantity, math.nan, value, "new"))
+            continue
+        old_quantity, old_value = previous.quantities[i], previous.values[i]
+        if old_quantity == quantity and _same(old_value, value):
+            continue
+        if math.isnan(old_value) or math.isnan(value):
+            kind = "unpriced" if math.isnan(value) else "priced"
+        else:
+            unit = value / quantity
+            market += old_quantity * (unit - old_value / old_quantity)
+            flows += (quantity - old_quantity) * unit
+            kind = "quantity" if quantity != old_quantity else "market"
+        rows.append((symbol, old_quantity, quantity, old_value, value, kind))
+    for symbol, i in old.items():
+        flows -= _nonzero(previous.values[i])
+        rows.append((symbol, previous.quantities[i], None, previous.values[i], math.nan,
+                     "removed"))
+
+    rows.sort(key=lambda row: -abs(_nonzero(row[4]) - _nonzero(row[3])))
+    holdings_changed = any(kind in ("new", "removed", "quantity") for *_, kind in rows)
+    return Changes(previous.taken_at, current.base, previous.total, current.total, market, flows,
+                   rows, holdings_changed)
+
+
+def _amount(value, signed=False):
+    if math.isnan(value):
+        return "N/A"
+    return f"{value:+,.2f}" if signed else f"{value:,.2f}"
+
+
+def render_changes(changes, max_rows=MAX_CHANGE_ROWS):
+    since = datetime.fromtimestamp(changes.since).strftime("%Y-%m-%d %H:%M:%S")
+    base = changes.base
+    change = changes.total - changes.previous_total
+    lines = [f"Changes since the last valuation ({since}):",
+             f"  Total: {changes.previous_total:,.2f} -> {changes.total:,.2f} {base} "
+             f"({change:+,.2f})"]
+    if not changes.rows:
+        lines.append("  No position changed.")
+        return "\n".join(lines) + "\n"
+
+    summary = f"  Market P&L: {changes.market:+,.2f} {base}"
+    if changes.holdings_changed:
+        summary += f", bought/sold: {changes.flows:+,.2f} {base}"
+    if abs(changes.unpriced) >= 0.005:
+        summary += f", positions priced in only one valuation: {changes.unpriced:+,.2f} {base}"
+    lines.append(summary)
+    lines.append(f"  {'Symbol':12} {'Shares':>20} {'Was':>16} {'Now':>16} {'Change':>14}")
+    for symbol, old_quantity, quantity, old_value, value, kind in changes.rows[:max_rows]:
+        if old_quantity is None or quantity is None or old_quantity == quantity:
+            shares = f"{quantity if quantity is not None else old_quantity}"
+        else:
+            shares = f"{old_quantity} -> {quantity}"
+        delta = _nonzero(value) - _nonzero(old_value)
+        lines.append(f"  {symbol:12} {shares:>20} {_amount(old_value):>16} {_amount(value):>16} "
+                     f"{_amount(delta, signed=True):>14}  {kind}")
+    if len(changes.rows) > max_rows:
+        lines.append(f"  ... and {len(changes.rows) - max_rows} more changed position(s)")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,46 @@
+import math
+
+
+# portfolios with up to this many symbols are valued in plain Python;
+# importing NumPy and pandas costs more than valuing them takes
+SMALL_PORTFOLIO = 1000
+
+
+# merge repeated tickers in plain lists, keeping first-seen order
+def aggregate(tickers, quantities):
+    totals = {}
+    for ticker, quantity in zip(tickers, quantities):
+        totals[ticker] = totals.get(ticker, 0) + quantity
+    return list(totals.keys()), list(totals.values())
+
+
+# (symbols, quantities) with one entry per symbol, from a LoadResult or a DataFrame
+def holdings_lists(portfolio):
+    if hasattr(portfolio, 'tickers'):
+        return portfolio.tickers, portfolio.quantities
+    return aggregate(portfolio['ticker'].tolist(), portfolio['quantity'].tolist())
+
+
+# build the price vector for `symbols`, NaN where there is no usable price
+def price_vector(symbols, quotes):
+    import numpy as np
+    prices = np.fromiter(
+        (quotes[s].price if s in quotes else np.nan for s in symbols),
+        dtype=float, count=len(symbols))
+    prices[prices == 0] = np.nan
+    return prices
+
+
+# (prices, values, total) for parallel symbol/quantity lists, NaN where unpriced
+def value_positions(symbols, quantities, quotes):
+    if len(symbols) <= SMALL_PORTFOLIO:
+        prices = [quotes[s].price if s in quotes and quotes[s].price else math.nan
+                  for s in symbols]
+        values = [quantity * price for quantity, price in zip(quantities, prices)]
+        total = sum(value for value in values if not math.isnan(value))
+        return prices, values, total
+
+    import numpy as np
+    prices = price_vector(symbols, quotes)
+    values = np.asarray(quantities, dtype=float) * prices
+    return prices, values, float(np.nansum(values))
@@ -0,0 +1,302 @@
+"""Live watch mode: keeps the portfolio value current.
+
+    python main.py watch portfolio.csv --interval 1
+
+Quotes are polled on a fixed asyncio schedule. A symbol is fetched
+again only once its cached quote is older than the interval, and only
+the positions whose price, exchange rate or quantity changed are
+revalued; the total is adjusted by their difference instead of being
+summed again. Values are converted to the base currency. Edits
+to the portfolio file are picked up from its mtime and content hash.
+On a terminal only the changed lines are redrawn; otherwise each
+change is printed as a log line.
+"""
+import argparse
+import asyncio
+import hashlib
+import math
+import os
+import shutil
+import sys
+import time
+
+from fx import base_currency, currency_of, rates_for_quotes, split_minor
+from portfolio_loader import load_portfolio
+from quote_cache import QuoteCache
+from quote_provider import LocalQuoteProvider, QuoteFetcher, get_provider
+
+
+DEFAULT_INTERVAL = 1.0
+
+
+def file_digest(path):
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# equal, counting two NaNs as equal
+def same_number(a, b):
+    return a == b or (math.isnan(a) and math.isnan(b))
+
+
+def format_row(symbol, quantity, price, value):
+    if math.isnan(price):
+        return f"{symbol:12} {quantity!s:>10} {'N/A':>12} {'N/A':>16}"
+    return f"{symbol:12} {quantity!s:>10} {price:12.2f} {value:16,.2f}"
+
+
+class TerminalView:
+    """Draws the table once, then rewrites only the lines that changed."""
+
+    HEADER_LINES = 3
+
+    def __init__(self, out):
+        self.out = out
+        self.positions = {}
+        self.visible = 0
+
+    def redraw(self, watcher):
+        height = shutil.get_terminal_size().lines
+        self.visible = max(0, min(len(watcher.symbols), height - self.HEADER_LINES - 3))
+        self.positions = {symbol: self.HEADER_LINES + 1 + i
+                          for i, symbol in enumerate(watcher.symbols[:self.visible])}
+
+        lines = ["\x1b[H\x1b[2J",
+                 f"Watching {watcher.path} every {watcher.interval:g}s (Ctrl+C to stop)\n",
+                 f"{'Symbol':12} {'Shares':>10} {'Price':>12} {'Value (' + watcher.base + ')':>16}\n",
+                 "-" * 53 + "\n"]
+        for symbol in watcher.symbols[:self.visible]:
+            lines.append(watcher.row(symbol) + "\n")
+        if len(watcher.symbols) > self.visible:
+            lines.append(f"... {len(watcher.symbols) - self.visible} more positions\n")
+        self.out.write("".join(lines))
+        self.update(watcher, ())
+
+    def update(self, watcher, changed):
+        parts = []
+        for symbol in changed:
+            line = self.positions.get(symbol)
+            if line is not None:
+                parts.append(f"\x1b[{line};1H\x1b[2K{watcher.row(symbol)}")
+        footer = self.HEADER_LINES + self.visible + (2 if len(watcher.symbols) > self.visible else 1)
+        parts.append(f"\x1b[{footer + 1};1H\x1b[2K{watcher.status_line()}")
+        self.out.write("".join(parts))
+        self.out.flush()
+
+
+class LogView:
+    """Prints one line per change, for pipes and log files."""
+
+    def __init__(self, out):
+        self.out = out
+
+    def redraw(self, watcher):
+        self.out.write(f"Watching {watcher.path}: {len(watcher.symbols)} positions\n")
+        self.update(watcher, watcher.symbols)
+
+    def update(self, watcher, changed):
+        lines = [watcher.row(symbol) + "\n" for symbol in changed]
+        if changed:
+            lines.append(watcher.status_line() + "\n")
+        self.out.write("".join(lines))
+        self.out.flush()
+
+
+class PortfolioWatcher:
+    """Holds the running valuation of one portfolio file."""
+
+    def __init__(self, path, fetcher, interval=DEFAULT_INTERVAL, view=None, base=None):
+        self.path = path
+        self.fetcher = fetcher
+        self.interval = interval
+        self.view = view or LogView(sys.stdout)
+        self.base = base or base_currency()
+
+        self.symbols = []      # display order
+        self.quantities = {}
+        self.prices = {}       # NaN until a price arrives, in the quote's currency
+        self.factors = {}      # turns a price into the base currency, NaN without a rate
+        self.values = {}       # in the base currency
+        self.total = 0.0
+        self.unpriced = set()  # left out of the total, never counted as 0
+        self.cycles = 0
+        self.late_cycles = 0
+        self.last_fetch_time = 0.0
+        self.last_fetched = 0
+
+        self._signature = None
+        self._digest = None
+
+    def row(self, symbol):
+        return format_row(symbol, self.quantities[symbol], self.prices[symbol], self.values[symbol])
+
+    def total_text(self):
+        text = f"Total Portfolio Value: {self.total:,.2f} {self.base}"
+        if self.unpriced:
+            text += f" ({len(self.unpriced)} position(s) unpriced)"
+        return text
+
+    def status_line(self):
+        return (f"{self.total_text()}   "
+                f"[cycle {self.cycles}, {self.last_fetched} fetched in "
+                f"{self.last_fetch_time * 1000:.0f} ms, {self.late_cycles} late]")
+
+    def _set_value(self, symbol):
+        """Revalue one position and move the total by the difference."""
+        old = self.values.get(symbol, math.nan)
+        new = self.quantities[symbol] * self.prices[symbol] * self.factors[symbol]
+        self.total += (0.0 if math.isnan(new) else new) - (0.0 if math.isnan(old) else old)
+        self.values[symbol] = new
+        if math.isnan(new):
+            self.unpriced.add(symbol)
+        else:
+            self.unpriced.discard(symbol)
+
+    def reload_if_changed(self):
+        """Re-read the file when its mtime and then its content changed.
+
+        Returns (layout_changed, changed_symbols). A file that cannot be
+        read keeps the last holdings and is tried again on the next call.
+        """
+        try:
+            stat = os.stat(self.path)
+            signature = (stat.st_mtime_ns, stat.st_size)
+            if signature == self._signature:
+                return False, []
+            digest = file_digest(self.path)
+            if digest == self._digest:
+                self._signature = signature
+                return False, []
+            result = load_portfolio(self.path)
+        except OSError:
+            # editors that save by writing a new file and renaming it leave
+            # the path missing for a moment
+            return False, []
+        self._signature = signature
+        self._digest = digest
+
+        new = dict(zip(result.tickers, result.quantities))
+        changed = []
+        for symbol in self.symbols:
+            if symbol not in new:
+                old = self.values.pop(symbol)
+                if not math.isnan(old):
+                    self.total -= old
+                del self.quantities[symbol]
+                del self.prices[symbol]
+                del self.factors[symbol]
+                self.unpriced.discard(symbol)
+        for symbol, quantity in new.items():
+            if self.quantities.get(symbol) != quantity:
+                self.quantities[symbol] = quantity
+                self.prices.setdefault(symbol, math.nan)
+                self.factors.setdefault(symbol, math.nan)
+                self._set_value(symbol)
+                changed.append(symbol)
+
+        layout_changed = list(new) != self.symbols
+        self.symbols = list(new)
+        return layout_changed, changed
+
+    async def refresh_prices(self):
+        """Fetch expired quotes and revalue only the positions that moved."""
+        started = time.perf_counter()
+        cache = self.fetcher.cache
+        misses_before = cache.misses if cache is not None else 0
+        quotes, errors = await self.fetcher.fetch_many(self.symbols)
+        rates, _ = await rates_for_quotes(self.fetcher, self.symbols, quotes, self.base)
+        self.last_fetch_time = time.perf_counter() - started
+        self.last_fetched = (cache.misses - misses_before) if cache is not None else len(self.symbols)
+
+        changed = []
+        for symbol in self.symbols:
+            quote = quotes.get(symbol)
+            price = quote.price if quote is not None and quote.price else math.nan
+            major, scale = split_minor(currency_of(symbol, quote))
+            factor = scale * rates.get(major, math.nan)
+            if not (same_number(price, self.prices[symbol]) and same_number(factor, self.factors[symbol])):
+                self.prices[symbol] = price
+                self.factors[symbol] = factor
+                self._set_value(symbol)
+                changed.append(symbol)
+        return changed
+
+    async def cycle(self):
+        layout_changed, changed = self.reload_if_changed()
+        changed += await self.refresh_prices()
+        self.cycles += 1
+        if layout_changed or self.cycles == 1:
+            self.view.redraw(self)
+        else:
+            self.view.update(self, list(dict.fromkeys(changed)))
+
+    async def run(self, cycles=None):
+        """Run every `interval` seconds; late ticks are skipped, not queued."""
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time()
+        while cycles is None or self.cycles < cycles:
+            await self.cycle()
+            next_tick += self.interval
+            now = loop.time()
+            if now > next_tick:
+                # fell behind: count it and realign instead of bursting
+                missed = int((now - next_tick) // self.interval) + 1
+                self.late_cycles += missed
+                next_tick += missed * self.interval
+            await asyncio.sleep(next_tick - now)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="main.py watch",
+        description="Keep the portfolio value current, refreshing quotes on a schedule.")
+    parser.add_argument("path", nargs="?", default="portfolio.csv",
+                        help="portfolio csv file (default: portfolio.csv)")
+    parser.add_argument("--interval", type=float, default=DEFAULT_INTERVAL,
+                        help="seconds between refreshes (default: 1)")
+    parser.add_argument("--cycles", type=int, help="stop after this many refreshes")
+    parser.add_argument("--provider", help="quote provider (default: PORTFOLIO_PROVIDER or yfinance)")
+    parser.add_argument("--base-currency", help="currency of the values (default: PORTFOLIO_BASE_CURRENCY or USD)")
+    parser.add_argument("--max-concurrency", type=int, help="quote requests in flight at once")
+    parser.add_argument("--tick-volatility", type=float, default=0.002,
+                        help="local provider only: size of simulated price moves")
+    parser.add_argument("--log", action="store_true",
+                        help="print changes as log lines even on a terminal")
+    return parser
+
+
+def run(argv):
+    args = build_parser().parse_args(argv)
+    if args.interval <= 0:
+        print("Error: --interval must be positive.", file=sys.stderr)
+        return 2
+    if not os.path.exists(args.path):
+        print(f"Error: {args.path} not found.", file=sys.stderr)
+        return 2
+
+    try:
+        provider = get_provider(args.provider)
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 2
+    if isinstance(provider, LocalQuoteProvider):
+        provider.tick_volatility = args.tick_volatility
+
+    # quotes expire just before the next tick, so each symbol is fetched once per interval
+    cache = QuoteCache(path=None, ttl=args.interval * 0.9)
+    fetcher = QuoteFetcher(provider, max_concurrency=args.max_concurrency, cache=cache)
+    view = TerminalView(sys.stdout) if sys.stdout.isatty() and not args.log else LogView(sys.stdout)
+    watcher = PortfolioWatcher(args.path, fetcher, args.interval, view,
+                               base=(args.base_currency or base_currency()).upper())
+    try:
+        asyncio.run(watcher.run(args.cycles))
+    except KeyboardInterrupt:
+        print()
+    finally:
+        fetcher.close()
+    print(f"Stopped after {watcher.cycles} cycles ({watcher.late_cycles} late). "
+          f"{watcher.total_text()}")
+    return 0